@@ -2,8 +2,14 @@ from fastapi import APIRouter
 from .v1.navigation import router as nav_router
 from .v1.weather import router as weather_router
 from .v1.parking import router as parking_router
+from .v1.facilities import router as facilities_router
+from .v1.tiles import router as tiles_router
+from .v1.parks import router as parks_router
 
 api_router = APIRouter()
 api_router.include_router(nav_router)
 api_router.include_router(weather_router)
 api_router.include_router(parking_router)
+api_router.include_router(facilities_router)
+api_router.include_router(tiles_router)
+api_router.include_router(parks_router)
@@ -0,0 +1,283 @@
+from fastapi import APIRouter, Depends, Query, Request, Response, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from typing import List, Optional, Sequence, Tuple
+import base64
+import datetime
+from app.database import get_db
+from app.services.facility_geojson import facility_collection_json, FACILITY_PROPERTIES, FILTER_PROPERTIES
+from app.services.facility_snapshot import get_facility_snapshot
+from app.services.facility_proximity import get_proximity_graph
+from app.services.facility_search import get_facility_search_index
+from app.services.opening_hours import get_opening_hours_index, minute_of_day, now_minute, MINUTES_PER_DAY
+
+router = APIRouter(prefix="/facilities", tags=["facilities"])
+
+def _category_list(categories: Optional[str]):
+    return [c.strip() for c in categories.split(',') if c.strip()] if categories else []
+
+def _parse_bbox(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    if not bbox:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(422, "bbox must be min_lon,min_lat,max_lon,max_lat")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(422, "bbox minimums must not exceed maximums")
+    return min_lon, min_lat, max_lon, max_lat
+
+def _parse_fields(fields: Optional[str], default: Sequence[str]) -> Sequence[str]:
+    """Requested GeoJSON properties, objectid always first."""
+    if not fields:
+        return default
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in FACILITY_PROPERTIES]
+    if unknown:
+        raise HTTPException(422, f"Unknown fields: {', '.join(unknown)}")
+    return ["objectid"] + [f for f in dict.fromkeys(names) if f != "objectid"]
+
+def _parse_hhmm(value: str) -> int:
+    try:
+        return minute_of_day(datetime.datetime.strptime(value, "%H:%M").time())
+    except ValueError:
+        raise HTTPException(422, f"Expected HH:MM, got '{value}'")
+
+def _hours_filter(open_now: bool, open_at: Optional[str], closing_within: Optional[int]) -> Optional[List[int]]:
+    """
+    objectids matching the opening-hours filters, or None when no filter was asked for.
+    open_at (HH:MM, Singapore time) overrides "now" for both filters.
+    """
+    if not open_now and open_at is None and closing_within is None:
+        return None
+    index = get_opening_hours_index()
+    if index is None:
+        raise HTTPException(503, "Opening hours are not loaded yet")
+    minute = _parse_hhmm(open_at) if open_at is not None else now_minute()
+    if closing_within is not None:
+        rows, _ = index.closing_within(minute, closing_within)
+    else:
+        rows = index.open_at(minute).nonzero()[0]
+    return index.objectids[rows].tolist()
+
+BBOX_DESCRIPTION = "min_lon,min_lat,max_lon,max_lat - only facilities inside this box"
+FIELDS_DESCRIPTION = "Comma-separated properties to return (objectid is always included)"
+LIMIT_DESCRIPTION = "Page size; the response carries next_cursor while more rows follow"
+AFTER_DESCRIPTION = "next_cursor from the previous page"
+
+
+@router.get("/all_facilities")
+async def facilities(
+    request: Request,
+    bbox: Optional[str] = Query(None, description=BBOX_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description=LIMIT_DESCRIPTION),
+    after: Optional[int] = Query(None, description=AFTER_DESCRIPTION),
+    precision: Optional[int] = Query(None, ge=0, le=15, description="Decimal places for coordinates"),
+    db=Depends(get_db)
+):
+    """
+    Every facility as GeoJSON. Served from a pre-serialised, pre-compressed snapshot
+    that is rebuilt only when park_facilities changes; send If-None-Match to get a 304.
+
+    With bbox / fields / limit / after / precision the collection is built for that
+    request instead, reading only the rows and columns asked for.
+    Example: /v1/facilities/all_facilities?bbox=103.94,1.37,103.96,1.39&fields=class,name_left&limit=200
+    """
+    if any(p is not None for p in (bbox, fields, limit, after, precision)):
+        body = await facility_collection_json(
+            db, _parse_fields(fields, tuple(FACILITY_PROPERTIES)), precision=precision,
+            bbox=_parse_bbox(bbox), limit=limit, after=after,
+        )
+        return Response(content=body, media_type="application/json")
+
+    snapshot = await get_facility_snapshot()
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": "public, max-age=0, must-revalidate",
+        "Vary": "Accept-Encoding",
+    }
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+
+    encoding = snapshot.negotiate(request.headers.get("accept-encoding", ""))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=snapshot.bodies[encoding], media_type="application/json", headers=headers)
+
+
+@router.get("/filter")
+async def filter_facilities(
+    categories: str = Query(..., description="Comma-separated list of facility categories (class_name) to filter by"),
+    open_now: bool = False,
+    open_at: Optional[str] = Query(None, description="Only facilities open at this HH:MM (Singapore time)"),
+    closing_within: Optional[int] = Query(None, ge=0, le=MINUTES_PER_DAY, description="Only facilities closing within N minutes"),
+    bbox: Optional[str] = Query(None, description=BBOX_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description=LIMIT_DESCRIPTION),
+    after: Optional[int] = Query(None, description=AFTER_DESCRIPTION),
+    precision: Optional[int] = Query(None, ge=0, le=15, description="Decimal places for coordinates"),
+    db=Depends(get_db)
+):
+    category_list = _category_list(categories)
+    objectids = _hours_filter(open_now, open_at, closing_within)
+    body = await facility_collection_json(
+        db, _parse_fields(fields, FILTER_PROPERTIES), categories=category_list, objectids=objectids,
+        precision=precision, bbox=_parse_bbox(bbox), limit=limit, after=after,
+    )
+    return Response(content=body, media_type="application/json")
+
+
+
+@router.get("/nearest")
+async def nearest_facilities(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    categories: Optional[str] = Query(None, description="Comma-separated class names to include"),
+    k: int = Query(5, ge=1, le=100),
+    open_now: bool = False,
+    open_at: Optional[str] = Query(None, description="Only facilities open at this HH:MM (Singapore time)"),
+    closing_within: Optional[int] = Query(None, ge=0, le=MINUTES_PER_DAY),
+    db=Depends(get_db)
+):
+    """
+    The k facilities closest to (lat, lon), nearest first.
+    Example: /v1/facilities/nearest?lat=1.3806&lon=103.9560&categories=TOILET,F%26B&k=3&open_now=true
+
+    Candidates are ordered with the KNN operator (<->) on the raw 4326 geom column,
+    so the GiST index walks only as far as it needs; the exact metre distance is then
+    computed for those few rows only.
+    """
+    where = ["geom IS NOT NULL"]   # NULLs sort last in the KNN order and have no distance
+    params = {"lat": lat, "lon": lon, "candidates": k + 10, "k": k}
+    category_list = _category_list(categories)
+    if category_list:
+        where.append("class = ANY(:categories)")
+        params["categories"] = category_list
+    objectids = _hours_filter(open_now, open_at, closing_within)
+    if objectids is not None:
+        where.append("objectid = ANY(:objectids)")
+        params["objectids"] = objectids
+
+    sql = text(f"""
+        SELECT objectid, class, name_left, name_right, additional_info,
+               to_char(hours_open, 'HH24:MI') AS hours_open,
+               to_char(hours_close, 'HH24:MI') AS hours_close,
+               ST_X(geom) AS lon, ST_Y(geom) AS lat,
+               ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography) AS distance_m
+        FROM (
+            SELECT *
+            FROM park_facilities
+            WHERE {" AND ".join(where)}
+            ORDER BY geom <-> ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)
+            LIMIT :candidates
+        ) candidates
+        ORDER BY distance_m
+        LIMIT :k;
+    """)
+    rows = (await db.execute(sql, params)).mappings().all()
+    return {
+        "origin": {"lat": lat, "lon": lon},
+        "results": [{
+            "objectid": r["objectid"],
+            "class": r["class"],
+            "name_left": r["name_left"],
+            "name_right": r["name_right"],
+            "additional_info": r["additional_info"],
+            "hours": {"open": r["hours_open"], "close": r["hours_close"]}
+                     if r["hours_open"] or r["hours_close"] else None,
+            "lat": r["lat"],
+            "lon": r["lon"],
+            "distance_meters": round(r["distance_m"], 1),
+        } for r in rows],
+    }
+
+
+
+@router.get("/search")
+async def search_facilities(
+    q: str = Query(..., min_length=1, max_length=100),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Typo-tolerant search over facility names, cuisine, activities and service options.
+    Example: /v1/facilities/search?q=prata&lat=1.3806&lon=103.9560
+
+    Matches prefixes ("toil") and near misses ("resturant"); with lat/lon, closer
+    facilities get a boost.
+    """
+    index = get_facility_search_index()
+    if index is None:
+        raise HTTPException(503, "Facility search index is not loaded yet")
+    return {"query": q, "results": index.search(q, limit=limit, lat=lat, lon=lon)}
+
+
+@router.get("/{objectid}/nearby")
+async def nearby_facilities(
+    objectid: int,
+    categories: Optional[str] = Query(None, description="Comma-separated class names to include"),
+    k: Optional[int] = Query(None, ge=1, description="Neighbours per category (at most the precomputed k)")
+):
+    """
+    Facilities near another facility, per category, nearest walk first.
+    Example: /v1/facilities/42/nearby?categories=TOILET,SHELTER&k=3
+
+    Read straight from the precomputed proximity graph (also materialised in the
+    facility_proximity table); nothing spatial is computed per request.
+    """
+    graph = get_proximity_graph()
+    if graph is None:
+        raise HTTPException(503, "Facility proximity graph is not loaded yet")
+    nearby = graph.nearby(objectid, _category_list(categories), k)
+    if nearby is None:
+        raise HTTPException(404, f"Facility {objectid} not found")
+    return {"objectid": objectid, "nearby": nearby}
+
+
+@router.get("/hours/status")
+async def opening_hours_status(
+    at: Optional[str] = Query(None, description="HH:MM Singapore time; defaults to now"),
+    closing_within: int = Query(30, ge=0, le=MINUTES_PER_DAY)
+):
+    """Which facilities are open at a time, and which of those close soon."""
+    index = get_opening_hours_index()
+    if index is None:
+        raise HTTPException(503, "Opening hours are not loaded yet")
+    minute = _parse_hhmm(at) if at is not None else now_minute()
+    open_rows = index.open_at(minute).nonzero()[0]
+    soon_rows, minutes_left = index.closing_within(minute, closing_within)
+    return {
+        "at": f"{minute // 60:02d}:{minute % 60:02d}",
+        "open": index.objectids[open_rows].tolist(),
+        "closing_soon": [
+            {"objectid": int(oid), "minutes_until_close": int(left)}
+            for oid, left in zip(index.objectids[soon_rows].tolist(), minutes_left.tolist())
+        ],
+    }
+
+
+@router.get("/hours/bitmap")
+async def opening_hours_bitmap(request: Request):
+    """
+    Per-minute open/closed state of every facility for the whole day, for clients to
+    cache and look up locally. bitmap is base64 of 1440 rows of bytes_per_minute bytes;
+    within a row, facility i (in objectids order) is bit (7 - i % 8) of byte i // 8.
+    """
+    index = get_opening_hours_index()
+    if index is None:
+        raise HTTPException(503, "Opening hours are not loaded yet")
+    etag = index.etag()
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=0, must-revalidate"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    bitmap = index.minute_bitmap()
+    payload = {
+        "objectids": index.objectids.tolist(),
+        "minutes": MINUTES_PER_DAY,
+        "bytes_per_minute": bitmap.shape[1],
+        "timezone": "Asia/Singapore",
+        "bitmap": base64.b64encode(bitmap.tobytes()).decode(),
+    }
+    return JSONResponse(payload, headers=headers)
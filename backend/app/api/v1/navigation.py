@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Query
-from app.services.routing_service import shortest_path
+from fastapi import APIRouter, Query, HTTPException, Response
+from typing import List, Tuple
+from app.config.settings import settings
+from app.services.isochrones import get_isochrone_index, walking_isochrone
+from app.services.routing_service import shortest_path, route_cache, walking_matrix
 
 router = APIRouter(prefix="/navigation", tags=["navigation"])
 
@@ -20,3 +23,90 @@ async def get_route(
         end=(end_lat, end_lon),
         prefer_shelter=prefer_shelter
     )
+
+
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_DESTINATIONS = 500
+
+def _parse_points(raw: str, name: str) -> List[Tuple[float, float]]:
+    """'lat,lon;lat,lon' -> [(lat, lon), ...]"""
+    points = []
+    for pair in raw.split(";"):
+        if not pair.strip():
+            continue
+        try:
+            lat, lon = (float(v) for v in pair.split(","))
+        except ValueError:
+            raise HTTPException(422, f"{name}: expected 'lat,lon;lat,lon', got '{pair}'")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise HTTPException(422, f"{name}: coordinate out of range '{pair}'")
+        points.append((lat, lon))
+    if not points:
+        raise HTTPException(422, f"{name}: at least one coordinate is required")
+    return points
+
+@router.get("/matrix")
+async def get_matrix(
+    origins: str = Query(..., description="Semicolon-separated 'lat,lon' pairs"),
+    destinations: str = Query(..., description="Semicolon-separated 'lat,lon' pairs"),
+    prefer_shelter: bool = False
+):
+    """
+    Walking distance/duration from each origin to each destination, in input order.
+    Example:
+    /v1/navigation/matrix?origins=1.3806,103.9560&destinations=1.3739,103.9539;1.3790,103.9520
+    """
+    origin_points = _parse_points(origins, "origins")
+    destination_points = _parse_points(destinations, "destinations")
+    if len(origin_points) > MATRIX_MAX_ORIGINS or len(destination_points) > MATRIX_MAX_DESTINATIONS:
+        raise HTTPException(
+            422, f"At most {MATRIX_MAX_ORIGINS} origins and {MATRIX_MAX_DESTINATIONS} destinations per request."
+        )
+    return await walking_matrix(origin_points, destination_points, prefer_shelter=prefer_shelter)
+
+
+ISOCHRONE_MAX_BANDS = 4
+
+def _parse_minutes(raw: str) -> List[float]:
+    """'5' or '5,10,15' -> [5.0, 10.0, 15.0]"""
+    try:
+        bands = [float(v) for v in raw.split(",") if v.strip()]
+    except ValueError:
+        raise HTTPException(422, f"minutes: expected numbers separated by commas, got '{raw}'")
+    if not bands or len(bands) > ISOCHRONE_MAX_BANDS:
+        raise HTTPException(422, f"minutes: between 1 and {ISOCHRONE_MAX_BANDS} values are required")
+    if any(not 0 < m <= settings.isochrone_max_minutes for m in bands):
+        raise HTTPException(422, f"minutes: each value must be in (0, {settings.isochrone_max_minutes:g}]")
+    return bands
+
+@router.get("/isochrone")
+async def get_isochrone(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    minutes: str = Query("5", description="Walking minutes, or comma-separated bands e.g. 5,10,15"),
+    prefer_shelter: bool = False
+):
+    """
+    Area reachable on foot within `minutes`, as GeoJSON polygons (one per band, largest
+    first). With prefer_shelter, exposed path counts settings.rain_penalty times its length.
+    Origins at MRT exits, carparks and facilities are served from precomputed polygons.
+    Example:
+    /v1/navigation/isochrone?lat=1.3806&lon=103.9560&minutes=5,10&prefer_shelter=true
+    """
+    body = await walking_isochrone((lat, lon), _parse_minutes(minutes), prefer_shelter)
+    return Response(content=body, media_type="application/json")
+
+
+@router.get("/isochrone/cache-stats")
+async def get_isochrone_cache_stats():
+    """Precomputed and on-demand isochrone counts and hit rate for this worker."""
+    index = get_isochrone_index()
+    if index is None:
+        raise HTTPException(503, "Walk graph unavailable")
+    return index.stats()
+
+
+@router.get("/cache-stats")
+async def get_route_cache_stats():
+    """Hit/miss counters for this worker's route cache."""
+    return route_cache.stats()
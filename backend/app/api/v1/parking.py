@@ -9,34 +9,14 @@ from math import radians, sin, cos, sqrt, atan2
 import asyncio
 from functools import lru_cache
 import time
+from app.services.carpark_ingest import ingest_metrics
+from app.services.carpark_history import carpark_history
+from app.services.carpark_service import carpark_service
+from app.services.park_registry import get_park_registry
+from app.api.v1.parks import PARK_DESCRIPTION, resolve_park
 
 router = APIRouter(prefix="/parking", tags=["parking"])
 
-# Cache for carpark data (30 minutes TTL)
-carpark_cache = {
-    "data": None,
-    "timestamp": None,
-    "ttl": timedelta(minutes=30)
-}
-
-# MRT Exit Information for Pasir Ris - to store in DB
-MRT_EXITS = [
-    {
-        "exit": "A",
-        "name": "Pasir Ris MRT Exit A",
-        "lat": 1.372842,
-        "lon": 103.949333,
-        "description": "To Pasir Ris Park"
-    },
-    {
-        "exit": "B",
-        "name": "Pasir Ris MRT Exit B",
-        "lat": 1.372886,
-        "lon": 103.949137,
-        "description": "To White Sands"
-    }
-]
-
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two points in meters using Haversine formula"""
     R = 6371000  # Earth's radius in meters
@@ -52,66 +32,13 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     return R * c
 
 async def fetch_carpark_availability():
-    """Fetch carpark availability from LTA DataMall API"""
-    global carpark_cache
-    
-    # Check cache
-    if carpark_cache["data"] and carpark_cache["timestamp"]:
-        if datetime.now() - carpark_cache["timestamp"] < carpark_cache["ttl"]:
-            return carpark_cache["data"]
-    
+    """Current carpark snapshot, refreshed in the background by carpark_service."""
     try:
-        api_key = os.getenv("LTA_API_KEY")
-        if not api_key:
-            print("ERROR: LTA_API_KEY not found in environment variables")
-            raise HTTPException(status_code=500, detail="LTA API key not configured")
-        
-        url = "https://datamall2.mytransport.sg/ltaodataservice/CarParkAvailabilityv2"
-        headers = {
-            "AccountKey": api_key,
-            "Accept": "application/json"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, timeout=10)
-            
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch carpark data from LTA")
-        
-        data = response.json()
-        records = data.get("value", [])
-        
-        # Filter for Pasir Ris carparks using string search
-        pasir_ris_carparks = []
-        for record in records:
-            if "PASIR RIS" in record.get("Development", "").upper():
-                # Parse location string "lat lon" format
-                location_parts = record.get("Location", "").split()
-                if len(location_parts) >= 2:
-                    try:
-                        lat = float(location_parts[0])
-                        lon = float(location_parts[1])
-                        
-                        pasir_ris_carparks.append({
-                            "carpark_id": record.get("CarParkID"),
-                            "available_lots": int(record.get("AvailableLots", 0)),
-                            "lot_type": record.get("LotType"),
-                            "agency": record.get("Agency"),
-                            "development": record.get("Development"),
-                            "lat": lat,
-                            "lon": lon
-                        })
-                    except (ValueError, IndexError):
-                        continue
-        
-        # Update cache
-        carpark_cache["data"] = pasir_ris_carparks
-        carpark_cache["timestamp"] = datetime.now()
-        
-        return pasir_ris_carparks
-        
+        return await carpark_service.get()
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout fetching carpark data")
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail="Failed to fetch carpark data from LTA")
     except Exception as e:
         print(f"Error fetching carpark data: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching carpark data: {str(e)}")
@@ -120,62 +47,30 @@ async def fetch_carpark_availability():
 async def get_carpark_availability(
     user_lat: float = Query(..., description="User's current latitude"),
     user_lon: float = Query(..., description="User's current longitude"),
-    limit: int = Query(5, description="Number of carparks to return")
+    limit: int = Query(5, description="Number of carparks to return"),
+    park: Optional[str] = Query(None, description=PARK_DESCRIPTION),
 ):
     """
-    Get nearby Pasir Ris carpark availability with real-time lot information
+    Get availability of the carparks serving a park, with real-time lot information.
+    Carparks are ranked by the lots expected when the user arrives
+    (predicted_lots_at_arrival), forecast from their occupancy history.
     """
+    info = resolve_park(park)
     try:
-        # Fetch carpark data
-        carparks = await fetch_carpark_availability()
-        
-        # Group by carpark_id and aggregate lots by type
-        carpark_dict = {}
-        for cp in carparks:
-            cp_id = cp["carpark_id"]
-            if cp_id not in carpark_dict:
-                carpark_dict[cp_id] = {
-                    "carpark_id": cp_id,
-                    "development": cp["development"],
-                    "agency": cp["agency"],
-                    "lat": cp["lat"],
-                    "lon": cp["lon"],
-                    "lots_by_type": {},
-                    "total_available": 0
-                }
-            
-            # Add lots by type
-            lot_type = cp["lot_type"]
-            carpark_dict[cp_id]["lots_by_type"][lot_type] = cp["available_lots"]
-            carpark_dict[cp_id]["total_available"] += cp["available_lots"]
-        
-        # Calculate distances and prepare response
-        result_carparks = []
-        for cp_id, cp_data in carpark_dict.items():
-            distance = calculate_distance(
-                user_lat, user_lon,
-                cp_data["lat"], cp_data["lon"]
-            )
-            
-            result_carparks.append({
-                "carpark_id": cp_data["carpark_id"],
-                "development": cp_data["development"],
-                "agency": cp_data["agency"],
-                "lat": cp_data["lat"],
-                "lon": cp_data["lon"],
-                "distance_meters": round(distance),
-                "lots_by_type": cp_data["lots_by_type"],
-                "total_available": cp_data["total_available"],
-                "recommendation_score": cp_data["total_available"] / (distance / 100) if distance > 0 else 0
-            })
-        
-        # Sort by recommendation score (balances availability and distance)
-        result_carparks.sort(key=lambda x: x["recommendation_score"], reverse=True)
-        
+        # Read the ready snapshot; no upstream call on the request path
+        snapshot = await fetch_carpark_availability()
+
+        # Grouped once per refresh (and per park per snapshot); this is a vectorised
+        # distance, forecast and top-k over the park's carparks.
+        rows = get_park_registry().carpark_rows(info, snapshot)
+        carparks = snapshot.rank(user_lat, user_lon, limit, predictor=carpark_history.predict, rows=rows)
+
         return {
-            "carparks": result_carparks[:limit],
+            "park": info.slug,
+            "carparks": carparks,
             "timestamp": datetime.now(pytz.timezone("Asia/Singapore")).isoformat(),
-            "cache_age_minutes": (datetime.now() - carpark_cache["timestamp"]).total_seconds() / 60 if carpark_cache["timestamp"] else None
+            "cache_age_minutes": snapshot.age_s() / 60,
+            "is_stale": carpark_service.is_stale(),
         }
         
     except HTTPException:
@@ -184,16 +79,22 @@ async def get_carpark_availability(
         print(f"Error in get_carpark_availability: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/carparks/ingest-metrics")
+async def get_carpark_ingest_metrics():
+    """Pages, bytes, records and throughput of the last LTA carpark ingestion."""
+    return dict(ingest_metrics.as_dict(), last_refresh_error=carpark_service.last_error)
+
 @router.get("/mrt-exits")
 async def get_mrt_exits(
     user_lat: Optional[float] = None,
-    user_lon: Optional[float] = None
+    user_lon: Optional[float] = None,
+    park: Optional[str] = Query(None, description=PARK_DESCRIPTION),
 ):
     """
-    Get Pasir Ris MRT exit information
+    Get the MRT exits serving a park
     """
     exits = []
-    for exit_info in MRT_EXITS:
+    for exit_info in get_park_registry().mrt_exits(resolve_park(park)):
         exit_data = exit_info.copy()
         
         # Calculate distance if user location provided
@@ -217,7 +118,8 @@ async def get_navigation_to_park(
     start_lat: float = Query(...),
     start_lon: float = Query(...),
     destination_type: str = Query(..., regex="^(mrt|carpark)$"),
-    destination_id: Optional[str] = None
+    destination_id: Optional[str] = None,
+    park: Optional[str] = Query(None, description=PARK_DESCRIPTION),
 ):
     """
     Get navigation to MRT exit or carpark from user's location
@@ -227,7 +129,7 @@ async def get_navigation_to_park(
     
     if destination_type == "mrt":
         # Find the closest MRT exit if not specified
-        exits_response = await get_mrt_exits(start_lat, start_lon)
+        exits_response = await get_mrt_exits(start_lat, start_lon, park)
         mrt_exits = exits_response["mrt_exits"]
         
         if destination_id:
@@ -238,8 +140,9 @@ async def get_navigation_to_park(
             
     else:  # carpark
         # Get recommended carpark
-        carparks_response = await get_carpark_availability(start_lat, start_lon, limit=1)
-        carparks = carparks_response["carparks"]
+        snapshot = await fetch_carpark_availability()
+        rows = get_park_registry().carpark_rows(resolve_park(park), snapshot)
+        carparks = snapshot.rank(start_lat, start_lon, 1, predictor=carpark_history.predict, rows=rows)
         destination = carparks[0] if carparks else None
     
     if not destination:
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, Query, HTTPException
+from typing import Optional
+
+from app.services.park_registry import ParkInfo, get_park_registry
+from app.services.weather_store import weather_store
+
+router = APIRouter(prefix="/parks", tags=["parks"])
+
+PARK_DESCRIPTION = "Park slug (e.g. pasir-ris-pk) or NParks NAME; defaults to the configured park"
+
+# Dataset whose metadata names each kind of weather location
+WEATHER_LOOKUPS = {
+    "weather_station": "air-temperature",
+    "wind_station": "wind-speed",
+    "psi_region": "psi",
+    "forecast_area": "two-hr-forecast",
+}
+
+
+def resolve_park(park: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None) -> ParkInfo:
+    """
+    The park a request is about: the named one (404 if unknown), else the one at
+    (lat, lon) when given and inside a park, else settings.park_name.
+    """
+    registry = get_park_registry()
+    if park:
+        info = registry.get(park)
+        if info is None:
+            raise HTTPException(status_code=404, detail=f"Unknown park: {park}")
+        return info
+    if lat is not None and lon is not None:
+        info = registry.resolve(lat, lon)
+        if info is not None:
+            return info
+    info = registry.default()
+    if info is None:
+        raise HTTPException(status_code=503, detail="Park registry unavailable")
+    return info
+
+
+def _lookups(park: ParkInfo) -> dict:
+    """Per-park weather locations from the payloads already cached; None until a dataset is fetched."""
+    registry = get_park_registry()
+    out = {}
+    for field, dataset in WEATHER_LOOKUPS.items():
+        entry = weather_store.entries.get(dataset)
+        out[field] = registry.nearest(dataset, entry.payload, park) if entry is not None else None
+    out["mrt_exits"] = registry.mrt_exits(park)
+    return out
+
+
+@router.get("")
+async def list_parks(
+    q: Optional[str] = Query(None, description="Case-insensitive substring of the park name"),
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Registered parks, largest first."""
+    parks = get_park_registry().parks
+    if q:
+        needle = q.upper()
+        parks = [p for p in parks if needle in p.name.upper()]
+    parks = sorted(parks, key=lambda p: -p.area_m2)
+    return {"total": len(parks), "parks": [p.as_dict() for p in parks[offset:offset + limit]]}
+
+
+@router.get("/resolve")
+async def resolve_park_at(
+    lat: float = Query(...),
+    lon: float = Query(...),
+):
+    """
+    The park at a coordinate (or within park_resolve_m of one), with its nearest
+    weather station, PSI region, forecast area and MRT exits.
+    """
+    park = get_park_registry().resolve(lat, lon)
+    if park is None:
+        raise HTTPException(status_code=404, detail="No park at this location")
+    return dict(park.as_dict(), **_lookups(park))
+
+
+@router.get("/{park}")
+async def get_park(park: str):
+    info = resolve_park(park)
+    return dict(info.as_dict(), **_lookups(info))
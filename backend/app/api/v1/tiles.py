@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from app.services.vector_tiles import LAYERS, layer_version, render_tile, tile_cache
+
+router = APIRouter(prefix="/tiles", tags=["tiles"])
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+@router.get("/{layer}/{z}/{x}/{y}.mvt")
+async def get_tile(layer: str, z: int, x: int, y: int, request: Request):
+    """
+    Mapbox Vector Tile for one layer ('facilities' or 'covered_linkways').
+    Example: /v1/tiles/facilities/16/51691/32516.mvt
+    The ETag is the layer's data version, so clients revalidate and get a 304 until it changes.
+    """
+    if layer not in LAYERS:
+        raise HTTPException(404, f"Unknown layer '{layer}'. Available: {', '.join(LAYERS)}")
+    if z < 0 or z > 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(400, "Tile coordinates out of range")
+
+    etag = f'"{layer_version(layer)[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=0, must-revalidate"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    tile = await render_tile(layer, z, x, y)
+    if not tile:
+        return Response(status_code=204, headers=headers)
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE, headers=headers)
+
+
+@router.get("/cache-stats")
+async def get_tile_cache_stats():
+    return tile_cache.stats()
@@ -1,28 +1,71 @@
+import asyncio
 import datetime
 import pytz
-import httpx
 import math
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Response
+from app.config.settings import settings
+from app.services.upstream import get_upstream
+from app.services.feels_like_grid import feels_like_grid
+from app.services.park_registry import get_park_registry
+from app.services.weather_history import weather_history, SERIES_DATASETS
+from app.services.weather_store import weather_store
+from app.api.v1.parks import PARK_DESCRIPTION, resolve_park
 
 router = APIRouter(tags=["weather"])
-BASE_URL = "https://api-open.data.gov.sg/v2/real-time/api"
+BASE_URL = "/v2/real-time/api"   # relative to the pooled data.gov.sg upstream
 
-def _get_date_str_with_fallback():
+async def _get(url, **kwargs):
+    return await get_upstream("datagov").get(url, **kwargs)
+
+async def _get_json(url, **kwargs):
+    res = await asyncio.wait_for(_get(url, **kwargs), timeout=settings.weather_call_timeout_s)
+    res.raise_for_status()
+    return res.json()
+
+async def _fetch_all(requests):
     """
-    Returns the appropriate date string for API calls.
-    During midnight to 5am, uses previous day's date due to API downtime.
-    Returns tuple: (date_str, is_fallback)
+    Issue every {name: (url, params)} request at once. Returns (payloads, errors):
+    a dataset that fails or outlives weather_call_timeout_s lands in errors instead
+    of failing the others, so a response costs the slowest call, not the sum.
     """
-    sgt = pytz.timezone("Asia/Singapore")
-    now = datetime.datetime.now(tz=sgt)
-    
-    # Check if current time is between midnight and 5am
-    if 0 <= now.hour < 5:
-        # Use previous day's date
-        yesterday = now - datetime.timedelta(days=1)
-        return yesterday.strftime("%Y-%m-%d"), True
-    else:
-        return now.strftime("%Y-%m-%d"), False
+    names = list(requests)
+    results = await asyncio.gather(
+        *(_get_json(url, params=params) for url, params in requests.values()),
+        return_exceptions=True,
+    )
+    payloads, errors = {}, {}
+    for name, result in zip(names, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors[name] = "timed out"
+        elif isinstance(result, Exception):
+            errors[name] = str(result) or type(result).__name__
+        else:
+            payloads[name] = result
+    return payloads, errors
+
+FALLBACK_REASON = "Using previous day's data due to API downtime (12am-5am)"
+
+def _freshness(entries):
+    """Data age fields for a response built from weather_store entries."""
+    oldest = min(e.fetched_at for e in entries.values())
+    return {
+        "fetched_at": datetime.datetime.fromtimestamp(oldest, tz=pytz.timezone("Asia/Singapore")).isoformat(),
+        "data_age_seconds": round(max(e.age_s() for e in entries.values()), 1),
+        "is_stale": any(weather_store.is_stale(name) for name in entries),
+    }
+
+async def _dataset_response(name):
+    """Latest snapshot of one dataset, as data.gov.sg returned it, plus data age."""
+    try:
+        entry = await weather_store.get(name)
+    except Exception:
+        raise HTTPException(status_code=502, detail=f"{name} unavailable: {weather_store.errors.get(name)}")
+    response = dict(entry.payload)   # never mutate the shared snapshot
+    response.update(_freshness({name: entry}))
+    if entry.is_fallback:
+        response["is_fallback_data"] = True
+        response["fallback_reason"] = FALLBACK_REASON
+    return response
 
 def _latest_map_from(payload):
     try:
@@ -73,150 +116,174 @@ def _single_station_record(stations, sid):
     return []
 
 @router.get("/weather/now")
-def weather_now():
-    date_str, is_fallback = _get_date_str_with_fallback()
-    url = f"{BASE_URL}/two-hr-forecast?date={date_str}"
-    response = httpx.get(url, timeout=5).json()
-    
-    # Add fallback indicator to response
-    if is_fallback:
-        response["is_fallback_data"] = True
-        response["fallback_reason"] = "Using previous day's data due to API downtime (12am-5am)"
-    
-    return response
+async def weather_now():
+    return await _dataset_response("two-hr-forecast")
 
 @router.get("/weather/wind-speed-now")
-def wind_speed_now():
-    date_str, is_fallback = _get_date_str_with_fallback()
-    url = f"{BASE_URL}/wind-speed?date={date_str}"
-    response = httpx.get(url, timeout=5).json()
-    
-    if is_fallback:
-        response["is_fallback_data"] = True
-        response["fallback_reason"] = "Using previous day's data due to API downtime (12am-5am)"
-    
-    return response
+async def wind_speed_now():
+    return await _dataset_response("wind-speed")
 
 @router.get("/weather/psi-now")
-def psi_now():
-    date_str, is_fallback = _get_date_str_with_fallback()
-    url = f"{BASE_URL}/psi?date={date_str}"
-    response = httpx.get(url, timeout=5).json()
-    
-    if is_fallback:
-        response["is_fallback_data"] = True
-        response["fallback_reason"] = "Using previous day's data due to API downtime (12am-5am)"
-    
-    return response
+async def psi_now():
+    return await _dataset_response("psi")
+
+@router.get("/weather/status")
+async def weather_status():
+    """Age, staleness and last poll error of every cached weather dataset."""
+    return weather_store.status()
+
+def _parse_24hr(forecast_data_24hr):
+    general_24 = (forecast_data_24hr.get("data", {})
+                                 .get("records", [{}])[0]
+                                 .get("general", {}))
+    return general_24.get("temperature", {}), general_24.get("relativeHumidity", {})
+
+def _parse_2hr(forecast_data_2hr, area):
+    item_2hr = (forecast_data_2hr.get("data", {}).get("items") or [{}])[0]
+    area_forecasts = item_2hr.get("forecasts") or []
+    pr = next((f for f in area_forecasts if f.get("area", "").lower() == area), None)
+    cond_text = (pr or (area_forecasts[0] if area_forecasts else {})).get("forecast")
+    return {"text": cond_text, "code": None}
+
+def _parse_wind_knots(wind_data, station):
+    try:
+        for reading in wind_data["data"]["readings"]:
+            for r in reading["data"]:
+                if r.get("stationId") == station:
+                    return float(r["value"])
+    except Exception:
+        pass
+    return None
+
+def _parse_psi_region(psi_data, region):
+    psi_reading = psi_data["data"]["items"][0]["readings"]
+    return {
+        "psi_twenty_four_hourly": psi_reading["psi_twenty_four_hourly"][region],
+        "pm25_sub_index": psi_reading["pm25_sub_index"][region],
+        "pm25_twenty_four_hourly": psi_reading["pm25_twenty_four_hourly"][region],
+    }
 
 @router.get("/weather/full")
-def full_weather_now():
+async def full_weather_now(
+    park: str | None = Query(default=None, description=PARK_DESCRIPTION),
+):
+    info = resolve_park(park)
     sgt = pytz.timezone("Asia/Singapore")
     now = datetime.datetime.now(tz=sgt)
-    date_str, is_fallback = _get_date_str_with_fallback()
+    entries, errors = await weather_store.get_many(
+        ["two-hr-forecast", "twenty-four-hr-forecast", "wind-speed", "psi"]
+    )
+    payloads = {name: e.payload for name, e in entries.items()}
+    if not payloads:
+        return {"error": "Failed to fetch combined weather data: " +
+                         "; ".join(f"{k}: {v}" for k, v in errors.items())}
 
-    try:
-        forecast_url_2hr = f"{BASE_URL}/two-hr-forecast?date={date_str}"
-        forecast_url_24hr = f"{BASE_URL}/twenty-four-hr-forecast?date={date_str}"
-        wind_url = f"{BASE_URL}/wind-speed?date={date_str}"
-        psi_url = f"{BASE_URL}/psi?date={date_str}"
-
-        forecast_res_2hr = httpx.get(forecast_url_2hr, timeout=5)
-        forecast_res_24hr = httpx.get(forecast_url_24hr, timeout=5)
-        wind_res = httpx.get(wind_url, timeout=5)
-        psi_res = httpx.get(psi_url, timeout=5)
-
-        forecast_data_2hr = forecast_res_2hr.json()
-        forecast_data_24hr = forecast_res_24hr.json()
-        wind_data = wind_res.json()
-        psi_data = psi_res.json()
-
-        general_24 = (forecast_data_24hr.get("data", {})
-                                     .get("records", [{}])[0]
-                                     .get("general", {}))
-        temperature = general_24.get("temperature", {})
-        humidity = general_24.get("relativeHumidity", {})
-
-        item_2hr = (forecast_data_2hr.get("data", {}).get("items") or [{}])[0]
-        area_forecasts = item_2hr.get("forecasts") or []
-        pr = next((f for f in area_forecasts if f.get("area", "").lower() == "pasir ris"), None)
-        cond_text = (pr or (area_forecasts[0] if area_forecasts else {})).get("forecast")
-        forecast = {"text": cond_text, "code": None}
-
-        wind_speed_knots = None
+    # Each dataset degrades on its own: a missing or malformed one leaves its fields None.
+    temperature, humidity = {}, {}
+    parsers = {
+        "twenty-four-hr-forecast": _parse_24hr,
+        "two-hr-forecast": _parse_2hr,
+        "wind-speed": _parse_wind_knots,
+        "psi": _parse_psi_region,
+    }
+    registry = get_park_registry()
+    parsed = {}
+    for name, parse in parsers.items():
+        if name not in payloads:
+            continue
         try:
-            for reading in wind_data["data"]["readings"]:
-                for r in reading["data"]:
-                    if r.get("stationId") == "S106":
-                        wind_speed_knots = float(r["value"])
-                        break
-                if wind_speed_knots is not None:
-                    break
-        except Exception:
-            wind_speed_knots = None
-        wind_speed_kmh = round(wind_speed_knots * 1.852, 1) if wind_speed_knots is not None else None
-
-        psi_reading = psi_data["data"]["items"][0]["readings"]
-        psi_east = {
-            "psi_twenty_four_hourly": psi_reading["psi_twenty_four_hourly"]["east"],
-            "pm25_sub_index": psi_reading["pm25_sub_index"]["east"],
-            "pm25_twenty_four_hourly": psi_reading["pm25_twenty_four_hourly"]["east"],
-        }
-
-        response = {
-            "timestamp": now.isoformat(),
-            "temperature": temperature.get("high"),
-            "tempLow": temperature.get("low"),
-            "condition": forecast.get("text"),
-            "conditionCode": forecast.get("code"),
-            "humidity": humidity.get("high"),
-            "windSpeed": wind_speed_kmh,
-            "windSpeedKnots": wind_speed_knots,
-            "psi": psi_east,
-        }
-        
-        # Add fallback indicator if using previous day's data
-        if is_fallback:
-            response["is_fallback_data"] = True
-            response["fallback_reason"] = "Data from previous day due to API downtime (12am-5am)"
-            response["data_date"] = date_str
-        
-        return response
+            if name == "twenty-four-hr-forecast":   # island-wide
+                parsed[name] = parse(payloads[name])
+            else:
+                parsed[name] = parse(payloads[name], registry.nearest(name, payloads[name], info))
+        except Exception as e:
+            errors[name] = f"unexpected schema: {e}"
+    if "twenty-four-hr-forecast" in parsed:
+        temperature, humidity = parsed["twenty-four-hr-forecast"]
+    forecast = parsed.get("two-hr-forecast", {})
+    wind_speed_knots = parsed.get("wind-speed")
+    psi = parsed.get("psi")
+    wind_speed_kmh = round(wind_speed_knots * 1.852, 1) if wind_speed_knots is not None else None
 
-    except Exception as e:
-        return {"error": f"Failed to fetch combined weather data: {str(e)}"}
+    response = {
+        "park": info.slug,
+        "timestamp": now.isoformat(),
+        "temperature": temperature.get("high"),
+        "tempLow": temperature.get("low"),
+        "condition": forecast.get("text"),
+        "conditionCode": forecast.get("code"),
+        "humidity": humidity.get("high"),
+        "windSpeed": wind_speed_kmh,
+        "windSpeedKnots": wind_speed_knots,
+        "psi": psi,
+    }
+    response.update(_freshness(entries))
+    if errors:
+        response["partial"] = True
+        response["unavailable"] = errors
+
+    # Add fallback indicator if using previous day's data
+    fallback = next((e for e in entries.values() if e.is_fallback), None)
+    if fallback is not None:
+        response["is_fallback_data"] = True
+        response["fallback_reason"] = "Data from previous day due to API downtime (12am-5am)"
+        response["data_date"] = fallback.date
+
+    return response
 
 @router.get("/feels-like")
-def feels_like(
+async def feels_like(
     date: str | None = Query(default=None),
-    lat: float = Query(default=1.3815),
-    lon: float = Query(default=103.9510),
+    lat: float | None = Query(default=None, description="Defaults to a point inside the park"),
+    lon: float | None = Query(default=None, description="Defaults to a point inside the park"),
+    park: str | None = Query(default=None, description=PARK_DESCRIPTION),
 ):
-    # If no date provided, use the fallback logic
+    names = ["air-temperature", "relative-humidity", "wind-speed"]
+    entries = None
     if date is None:
-        date, is_fallback = _get_date_str_with_fallback()
+        # Current readings come from the polled snapshot (with its own 12am-5am fallback).
+        entries, errors = await weather_store.get_many(names)
+        payloads = {name: e.payload for name, e in entries.items()}
+        fallback = next((e for e in entries.values() if e.is_fallback), None)
+        is_fallback = fallback is not None
+        if is_fallback:
+            date = fallback.date
     else:
+        # An explicit date is a historical query: go to data.gov.sg directly.
         is_fallback = False
-    
-    params = {"date": date}
+        params = {"date": date}
+        payloads, errors = await _fetch_all({name: (f"{BASE_URL}/{name}", params) for name in names})
 
-    air = httpx.get(f"{BASE_URL}/air-temperature", params=params, timeout=5).json()
-    rh = httpx.get(f"{BASE_URL}/relative-humidity", params=params, timeout=5).json()
-    wind = httpx.get(f"{BASE_URL}/wind-speed", params=params, timeout=5).json()
+    # Air temperature carries the station list and the base value; without it there is no answer.
+    if "air-temperature" not in payloads:
+        status = 504 if errors.get("air-temperature") == "timed out" else 502
+        raise HTTPException(status_code=status, detail=f"Air temperature unavailable: {errors.get('air-temperature')}")
 
+    air = payloads["air-temperature"]
     ts_air, t_map = _latest_map_from(air)
-    ts_rh, rh_map = _latest_map_from(rh)
-    ts_w, w_map = _latest_map_from(wind)
+    timestamps = [ts_air]
+    rh_map, w_map = {}, {}
+    if "relative-humidity" in payloads:
+        ts_rh, rh_map = _latest_map_from(payloads["relative-humidity"])
+        timestamps.append(ts_rh)
+    if "wind-speed" in payloads:
+        ts_w, w_map = _latest_map_from(payloads["wind-speed"])
+        timestamps.append(ts_w)
 
     stations = _stations_from(air)
-    sid = _nearest_station_id(stations, lat, lon)
+    if lat is None or lon is None:
+        # The park's station comes from a table built once per payload.
+        sid = get_park_registry().nearest("air-temperature", air, resolve_park(park))
+    else:
+        sid = _nearest_station_id(stations, lat, lon)
 
     t_c = t_map.get(sid)
     r = rh_map.get(sid)
     v_ms = w_map.get(sid)
 
+    # Missing humidity or wind falls back to the plain air temperature.
     at = _round1(_apparent_temperature_c(t_c, r, v_ms))
-    ts = max(ts_air, ts_rh, ts_w)
+    ts = max(timestamps)
 
     response = {
         "code": 0,
@@ -238,6 +305,11 @@ def feels_like(
             "readingUnit": "deg c",
         },
     }
+    if entries:
+        response.update(_freshness(entries))
+    if errors:
+        response["partial"] = True
+        response["unavailable"] = errors
     
     if is_fallback:
         response["is_fallback_data"] = True
@@ -246,10 +318,102 @@ def feels_like(
     
     return response
 
+@router.get("/weather/feels-like/grid")
+async def feels_like_grid_now(
+    park: str | None = Query(default=None, description=PARK_DESCRIPTION),
+):
+    """
+    Apparent temperature on a regular grid over the park, as GeoJSON points for a
+    heatmap layer. Air temperature, humidity and wind are interpolated from every
+    station (inverse distance weighting); the result is cached per reading timestamp.
+    """
+    info = resolve_park(park)
+    entries, errors = await weather_store.get_many(["air-temperature", "relative-humidity", "wind-speed"])
+    if "air-temperature" not in entries:
+        raise HTTPException(status_code=502, detail=f"Air temperature unavailable: {errors.get('air-temperature')}")
+    body = feels_like_grid.render(
+        info,
+        entries["air-temperature"].payload,
+        entries["relative-humidity"].payload if "relative-humidity" in entries else None,
+        entries["wind-speed"].payload if "wind-speed" in entries else None,
+    )
+    if body is None:
+        raise HTTPException(status_code=503, detail="Weather stations unavailable")
+    freshness = _freshness(entries)
+    return Response(content=body, media_type="application/json", headers={
+        "X-Data-Age-Seconds": str(freshness["data_age_seconds"]),
+        "X-Data-Stale": "true" if freshness["is_stale"] or errors else "false",
+    })
+
+def _check_dataset(dataset):
+    if dataset not in SERIES_DATASETS:
+        raise HTTPException(status_code=422, detail=f"dataset must be one of: {', '.join(SERIES_DATASETS)}")
+
+async def _park_stations(info, datasets):
+    """{dataset: the park's station / region / area}, from the cached payloads' metadata."""
+    entries, _ = await weather_store.get_many(datasets)
+    registry = get_park_registry()
+    return {name: registry.nearest(name, entry.payload, info) for name, entry in entries.items()}
+
+@router.get("/weather/history")
+async def weather_history_series(
+    dataset: str = Query(default="air-temperature"),
+    station: str | None = Query(default=None, description="Station id, PSI region or forecast area; defaults to the park's"),
+    hours: float = Query(default=24, gt=0, le=settings.weather_history_hours),
+    bucket_minutes: float = Query(default=15, gt=0, le=24 * 60),
+    park: str | None = Query(default=None, description=PARK_DESCRIPTION),
+):
+    """Recorded readings of one series, averaged into buckets. No upstream calls once polled."""
+    _check_dataset(dataset)
+    if station is None:
+        info = resolve_park(park)
+        station = (await _park_stations(info, [dataset])).get(dataset)
+        if station is None:
+            raise HTTPException(status_code=503, detail=f"No {dataset} station known for {info.slug} yet")
+    return {
+        "dataset": dataset,
+        "station": station,
+        "hours": hours,
+        "bucket_minutes": bucket_minutes,
+        "series": weather_history.downsample(dataset, station, hours, bucket_minutes * 60),
+    }
+
+@router.get("/weather/trend")
+async def weather_trend(
+    hours: float = Query(default=3, gt=0, le=settings.weather_history_hours),
+    park: str | None = Query(default=None, description=PARK_DESCRIPTION),
+):
+    """
+    Is it getting hotter, more humid, windier or hazier near the park? Least-squares
+    slope per hour of each park series over the last `hours`, plus how the 2-hour
+    forecast text changed.
+    """
+    info = resolve_park(park)
+    stations = await _park_stations(info, SERIES_DATASETS)
+    trends = {}
+    for dataset in SERIES_DATASETS:
+        station = stations.get(dataset)
+        if station is None:
+            trends[dataset] = None
+        elif dataset == "two-hr-forecast":
+            _, codes = weather_history.window(dataset, station, hours)
+            texts = [weather_history.texts[int(c)] for c in codes]
+            trends[dataset] = {
+                "station": station,
+                "earliest": texts[0],
+                "latest": texts[-1],
+                "changes": sum(1 for a, b in zip(texts, texts[1:]) if a != b),
+            } if texts else None
+        else:
+            trend = weather_history.trend(dataset, station, hours)
+            trends[dataset] = dict(trend, station=station) if trend else None
+    return {"park": info.slug, "hours": hours, "trends": trends}
+
 @router.get("/apparent-temperature")
-def apparent_temperature(
+async def apparent_temperature(
     date: str | None = Query(default=None),
-    lat: float = Query(default=1.3815),
-    lon: float = Query(default=103.9510),
+    lat: float | None = Query(default=None, description="Defaults to a point inside the park"),
+    lon: float | None = Query(default=None, description="Defaults to a point inside the park"),
+    park: str | None = Query(default=None, description=PARK_DESCRIPTION),
 ):
-    return feels_like(date=date, lat=lat, lon=lon)
+    return await feels_like(date=date, lat=lat, lon=lon, park=park)
@@ -1,6 +1,74 @@
+from pathlib import Path
+from typing import List
 from pydantic_settings import BaseSettings
 
+# Bundled datasets, resolved from the package so the working directory doesn't matter.
+DATA_DIR = Path(__file__).resolve().parents[3] / "data" / "raw"
+
 class Settings(BaseSettings):
     rain_penalty: float = 2.5   # multiply length for unsheltered edges
 
+    # --- local walking router ---
+    walk_network_table: str = "tracks"   # park path network (LINESTRING / MULTILINESTRING)
+    walking_speed_mps: float = 1.4       # average walking speed used for durations
+    max_snap_m: float = 250.0            # further than this from the graph -> Mapbox fallback
+    mapbox_fallback: bool = True         # use Mapbox Directions when the local graph can't answer
+
+    # --- precomputed facility-to-facility routes ---
+    route_index_path: str = "cache/facility_routes.npz"
+    facility_match_m: float = 3.0        # a route endpoint this close to a facility counts as that facility
+    route_table_max_group: int = 2000    # parks with more facilities than this are routed on demand
+
+    # --- in-memory facility indexes ---
+    facility_refresh_s: float = 300.0    # how often to check park_facilities for changes
+    geojson_precision: int = 6           # decimal places in facility GeoJSON (~0.1 m)
+    proximity_k: int = 5                 # nearby facilities kept per category for each facility
+
+    # --- vector tiles ---
+    tile_cache_dir: str = "cache/tiles"
+    tile_cache_size: int = 4096          # tiles kept in memory per worker
+    tile_cache_max_mb: float = 256.0     # disk cache cap; the least recently written tiles go first
+    tile_seed_zooms: List[int] = [14, 15, 16]   # pre-rendered over the park at startup; deeper zooms fill on demand
+
+    # --- route result cache ---
+    route_cache_size: int = 4096         # max cached routes per worker (LRU beyond this)
+    route_cache_ttl_s: float = 900.0
+    route_cache_grid_m: float = 10.0     # endpoints in the same grid cell share a cached route
+
+    # --- pooled upstream HTTP clients (Mapbox, LTA DataMall, data.gov.sg) ---
+    upstream_http2: bool = False         # needs the optional 'h2' package
+    upstream_keepalive_s: float = 60.0   # idle pooled connections are closed after this
+    weather_call_timeout_s: float = 4.0  # one data.gov.sg dataset slower than this is left out of the response
+
+    # --- park registry ---
+    parks_geojson_path: str = str(DATA_DIR / "NParksParksandNatureReserves.geojson")
+    park_name: str = "PASIR RIS PK"      # default park when a request names none
+    park_resolve_m: float = 500.0        # a point this close to a park's edge resolves to that park
+    park_point_radius_m: float = 250.0   # extent of a parks-table park that has no polygon
+    mrt_exits_path: str = str(DATA_DIR / "LTAMRTStationExitGEOJSON.geojson")   # LTA DataMall "Train Station Exit"; not bundled
+    mrt_radius_m: float = 1500.0         # MRT exits within this distance of a park serve it
+
+    # --- LTA carpark ingestion ---
+    carpark_page_parallelism: int = 4    # DataMall pages fetched at once
+    carpark_radius_m: float = 1000.0     # carparks within this distance of a park's boundary serve it
+    carpark_refresh_s: float = 60.0      # background refresh interval
+    carpark_snapshot_path: str = "cache/carparks.json"   # shared by the gunicorn workers
+    carpark_history_path: str = "cache/carpark_history.npz"
+    carpark_history_save_s: float = 600.0  # how often the occupancy history is written to disk
+    driving_speed_kmh: float = 25.0      # straight-line driving speed for arrival-time estimates
+
+    # --- weather snapshot ---
+    weather_polling: bool = True         # poll data.gov.sg in the background; off = fetch on first request only
+    weather_history_path: str = "cache/weather_history.sqlite"
+    weather_history_hours: float = 48.0  # rolling window kept in memory and on disk
+    feels_like_grid_m: float = 50.0      # spacing of the apparent-temperature heatmap grid
+
+    # --- walking isochrones ---
+    isochrone_minutes: List[float] = [5.0, 10.0, 15.0]   # bands precomputed for MRT exits, carparks, facilities
+    isochrone_max_minutes: float = 30.0
+    isochrone_buffer_m: float = 20.0     # half-width of the reachable corridor drawn around each path
+    isochrone_cell_m: float = 10.0       # raster resolution the polygons are traced at
+    isochrone_cache_size: int = 1024     # on-demand isochrone features kept per worker (LRU)
+    isochrone_cache_path: str = "cache/isochrones.json"
+
 settings = Settings()      # auto-loads from environment
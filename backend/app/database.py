@@ -47,4 +47,8 @@ engine = create_async_engine(
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+async def get_db():
+    async with AsyncSessionLocal() as session:
+        yield session
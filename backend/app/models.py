@@ -59,3 +59,16 @@ class Park(Base):
     y_local   = Column("y", Float)        # original SVY21 northing
 
     geom = Column(Geometry("POINT", srid=4326, spatial_index=True))
+
+# ---------------------------------------------------------
+# 4. Facility proximity  (materialised "nearby" lookups)
+# ---------------------------------------------------------
+class FacilityProximity(Base):
+    __tablename__ = "facility_proximity"
+
+    objectid            = Column(Integer, primary_key=True)     # facility the list belongs to
+    category            = Column(String, primary_key=True)      # class of the neighbours
+    rank                = Column(Integer, primary_key=True)     # 0 = nearest
+    neighbour_objectid  = Column(Integer, nullable=False)
+    straight_m          = Column(Float, nullable=False)
+    walking_m           = Column(Float, nullable=True)          # NULL when not reachable on the path network
@@ -0,0 +1,181 @@
+from typing import Dict
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from ..config.settings import settings
+from .carpark_service import CarparkSnapshot, arrival_minutes, carpark_service
+
+RECENT_POINTS = 120          # last two hours at the one-minute refresh
+TREND_WINDOW_S = 30 * 60     # recent slope is fitted over this much history
+TREND_DAMPING_MIN = 10.0     # the slope's effect saturates after roughly this many minutes
+BIN_S = 15 * 60
+BINS_PER_DAY = 86400 // BIN_S
+PROFILE_BINS = 7 * BINS_PER_DAY      # weekday x quarter-hour
+PROFILE_MEMORY = 60          # samples per bin before the mean turns into a moving average
+SGT_OFFSET_S = 8 * 3600      # Singapore has no DST, so local time is a fixed offset
+
+
+def profile_bin(ts):
+    """Weekday (Monday = 0) x quarter-hour bin of epoch seconds, in Singapore time; vectorised."""
+    local = np.asarray(ts, dtype=np.float64) + SGT_OFFSET_S
+    weekday = (np.floor(local / 86400).astype(np.int64) + 3) % 7     # 1970-01-01 was a Thursday
+    return weekday * BINS_PER_DAY + (local % 86400 // BIN_S).astype(np.int64)
+
+
+class OccupancyHistory:
+    """
+    Available lots per carpark over time, in fixed-width arrays.
+
+    One row per carpark ever seen: the last RECENT_POINTS totals in a ring sharing
+    one timestamp column, and a weekday x quarter-hour profile of mean totals. Fed
+    by carpark_service, so it costs no extra LTA calls, and saved to an npz every
+    carpark_history_save_s so the profile survives restarts.
+
+    The forecast for every carpark at once is the current total, plus the
+    profile's change between now and the arrival bin, plus the recent slope damped
+    towards zero, clipped at zero.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows: Dict[str, int] = {}
+        self.ts = np.full(RECENT_POINTS, np.nan)                           # shared by every row
+        self.recent = np.zeros((0, RECENT_POINTS), dtype=np.float32)       # NaN: not reported then
+        self.head = 0
+        self.profile = np.zeros((0, PROFILE_BINS), dtype=np.float32)
+        self.counts = np.zeros((0, PROFILE_BINS), dtype=np.uint16)
+        self.slope = np.zeros(0, dtype=np.float32)                         # lots per minute
+        self.last_ts = -np.inf
+        self._saved_at = time.time()
+
+    # --- persistence ---
+    def _save_sync(self, arrays: dict) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, self.path)
+
+    def _arrays(self) -> dict:
+        ids = sorted(self.rows, key=self.rows.get)
+        return {
+            "ids": np.array(ids, dtype=str),
+            "ts": self.ts.copy(),
+            "recent": self.recent.copy(),
+            "head": np.array(self.head),
+            "profile": self.profile.copy(),
+            "counts": self.counts.copy(),
+        }
+
+    def _load_sync(self) -> int:
+        with np.load(self.path, allow_pickle=False) as data:
+            if data["recent"].shape[1:] != (RECENT_POINTS,) or data["profile"].shape[1:] != (PROFILE_BINS,):
+                raise ValueError("history layout has changed")
+            self.rows = {str(cid): i for i, cid in enumerate(data["ids"].tolist())}
+            self.ts = data["ts"]
+            self.recent = data["recent"]
+            self.head = int(data["head"])
+            self.profile = data["profile"]
+            self.counts = data["counts"]
+        self.last_ts = float(np.nanmax(self.ts)) if not np.isnan(self.ts).all() else -np.inf
+        self._fit_slope()
+        return len(self.rows)
+
+    async def save(self) -> None:
+        if not self.rows:
+            return
+        self._saved_at = time.time()
+        await asyncio.to_thread(self._save_sync, self._arrays())
+
+    async def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            n = await asyncio.to_thread(self._load_sync)
+            print(f"Carpark history: {n} carparks restored from {self.path}")
+        except Exception as e:
+            print(f"Warning: could not load carpark history ({e})")
+
+    # --- ingest ---
+    def _rows_for(self, ids: np.ndarray, grow: bool) -> np.ndarray:
+        """Row of each carpark id; unknown ids get new rows when grow, else -1."""
+        if grow:
+            new = [cid for cid in ids.tolist() if cid not in self.rows]
+            if new:
+                for cid in new:
+                    self.rows[cid] = len(self.rows)
+                k = len(new)
+                self.recent = np.vstack([self.recent, np.full((k, RECENT_POINTS), np.nan, dtype=np.float32)])
+                self.profile = np.vstack([self.profile, np.zeros((k, PROFILE_BINS), dtype=np.float32)])
+                self.counts = np.vstack([self.counts, np.zeros((k, PROFILE_BINS), dtype=np.uint16)])
+                self.slope = np.concatenate([self.slope, np.zeros(k, dtype=np.float32)])
+        return np.array([self.rows.get(cid, -1) for cid in ids.tolist()], dtype=np.int64)
+
+    def _fit_slope(self) -> None:
+        """Least-squares slope of each row over the trend window, all rows at once."""
+        self.slope = np.zeros(len(self.rows), dtype=np.float32)
+        cols = np.flatnonzero(self.ts >= self.last_ts - TREND_WINDOW_S)
+        if len(cols) < 2:
+            return
+        t = (self.ts[cols] - self.last_ts) / 60.0
+        v = self.recent[:, cols].astype(np.float64)
+        m = ~np.isnan(v)
+        v = np.where(m, v, 0.0)
+        n, st, sv = m.sum(axis=1), (m * t).sum(axis=1), v.sum(axis=1)
+        stt, stv = (m * t * t).sum(axis=1), (v * t).sum(axis=1)
+        denom = n * stt - st * st
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.slope = np.where((n >= 2) & (denom > 0), (n * stv - st * sv) / denom, 0.0).astype(np.float32)
+
+    def append(self, snapshot: CarparkSnapshot) -> bool:
+        """Record one snapshot; snapshots already seen (or older) are ignored."""
+        if snapshot.fetched_at <= self.last_ts or not len(snapshot):
+            return False
+        rows = self._rows_for(snapshot.ids, grow=True)
+        totals = snapshot.total.astype(np.float32)
+
+        self.ts[self.head] = snapshot.fetched_at
+        self.recent[:, self.head] = np.nan
+        self.recent[rows, self.head] = totals
+        self.head = (self.head + 1) % RECENT_POINTS
+        self.last_ts = snapshot.fetched_at
+
+        b = profile_bin(snapshot.fetched_at)
+        counts = np.minimum(self.counts[rows, b].astype(np.int64) + 1, PROFILE_MEMORY)
+        self.profile[rows, b] += (totals - self.profile[rows, b]) / counts
+        self.counts[rows, b] = counts
+
+        self._fit_slope()
+        return True
+
+    async def on_snapshot(self, snapshot: CarparkSnapshot) -> None:
+        if self.append(snapshot) and time.time() - self._saved_at >= settings.carpark_history_save_s:
+            await self.save()
+
+    # --- forecast ---
+    def predict(self, snapshot: CarparkSnapshot, rows: np.ndarray, distance_m: np.ndarray) -> np.ndarray:
+        """Expected total lots of snapshot's rows when a driver distance_m away from each arrives."""
+        current = snapshot.total[rows].astype(np.float64)
+        history_rows = self._rows_for(snapshot.ids[rows], grow=False)
+        known = history_rows >= 0
+        if not known.any():
+            return current
+        r = history_rows[known]
+        horizon = arrival_minutes(np.asarray(distance_m, dtype=np.float64)[known])
+
+        now_bin = profile_bin(snapshot.fetched_at)
+        then_bin = profile_bin(snapshot.fetched_at + horizon * 60)
+        seasonal = self.profile[r, then_bin] - self.profile[r, now_bin]
+        seasonal = np.where((self.counts[r, then_bin] > 0) & (self.counts[r, now_bin] > 0), seasonal, 0.0)
+        trend = self.slope[r] * TREND_DAMPING_MIN * (1 - np.exp(-horizon / TREND_DAMPING_MIN))
+
+        predicted = current.copy()
+        predicted[known] = np.maximum(current[known] + seasonal + trend, 0.0)
+        return predicted
+
+
+carpark_history = OccupancyHistory(settings.carpark_history_path)
+carpark_service.subscribe(carpark_history.on_snapshot)
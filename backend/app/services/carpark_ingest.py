@@ -0,0 +1,146 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+
+import numpy as np
+import orjson
+
+from ..config.settings import settings
+from .park_registry import get_park_registry
+from .upstream import get_upstream
+
+CARPARK_URL = "/ltaodataservice/CarParkAvailabilityv2"
+PAGE_SIZE = 500   # DataMall's fixed page size; $skip moves in steps of this
+
+
+class IngestMetrics:
+    """Counters from the most recent full ingestion, for /parking/carparks/ingest-metrics."""
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at: Optional[float] = None
+        self.duration_s: Optional[float] = None
+        self.pages = 0
+        self.bytes = 0
+        self.records_total = 0
+        self.records_kept = 0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run_at": self.last_run_at,
+            "duration_seconds": None if self.duration_s is None else round(self.duration_s, 3),
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "records_total": self.records_total,
+            "records_kept": self.records_kept,
+            "records_per_second": round(self.records_total / self.duration_s, 1) if self.duration_s else None,
+            "last_error": self.last_error,
+        }
+
+
+ingest_metrics = IngestMetrics()
+
+
+def carpark_keep(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Which carparks count as serving some park: within carpark_radius_m of any
+    registered park. With no parks registered at all, every carpark is kept.
+    """
+    registry = get_park_registry()
+    if not len(registry):
+        return np.ones(len(lat), dtype=bool)
+    return registry.near_any(lat, lon, settings.carpark_radius_m)
+
+
+def _parse_page(body: bytes) -> Tuple[List[dict], int]:
+    """One DataMall page -> (records near a park, records on the page)."""
+    records = orjson.loads(body).get("value", [])
+    rows, lat, lon = [], [], []
+    for record in records:
+        parts = (record.get("Location") or "").split()
+        if len(parts) < 2:
+            continue
+        try:
+            la, lo = float(parts[0]), float(parts[1])
+            lots = int(record.get("AvailableLots", 0))
+        except ValueError:
+            continue
+        rows.append({
+            "carpark_id": record.get("CarParkID"),
+            "available_lots": lots,
+            "lot_type": record.get("LotType"),
+            "agency": record.get("Agency"),
+            "development": record.get("Development"),
+            "lat": la,
+            "lon": lo,
+        })
+        lat.append(la)
+        lon.append(lo)
+    if not rows:
+        return [], len(records)
+    keep = carpark_keep(np.array(lat), np.array(lon))
+    return [r for r, k in zip(rows, keep.tolist()) if k], len(records)
+
+
+async def fetch_all_carparks() -> List[dict]:
+    """
+    Every CarParkAvailabilityv2 page, fetched carpark_page_parallelism at a time.
+
+    Workers claim $skip offsets from a shared counter and parse each page as soon as
+    it lands, keeping only carparks near a park; the first short page marks the
+    end, and workers stop claiming offsets past it.
+    """
+    api_key = os.getenv("LTA_API_KEY")
+    if not api_key:
+        raise RuntimeError("LTA_API_KEY not configured")
+    headers = {"AccountKey": api_key, "Accept": "application/json"}
+    upstream = get_upstream("lta")
+
+    next_skip = 0
+    end_skip: Optional[int] = None      # skip of the first page shorter than PAGE_SIZE
+    pages: Dict[int, List[dict]] = {}
+    stats = {"pages": 0, "bytes": 0, "records": 0}
+
+    async def worker() -> None:
+        nonlocal next_skip, end_skip
+        while end_skip is None or next_skip <= end_skip:
+            skip = next_skip
+            next_skip += PAGE_SIZE
+            response = await upstream.get(CARPARK_URL, headers=headers, params={"$skip": skip})
+            response.raise_for_status()
+            body = response.content
+            pages[skip], n = _parse_page(body)
+            stats["pages"] += 1
+            stats["bytes"] += len(body)
+            stats["records"] += n
+            if n < PAGE_SIZE and (end_skip is None or skip < end_skip):
+                end_skip = skip
+
+    started = time.perf_counter()
+    ingest_metrics.runs += 1
+    workers = [asyncio.create_task(worker()) for _ in range(settings.carpark_page_parallelism)]
+    try:
+        await asyncio.gather(*workers)
+    except Exception as e:
+        # One failed page fails the run; don't leave its siblings fetching pages nobody will read.
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        ingest_metrics.failures += 1
+        ingest_metrics.last_error = str(e) or type(e).__name__
+        raise
+
+    carparks = [r for skip in sorted(pages) if skip <= end_skip for r in pages[skip]]
+    ingest_metrics.last_run_at = time.time()
+    ingest_metrics.duration_s = time.perf_counter() - started
+    ingest_metrics.pages = stats["pages"]
+    ingest_metrics.bytes = stats["bytes"]
+    ingest_metrics.records_total = stats["records"]
+    ingest_metrics.records_kept = len(carparks)
+    ingest_metrics.last_error = None
+    return carparks
@@ -0,0 +1,250 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+
+import numpy as np
+import orjson
+
+from ..config.settings import settings
+from .carpark_ingest import fetch_all_carparks
+
+try:  # advisory file locks coordinate gunicorn workers; unavailable on Windows
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EARTH_RADIUS_M = 6371000.0
+
+# (snapshot, candidate rows, metres from the driver to each) -> expected lots of each on arrival
+Predictor = Callable[["CarparkSnapshot", np.ndarray, np.ndarray], np.ndarray]
+
+
+def haversine_m(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Metres from one point to many, vectorised."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def arrival_minutes(distance_m):
+    """Driving minutes for a straight-line distance; road detours are folded into the speed."""
+    return distance_m / (settings.driving_speed_kmh * 1000 / 60)
+
+
+class CarparkSnapshot:
+    """
+    Carpark availability as of one LTA ingestion. Never mutated once built.
+
+    The per-lot-type records are grouped once, here, into row-aligned arrays (one
+    row per carpark): ids, lat/lon, a (carparks x lot types) lots matrix and the
+    total. Ranking a request is then one vectorised haversine and an argpartition.
+    """
+
+    def __init__(self, records: List[dict], fetched_at: float):
+        self.records = records
+        self.fetched_at = fetched_at
+
+        rows: Dict[str, int] = {}
+        lot_types: Dict[str, int] = {}
+        first: List[dict] = []
+        cells: List[Tuple[int, int, int]] = []
+        for r in records:
+            row = rows.setdefault(r["carpark_id"], len(rows))
+            if row == len(first):
+                first.append(r)
+            col = lot_types.setdefault(r["lot_type"], len(lot_types))
+            cells.append((row, col, int(r["available_lots"])))
+
+        n = len(first)
+        self.ids = np.array([r["carpark_id"] for r in first], dtype=object)
+        self.developments = np.array([r["development"] for r in first], dtype=object)
+        self.agencies = np.array([r["agency"] for r in first], dtype=object)
+        self.lat = np.array([r["lat"] for r in first], dtype=np.float64)
+        self.lon = np.array([r["lon"] for r in first], dtype=np.float64)
+        self.lot_types = list(lot_types)
+        self.lots = np.full((n, len(lot_types)), -1, dtype=np.int32)   # -1: carpark has no such lots
+        self.total = np.zeros(n, dtype=np.int64)
+        for row, col, lots in cells:
+            self.lots[row, col] = lots
+            self.total[row] += lots
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rank(self, lat: float, lon: float, limit: int, predictor: Optional[Predictor] = None,
+             rows: Optional[np.ndarray] = None) -> List[dict]:
+        """
+        The limit best carparks for someone at (lat, lon), best first, among rows
+        (default: all). Score is available lots per 100 m, which balances
+        availability against distance. With a predictor, lots are those expected
+        when the driver gets there.
+        """
+        rows = np.arange(len(self)) if rows is None else rows
+        if not len(rows) or limit <= 0:
+            return []
+        distance = haversine_m(lat, lon, self.lat[rows], self.lon[rows])
+        lots = self.total[rows] if predictor is None else predictor(self, rows, distance)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            score = np.where(distance > 0, lots / (distance / 100), 0.0)
+        if limit < len(rows):
+            top = np.argpartition(-score, limit - 1)[:limit]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-score[top], kind="stable")]
+        results = []
+        for j in top.tolist():
+            result = self.describe(int(rows[j]), float(distance[j]), float(score[j]))
+            if predictor is not None:
+                result["predicted_lots_at_arrival"] = int(round(float(lots[j])))
+                result["arrival_minutes"] = round(float(arrival_minutes(distance[j])), 1)
+            results.append(result)
+        return results
+
+    def describe(self, i: int, distance: float, score: float) -> dict:
+        return {
+            "carpark_id": self.ids[i],
+            "development": self.developments[i],
+            "agency": self.agencies[i],
+            "lat": float(self.lat[i]),
+            "lon": float(self.lon[i]),
+            "distance_meters": round(distance),
+            "lots_by_type": {t: int(v) for t, v in zip(self.lot_types, self.lots[i].tolist()) if v >= 0},
+            "total_available": int(self.total[i]),
+            "recommendation_score": score,
+        }
+
+    def age_s(self) -> float:
+        return max(0.0, time.time() - self.fetched_at)
+
+    def to_bytes(self) -> bytes:
+        return orjson.dumps({"fetched_at": self.fetched_at, "records": self.records})
+
+    @classmethod
+    def from_bytes(cls, body: bytes) -> "CarparkSnapshot":
+        data = orjson.loads(body)
+        return cls(data["records"], float(data["fetched_at"]))
+
+
+class CarparkService:
+    """
+    Carpark availability kept fresh in the background.
+
+    Requests only ever read self.snapshot, which a refresh replaces in one
+    assignment. Concurrent refreshes in a process share one in-flight call, and
+    across gunicorn workers a lock file elects one fetcher per interval: the
+    others adopt the snapshot it writes to settings.carpark_snapshot_path. When
+    LTA fails, the previous snapshot keeps being served and is marked stale.
+    Subscribed listeners are awaited with every newly adopted snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot: Optional[CarparkSnapshot] = None
+        self.last_error: Optional[str] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._listeners: List[Callable[[CarparkSnapshot], Awaitable[None]]] = []
+
+    def subscribe(self, listener: Callable[[CarparkSnapshot], Awaitable[None]]) -> None:
+        self._listeners.append(listener)
+
+    async def _publish(self, snapshot: CarparkSnapshot) -> None:
+        for listener in self._listeners:
+            try:
+                await listener(snapshot)
+            except Exception as e:
+                print(f"Warning: carpark listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+    def is_stale(self) -> bool:
+        return (self.snapshot is None or self.last_error is not None
+                or self.snapshot.age_s() > 2 * settings.carpark_refresh_s)
+
+    # --- shared snapshot file ---
+    def _read_shared(self) -> Optional[CarparkSnapshot]:
+        try:
+            with open(self.path, "rb") as f:
+                return CarparkSnapshot.from_bytes(f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_shared(self, snapshot: CarparkSnapshot) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(snapshot.to_bytes())
+        os.replace(tmp, self.path)   # atomic, so readers never see half a file
+
+    def _adopt(self, snapshot: Optional[CarparkSnapshot]) -> bool:
+        if snapshot is None or (self.snapshot is not None and snapshot.fetched_at <= self.snapshot.fetched_at):
+            return False
+        self.snapshot = snapshot
+        return True
+
+    async def _fetch(self) -> CarparkSnapshot:
+        """Fetch from LTA, unless another worker already has a fresh snapshot on disk."""
+        shared = await asyncio.to_thread(self._read_shared)
+        if shared is not None and shared.age_s() < settings.carpark_refresh_s:
+            return shared
+        if fcntl is None:
+            return CarparkSnapshot(await fetch_all_carparks(), time.time())
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        lock = open(f"{self.path}.lock", "a+")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is fetching right now; wait for it, then use its file.
+                await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+                shared = await asyncio.to_thread(self._read_shared)
+                if shared is not None and shared.age_s() < settings.carpark_refresh_s:
+                    return shared
+            snapshot = CarparkSnapshot(await fetch_all_carparks(), time.time())
+            await asyncio.to_thread(self._write_shared, snapshot)
+            return snapshot
+        finally:
+            lock.close()   # also releases the flock
+
+    async def _refresh(self) -> CarparkSnapshot:
+        try:
+            snapshot = await self._fetch()
+        except Exception as e:
+            self.last_error = str(e) or type(e).__name__
+            raise
+        self.last_error = None
+        if self._adopt(snapshot):
+            await self._publish(snapshot)
+        return self.snapshot
+
+    async def refresh(self) -> CarparkSnapshot:
+        """Single-flight: callers arriving while a refresh runs await that same refresh."""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+            self._inflight.add_done_callback(self._clear_inflight)
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, future: asyncio.Future) -> None:
+        self._inflight = None
+        if not future.cancelled():
+            future.exception()   # mark retrieved; callers get it through await
+
+    async def get(self) -> CarparkSnapshot:
+        """The current snapshot; only the very first call in a process waits for LTA."""
+        if self.snapshot is not None:
+            return self.snapshot
+        if os.path.exists(self.path) and self._adopt(await asyncio.to_thread(self._read_shared)):
+            await self._publish(self.snapshot)
+            return self.snapshot
+        return await self.refresh()
+
+    async def run_refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Warning: carpark refresh failed, serving stale data: {e}")
+            await asyncio.sleep(settings.carpark_refresh_s)
+
+
+carpark_service = CarparkService(settings.carpark_snapshot_path)
@@ -0,0 +1,115 @@
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from ..config.settings import settings
+
+# GeoJSON property name -> SQL expression over park_facilities.
+# Mirrors what the endpoints used to build row by row in Python.
+FACILITY_PROPERTIES: Dict[str, str] = {
+    "objectid": "objectid",
+    "class": "class",
+    "additional_info": "additional_info",
+    "name_left": "name_left",
+    "facility_type": "facility_type",
+    "phone": "phone",
+    "hours": (
+        "CASE WHEN hours_open IS NULL AND hours_close IS NULL THEN NULL "
+        "ELSE json_build_object('open', to_char(hours_open, 'HH24:MI'), "
+        "'close', to_char(hours_close, 'HH24:MI')) END"
+    ),
+    "price_range": "price_range",
+    "price_info": "price_info",
+    "rating": "CASE WHEN rating <> 0 THEN rating::float8 END",
+    "review_count": "review_count",
+    "cuisine": "cuisine",
+    "website": "website",
+    "activities": "activities",
+    "service_options": "service_options",
+    "reservation_links": "reservation_links",
+    "order_links": "order_links",
+    "address": "address",
+}
+
+FILTER_PROPERTIES = ("objectid", "class", "additional_info", "name_left")
+
+
+def _feature_sql(properties: Iterable[str]) -> str:
+    props = ", ".join(f"'{name}', {FACILITY_PROPERTIES[name]}" for name in properties)
+    return (
+        "json_build_object("
+        "'type', 'Feature', "
+        "'geometry', ST_AsGeoJSON(geom, :precision)::json, "
+        f"'properties', json_build_object({props}))"
+    )
+
+
+def feature_collection_sql(properties: Sequence[str], where: str = "", paginate: bool = False) -> str:
+    """
+    One statement that returns the whole FeatureCollection as a single text value,
+    so Python never decodes geometries or builds per-row objects. Only the requested
+    properties are evaluated. With paginate, the page is the first :limit rows after
+    :after in objectid order (a primary key range scan), and next_cursor is set when
+    more rows follow.
+    """
+    where_sql = f"WHERE {where}" if where else ""
+    if not paginate:
+        return f"""
+            SELECT json_build_object(
+                'type', 'FeatureCollection',
+                'features', coalesce(json_agg({_feature_sql(properties)} ORDER BY objectid), '[]'::json)
+            )::text
+            FROM park_facilities
+            {where_sql};
+        """
+    # One row past the page tells us whether there is a next page.
+    return f"""
+        SELECT json_build_object(
+            'type', 'FeatureCollection',
+            'features', coalesce(json_agg(feature ORDER BY objectid) FILTER (WHERE rn <= :limit), '[]'::json),
+            'next_cursor', CASE WHEN count(*) > :limit THEN max(objectid) FILTER (WHERE rn <= :limit) END
+        )::text
+        FROM (
+            SELECT objectid, {_feature_sql(properties)} AS feature,
+                   row_number() OVER (ORDER BY objectid) AS rn
+            FROM park_facilities
+            {where_sql}
+            ORDER BY objectid
+            LIMIT :limit + 1
+        ) page;
+    """
+
+
+async def facility_collection_json(
+    db,
+    properties: Sequence[str] = tuple(FACILITY_PROPERTIES),
+    categories: Optional[Sequence[str]] = None,
+    precision: Optional[int] = None,
+    objectids: Optional[Sequence[int]] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    limit: Optional[int] = None,
+    after: Optional[int] = None,
+) -> bytes:
+    """
+    FeatureCollection bytes assembled by PostGIS, ready to write to the response.
+    bbox is (min_lon, min_lat, max_lon, max_lat); limit/after page through objectids.
+    """
+    params = {"precision": settings.geojson_precision if precision is None else precision}
+    where = []
+    if categories:
+        where.append("class = ANY(:categories)")
+        params["categories"] = list(categories)
+    if objectids is not None:
+        where.append("objectid = ANY(:objectids)")
+        params["objectids"] = [int(i) for i in objectids]
+    if bbox is not None:
+        where.append("geom && ST_MakeEnvelope(:min_lon, :min_lat, :max_lon, :max_lat, 4326)")
+        params.update(zip(("min_lon", "min_lat", "max_lon", "max_lat"), bbox))
+    if after is not None:
+        where.append("objectid > :after")
+        params["after"] = after
+    if limit is not None:
+        params["limit"] = limit
+    sql = feature_collection_sql(properties, " AND ".join(where), paginate=limit is not None)
+    res = await db.execute(text(sql), params)
+    return res.scalar().encode()
@@ -0,0 +1,56 @@
+from typing import Iterable, List, Optional
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from .facility_store import FacilityStore, facility_store
+from .walk_graph import to_svy21
+
+ROUTE_AMENITY_CLASSES = ("SHELTER", "TOILET")
+
+
+class FacilityIndex:
+    """STRtree over every facility point in SVY21, so metre-based queries need no reprojection."""
+
+    def __init__(self, store: FacilityStore):
+        self.version = store.version
+        self.objectids = store.objectids
+        self.classes = store.classes
+        self.names = np.array([r.name_right for r in store.rows], dtype=object)
+        self.lonlat = store.lonlat
+        self.points = shapely.points(store.xy) if len(store.xy) else np.empty(0, dtype=object)
+        self.tree = STRtree(self.points)
+
+    def along_route(self, route_lonlat: np.ndarray, buffer_m: float,
+                    classes: Iterable[str] = ROUTE_AMENITY_CLASSES) -> List[dict]:
+        """Facilities of the given classes within buffer_m of a route, ordered along it."""
+        x, y = to_svy21(route_lonlat[:, 0], route_lonlat[:, 1])
+        line = shapely.linestrings(x, y)
+        hits = self.tree.query(line, predicate="dwithin", distance=buffer_m)
+        hits = hits[np.isin(self.classes[hits], list(classes))]
+        if not len(hits):
+            return []
+        hits = hits[np.argsort(shapely.line_locate_point(line, self.points[hits]), kind="stable")]
+        return [{
+            "objectid": int(self.objectids[i]),
+            "class": self.classes[i],
+            "name": self.names[i],
+            "lat": float(self.lonlat[i, 1]),
+            "lon": float(self.lonlat[i, 0]),
+        } for i in hits.tolist()]
+
+
+_index: Optional[FacilityIndex] = None
+
+
+def get_facility_index() -> Optional[FacilityIndex]:
+    return _index
+
+
+async def _rebuild(store: FacilityStore) -> None:
+    global _index
+    _index = FacilityIndex(store)
+
+
+facility_store.subscribe(_rebuild)
@@ -0,0 +1,174 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import delete, insert, text
+
+from ..config.settings import settings
+from ..database import AsyncSessionLocal
+from ..models import FacilityProximity
+from .facility_store import FacilityStore, facility_store
+# Imported for its side effect too: the route table must subscribe (and so rebuild) first.
+from .facility_routes import FacilityRouteIndex, get_facility_route_index
+
+CANDIDATE_FACTOR = 3   # straight-line candidates per slot, re-ranked by walking distance
+MATERIALIZE_LOCK_KEY = 0x70726F78   # pg advisory lock id held while one worker rewrites the table
+
+
+def _walking_metres(routes: Optional[FacilityRouteIndex], route_row: np.ndarray,
+                    rows: np.ndarray, cand: np.ndarray) -> np.ndarray:
+    """Walking metres from each store row to each of its candidates; NaN where unknown."""
+    out = np.full(cand.shape, np.nan, dtype=np.float64)
+    if routes is None:
+        return out
+    src = route_row[rows][:, None].repeat(cand.shape[1], axis=1)
+    dst = route_row[cand]
+    known = (src >= 0) & (dst >= 0)
+    metres = routes.lengths(src[known], dst[known], "fastest") + routes.fac_gap[src[known]] + routes.fac_gap[dst[known]]
+    out[known] = np.where(np.isfinite(metres), metres, np.nan)
+    return out
+
+
+class ProximityGraph:
+    """
+    For every facility, its k nearest facilities of each category.
+
+    Stored as dense (facilities x categories x k) arrays: neighbour store row (-1 for
+    an empty slot), straight-line metres and walking metres (NaN when the pair isn't
+    connected on the path network). Candidates come from a KD-tree per category and
+    are ranked by walking distance; those the route table can't connect follow, by
+    straight-line distance.
+    """
+
+    def __init__(self, store: FacilityStore, routes: Optional[FacilityRouteIndex], k: int):
+        self.version = store.version
+        self.k = k
+        self.objectids = store.objectids
+        self.classes = store.classes
+        self.lonlat = store.lonlat
+        self.names = np.array([r.name_left for r in store.rows], dtype=object)
+        self.categories: List[str] = sorted({c for c in store.classes.tolist() if c})
+        self._row = {int(oid): i for i, oid in enumerate(store.objectids.tolist())}
+
+        n, c = len(store.objectids), len(self.categories)
+        self.neighbour = np.full((n, c, k), -1, dtype=np.int32)
+        self.straight = np.full((n, c, k), np.nan, dtype=np.float32)
+        self.walking = np.full((n, c, k), np.nan, dtype=np.float32)
+        if not n:
+            return
+
+        route_row = np.full(n, -1, dtype=np.int64)
+        if routes is not None:
+            for i, oid in enumerate(store.objectids.tolist()):
+                r = routes.row_of(oid)
+                if r is not None:
+                    route_row[i] = r
+
+        rows = np.arange(n)
+        for ci, category in enumerate(self.categories):
+            members = np.flatnonzero(store.classes == category)
+            m = min(len(members), CANDIDATE_FACTOR * k + 1)
+            d, idx = cKDTree(store.xy[members]).query(store.xy, k=m)
+            d, idx = d.reshape(n, m), idx.reshape(n, m)
+            cand = members[idx]
+            walk = _walking_metres(routes, route_row, rows, cand)
+
+            # Reachable candidates by walking metres first, then those without a walking
+            # distance by straight-line metres; a facility is not its own neighbour.
+            itself = cand == rows[:, None]
+            walk_key = np.where(np.isnan(walk), np.inf, walk)
+            order = np.lexsort((d, walk_key, itself), axis=1)[:, :k]
+            keep = ~np.take_along_axis(itself, order, axis=1)
+            slots = order.shape[1]
+
+            self.neighbour[:, ci, :slots] = np.where(keep, np.take_along_axis(cand, order, axis=1), -1)
+            self.straight[:, ci, :slots] = np.where(keep, np.take_along_axis(d, order, axis=1), np.nan)
+            self.walking[:, ci, :slots] = np.where(keep, np.take_along_axis(walk, order, axis=1), np.nan)
+
+    def __len__(self) -> int:
+        return len(self.objectids)
+
+    def nearby(self, objectid: int, categories: Optional[Sequence[str]] = None,
+               k: Optional[int] = None) -> Optional[Dict[str, List[dict]]]:
+        """{category: neighbours nearest first}, or None for an unknown objectid."""
+        i = self._row.get(objectid)
+        if i is None:
+            return None
+        k = self.k if k is None else min(k, self.k)
+        result = {}
+        for ci, category in enumerate(self.categories):
+            if categories and category not in categories:
+                continue
+            entries = []
+            for slot in range(k):
+                j = int(self.neighbour[i, ci, slot])
+                if j < 0:
+                    break
+                walking = float(self.walking[i, ci, slot])
+                entries.append({
+                    "objectid": int(self.objectids[j]),
+                    "class": category,
+                    "name": self.names[j],
+                    "lat": float(self.lonlat[j, 1]),
+                    "lon": float(self.lonlat[j, 0]),
+                    "straight_meters": round(float(self.straight[i, ci, slot]), 1),
+                    "walking_meters": None if np.isnan(walking) else round(walking, 1),
+                    "walking_minutes": None if np.isnan(walking)
+                                       else round(walking / settings.walking_speed_mps / 60, 1),
+                })
+            if entries:
+                result[category] = entries
+        return result
+
+    def table_rows(self) -> List[dict]:
+        """The graph as facility_proximity rows."""
+        i, ci, slot = np.nonzero(self.neighbour >= 0)
+        neighbours = self.objectids[self.neighbour[i, ci, slot]].tolist()
+        straight = self.straight[i, ci, slot].tolist()
+        walking = self.walking[i, ci, slot].tolist()
+        return [{
+            "objectid": int(self.objectids[a]),
+            "category": self.categories[b],
+            "rank": int(s),
+            "neighbour_objectid": int(nb),
+            "straight_m": st,
+            "walking_m": None if np.isnan(w) else w,
+        } for a, b, s, nb, st, w in zip(i.tolist(), ci.tolist(), slot.tolist(), neighbours, straight, walking)]
+
+
+async def materialize(graph: ProximityGraph) -> None:
+    """
+    Replace the facility_proximity table with the graph, in one transaction.
+    Every worker builds the same graph, so only the one that wins a transaction-scoped
+    advisory lock rewrites the table; the others skip.
+    """
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            res = await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MATERIALIZE_LOCK_KEY})
+            if not res.scalar():
+                print("facility_proximity is being materialised by another worker; skipping")
+                return
+            rows = graph.table_rows()
+            await db.execute(delete(FacilityProximity))
+            if rows:
+                await db.execute(insert(FacilityProximity), rows)
+    print(f"facility_proximity materialised: {len(rows)} rows")
+
+
+_graph: Optional[ProximityGraph] = None
+
+
+def get_proximity_graph() -> Optional[ProximityGraph]:
+    return _graph
+
+
+async def _rebuild(store: FacilityStore) -> None:
+    global _graph
+    _graph = ProximityGraph(store, get_facility_route_index(), settings.proximity_k)
+    try:
+        await materialize(_graph)
+    except Exception as e:
+        print(f"Warning: could not materialise facility_proximity ({e})")
+
+
+facility_store.subscribe(_rebuild)
@@ -0,0 +1,298 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import os
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from ..config.settings import settings
+from .facility_store import FacilityStore, facility_store
+from .park_registry import get_park_registry
+from .walk_graph import PROFILES, WalkGraph, get_walk_graph, to_svy21
+
+INDEX_FORMAT = 2
+ROUTE_BATCH = 64       # sources per bulk Dijkstra; bounds the (batch x nodes) predecessor matrix
+ROUTE_DETOUR = 3.0     # searches stop this many times a park's facility spread from the source
+
+
+def _tree_lengths(xy: np.ndarray, pred: np.ndarray) -> np.ndarray:
+    """
+    Metres from every node to the root of its shortest-path tree.
+
+    Edges are straight segments, so a node's distance to its parent is just the
+    euclidean gap. Pointer jumping sums those up the tree in O(log depth) numpy passes.
+    """
+    n = len(pred)
+    has_parent = pred >= 0
+    anc = np.where(has_parent, pred, np.arange(n))
+    gap = xy - xy[anc]
+    dist = np.where(has_parent, np.hypot(gap[:, 0], gap[:, 1]), 0.0)
+    while True:
+        nxt = anc[anc]
+        if np.array_equal(nxt, anc):
+            return dist
+        dist = dist + dist[anc]
+        anc = nxt
+
+
+def _compress_tree(pred: np.ndarray, source: int, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep only the part of a predecessor tree that lies on a path to one of targets."""
+    keep = set()
+    for t in targets.tolist():
+        node = t
+        while node != source and node >= 0 and node not in keep:
+            keep.add(node)
+            node = int(pred[node])
+    nodes = np.array(sorted(keep), dtype=np.int32)
+    return nodes, pred[nodes].astype(np.int32)
+
+
+class FacilityRouteIndex:
+    """
+    Walking routes between the facilities of each park, for both profiles.
+
+    Facilities are grouped by the park they resolve to (rows sorted by group), and
+    each park has its own (n x n) block of metres between its facility nodes, so the
+    table grows with the largest park rather than with the whole registry. Facilities
+    outside any park, in parks over route_table_max_group, or in different parks are
+    not in the table; callers route those on demand.
+
+    Per profile, one trimmed predecessor tree per source facility lets the path itself
+    be unpacked without searching. Trees are packed CSR-style: the tree for source i
+    is tree_nodes[tree_ptr[i]:tree_ptr[i + 1]] (sorted) with parents in tree_parent.
+    The block for group g is length[block_ptr[g]:block_ptr[g + 1]], row-major.
+    """
+
+    def __init__(self, fingerprint: str, objectids: np.ndarray, fac_xy: np.ndarray,
+                 fac_node: np.ndarray, fac_gap: np.ndarray, group_ptr: np.ndarray,
+                 tables: Dict[str, Dict[str, np.ndarray]]):
+        self.fingerprint = fingerprint
+        self.objectids = objectids
+        self.fac_xy = fac_xy
+        self.fac_node = fac_node
+        self.fac_gap = fac_gap
+        self.group_ptr = group_ptr                # rows of group g: group_ptr[g]:group_ptr[g + 1]
+        self.tables = tables
+        sizes = np.diff(group_ptr)
+        self.group = np.repeat(np.arange(len(sizes)), sizes)
+        self.block_ptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes.astype(np.int64) ** 2, out=self.block_ptr[1:])
+        self._kdtree = cKDTree(fac_xy.reshape(-1, 2))
+        self._row = {int(oid): i for i, oid in enumerate(objectids.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.objectids)
+
+    def match(self, lat: float, lon: float) -> Optional[int]:
+        """Index of the facility sitting at (lat, lon), if any."""
+        if not len(self):
+            return None
+        d, i = self._kdtree.query(to_svy21(lon, lat))
+        return int(i) if d <= settings.facility_match_m else None
+
+    def row_of(self, objectid: int) -> Optional[int]:
+        return self._row.get(objectid)
+
+    def lengths(self, i: np.ndarray, j: np.ndarray, profile: str) -> np.ndarray:
+        """Network metres between facility rows, elementwise; inf across parks or when disconnected."""
+        i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+        out = np.full(i.shape, np.inf)
+        same = self.group[i] == self.group[j]
+        g = self.group[i[same]]
+        start, size = self.group_ptr[g], self.group_ptr[g + 1] - self.group_ptr[g]
+        flat = self.block_ptr[g] + (i[same] - start) * size + (j[same] - start)
+        out[same] = self.tables[profile]["length"][flat]
+        return out
+
+    def distance(self, i: int, j: int, profile: str) -> float:
+        """Facility-to-facility metres, including the walk on/off the network."""
+        return float(self.lengths(np.array([i]), np.array([j]), profile)[0]) + float(self.fac_gap[i] + self.fac_gap[j])
+
+    def path(self, i: int, j: int, profile: str) -> Optional[List[int]]:
+        """Graph node sequence from facility i to facility j, or None when not in the table."""
+        source, target = int(self.fac_node[i]), int(self.fac_node[j])
+        if source == target:
+            return [source]
+        if not np.isfinite(self.lengths(np.array([i]), np.array([j]), profile)[0]):
+            return None
+        t = self.tables[profile]
+        lo, hi = int(t["tree_ptr"][i]), int(t["tree_ptr"][i + 1])
+        nodes, parent = t["tree_nodes"][lo:hi], t["tree_parent"][lo:hi]
+        path = [target]
+        node = target
+        while node != source:
+            node = int(parent[np.searchsorted(nodes, node)])
+            path.append(node)
+        path.reverse()
+        return path
+
+    def save(self, path: str) -> None:
+        arrays = {
+            "format": np.array(INDEX_FORMAT),
+            "fingerprint": np.array(self.fingerprint),
+            "objectids": self.objectids,
+            "fac_xy": self.fac_xy,
+            "fac_node": self.fac_node,
+            "fac_gap": self.fac_gap,
+            "group_ptr": self.group_ptr,
+        }
+        for profile, t in self.tables.items():
+            for key, arr in t.items():
+                arrays[f"{profile}__{key}"] = arr
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, path)   # atomic, so a worker never reads a half-written file
+
+    @classmethod
+    def load(cls, path: str) -> Optional["FacilityRouteIndex"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as z:
+            if int(z["format"]) != INDEX_FORMAT:
+                return None
+            tables = {
+                profile: {key.split("__", 1)[1]: z[key] for key in z.files if key.startswith(f"{profile}__")}
+                for profile in PROFILES
+            }
+            return cls(str(z["fingerprint"]), z["objectids"], z["fac_xy"],
+                       z["fac_node"], z["fac_gap"], z["group_ptr"], tables)
+
+
+def facility_parks(fac_xy: np.ndarray) -> np.ndarray:
+    """Registry park index of each facility, or -1 outside every park."""
+    return get_park_registry().locate_xy(fac_xy[:, 0], fac_xy[:, 1])
+
+
+def index_fingerprint(graph: WalkGraph, objectids: np.ndarray, fac_xy: np.ndarray, parks: np.ndarray) -> str:
+    h = hashlib.sha1(graph.fingerprint().encode())
+    h.update(np.ascontiguousarray(objectids, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(fac_xy, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(parks, dtype=np.int64).tobytes())
+    h.update(repr(settings.route_table_max_group).encode())
+    return h.hexdigest()
+
+
+def _source_lengths(xy: np.ndarray, pred: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """_tree_lengths to each target, over only the nodes the (limited) search reached."""
+    nodes = np.flatnonzero(pred >= 0)
+    local = np.full(len(pred), -1, dtype=np.int64)
+    local[nodes] = np.arange(len(nodes))
+    roots = np.unique(pred[nodes][local[pred[nodes]] < 0])      # the source
+    local[roots] = len(nodes) + np.arange(len(roots))
+    nodes = np.concatenate([nodes, roots])
+    sub_pred = np.where(pred[nodes] >= 0, local[np.maximum(pred[nodes], 0)], -1)
+    lengths = _tree_lengths(xy[nodes], sub_pred)
+    hit = local[targets] >= 0
+    out = np.zeros(len(targets))
+    out[hit] = lengths[local[targets[hit]]]
+    return out
+
+
+def build_facility_route_index(graph: WalkGraph, objectids: np.ndarray, fac_xy: np.ndarray,
+                               parks: np.ndarray) -> FacilityRouteIndex:
+    """
+    Snap facilities onto the graph, group them by park and, per park, run bulk
+    Dijkstras from its facilities in batches of ROUTE_BATCH. Each search stops at
+    ROUTE_DETOUR times the park's facility spread, so it stays near the park.
+    """
+    fac_node, fac_gap = graph.snap_xy(fac_xy[:, 0], fac_xy[:, 1])
+    sizes = np.bincount(parks[parks >= 0], minlength=1)
+    keep = (fac_gap <= settings.max_snap_m) & (parks >= 0)
+    keep[keep] = sizes[parks[keep]] <= settings.route_table_max_group
+    if (sizes > settings.route_table_max_group).any():
+        print(f"Warning: {int((sizes > settings.route_table_max_group).sum())} parks have more than "
+              f"route_table_max_group facilities; their routes are computed on demand")
+    order = np.flatnonzero(keep)[np.argsort(parks[keep], kind="stable")]
+    objectids, fac_xy, parks = objectids[order], fac_xy[order], parks[order]
+    fac_node, fac_gap = fac_node[order].astype(np.int32), fac_gap[order]
+    group_ptr = np.flatnonzero(np.r_[True, parks[1:] != parks[:-1], True]) if len(parks) else np.zeros(1, dtype=np.int64)
+
+    tables = {}
+    for profile in PROFILES:
+        csr = graph.csr(profile)
+        penalty = graph.rain_penalty if profile == "sheltered" else 1.0
+        blocks, ptr = [], [0]
+        all_nodes, all_parent = [], []
+        for g in range(len(group_ptr) - 1):
+            lo, hi = int(group_ptr[g]), int(group_ptr[g + 1])
+            nodes_g = fac_node[lo:hi]
+            spread = float(np.ptp(fac_xy[lo:hi], axis=0).max()) if hi - lo > 1 else 0.0
+            length = np.empty((hi - lo, hi - lo), dtype=np.float32)
+            for b in range(lo, hi, ROUTE_BATCH):
+                _, pred = dijkstra(csr, directed=False, indices=fac_node[b:min(b + ROUTE_BATCH, hi)],
+                                   return_predecessors=True, limit=ROUTE_DETOUR * spread * penalty + 1.0)
+                for k in range(len(pred)):
+                    i = b + k
+                    # Measure real metres along the tree, not the (penalised) search cost.
+                    length[i - lo] = _source_lengths(graph.xy, pred[k], nodes_g)
+                    unreachable = pred[k][nodes_g] < 0
+                    unreachable[nodes_g == fac_node[i]] = False
+                    length[i - lo][unreachable] = np.inf
+                    tree_nodes, parent = _compress_tree(pred[k], int(fac_node[i]), nodes_g[~unreachable])
+                    all_nodes.append(tree_nodes)
+                    all_parent.append(parent)
+                    ptr.append(ptr[-1] + len(tree_nodes))
+            blocks.append(length.ravel())
+        tables[profile] = {
+            "length": np.concatenate(blocks) if blocks else np.empty(0, dtype=np.float32),
+            "tree_ptr": np.array(ptr, dtype=np.int64),
+            "tree_nodes": np.concatenate(all_nodes) if all_nodes else np.empty(0, dtype=np.int32),
+            "tree_parent": np.concatenate(all_parent) if all_parent else np.empty(0, dtype=np.int32),
+        }
+
+    return FacilityRouteIndex(
+        index_fingerprint(graph, objectids, fac_xy, parks), objectids, fac_xy, fac_node, fac_gap,
+        group_ptr.astype(np.int64), tables
+    )
+
+
+# ----------------------------------------------------------------------------
+# Process-wide index: loaded from disk when it matches the live graph, else rebuilt
+# ----------------------------------------------------------------------------
+_index: Optional[FacilityRouteIndex] = None
+
+
+def get_facility_route_index() -> Optional[FacilityRouteIndex]:
+    return _index
+
+
+async def load_facility_route_index(rebuild: bool = False) -> Optional[FacilityRouteIndex]:
+    """
+    Attach the facility route index for the current walk graph and facility_store
+    contents. The file at settings.route_index_path is reused as long as its
+    fingerprint matches.
+    """
+    global _index
+    graph = get_walk_graph()
+    if graph is None or facility_store.version is None:
+        _index = None
+        return None
+    try:
+        objectids, fac_xy = facility_store.objectids, facility_store.xy
+        parks = facility_parks(fac_xy)
+        wanted = index_fingerprint(graph, objectids, fac_xy, parks)
+        path = settings.route_index_path
+
+        index = None if rebuild else await asyncio.to_thread(FacilityRouteIndex.load, path)
+        if index is None or index.fingerprint != wanted:
+            index = await asyncio.to_thread(build_facility_route_index, graph, objectids, fac_xy, parks)
+            # The stored fingerprint covers every facility, not just the ones that snapped.
+            index.fingerprint = wanted
+            await asyncio.to_thread(index.save, path)
+            print(f"Facility route index built for {len(index)} facilities -> {path}")
+        _index = index
+    except Exception as e:
+        print(f"Warning: facility route index unavailable ({e})")
+        _index = None
+    return _index
+
+
+async def _on_facilities_changed(store: FacilityStore) -> None:
+    await load_facility_route_index()
+
+
+facility_store.subscribe(_on_facilities_changed)
@@ -0,0 +1,168 @@
+from typing import Dict, List, Optional
+import bisect
+import re
+
+import numpy as np
+
+from .facility_store import FacilityStore, facility_store
+from .walk_graph import to_svy21
+
+# How much a hit in each column counts towards a facility's score
+FIELD_WEIGHTS = {
+    "name_left": 3.0,
+    "name_right": 3.0,
+    "cuisine": 2.0,
+    "activities": 1.5,
+    "service_options": 1.0,
+    "additional_info": 1.0,
+}
+
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.6           # scaled by trigram similarity
+MIN_SIMILARITY = 0.35       # trigram Jaccard below this is not a match
+SPATIAL_SCALE_M = 500.0     # a facility this far away gets half the location boost
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(value) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = " ".join(v for v in value if v)
+    return _WORD.findall(str(value).lower().replace("&", " and "))
+
+
+def trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FacilitySearchIndex:
+    """
+    Token index over the text columns of every facility.
+
+    Each distinct token maps to (store rows, best field weight) postings. A query
+    term is resolved against the vocabulary three ways - exact, prefix (bisect on the
+    sorted vocabulary) and fuzzy (trigram overlap) - and the postings of every
+    matched token are folded into a per-facility score array.
+    """
+
+    def __init__(self, store: FacilityStore):
+        self.version = store.version
+        self.objectids = store.objectids
+        self.classes = store.classes
+        self.lonlat = store.lonlat
+        self.xy = store.xy
+        self.rows = store.rows
+
+        postings: Dict[str, Dict[int, float]] = {}
+        for i, row in enumerate(store.rows):
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(getattr(row, field)):
+                    docs = postings.setdefault(token, {})
+                    docs[i] = max(docs.get(i, 0.0), weight)
+
+        self.vocab: List[str] = sorted(postings)
+        self.post_rows: List[np.ndarray] = []
+        self.post_weights: List[np.ndarray] = []
+        for token in self.vocab:
+            docs = postings[token]
+            self.post_rows.append(np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)))
+            self.post_weights.append(np.fromiter(docs.values(), dtype=np.float64, count=len(docs)))
+
+        grams: Dict[str, List[int]] = {}
+        self._gram_count = np.zeros(len(self.vocab), dtype=np.int64)
+        for t, token in enumerate(self.vocab):
+            g = trigrams(token)
+            self._gram_count[t] = len(g)
+            for gram in g:
+                grams.setdefault(gram, []).append(t)
+        self._grams = {gram: np.array(ids, dtype=np.int64) for gram, ids in grams.items()}
+
+    def __len__(self) -> int:
+        return len(self.objectids)
+
+    def _resolve(self, term: str) -> Dict[int, float]:
+        """Vocabulary token id -> match quality for one query term."""
+        matches: Dict[int, float] = {}
+        lo = bisect.bisect_left(self.vocab, term)
+        hi = bisect.bisect_left(self.vocab, term + "\uffff")
+        for t in range(lo, hi):
+            matches[t] = EXACT_SCORE if self.vocab[t] == term else PREFIX_SCORE
+        if len(term) < 3:
+            return matches
+
+        query_grams = trigrams(term)
+        hits = [self._grams[g] for g in query_grams if g in self._grams]
+        if hits:
+            shared = np.bincount(np.concatenate(hits), minlength=len(self.vocab))
+            candidates = np.flatnonzero(shared)
+            similarity = shared[candidates] / (len(query_grams) + self._gram_count[candidates] - shared[candidates])
+            for t, s in zip(candidates.tolist(), similarity.tolist()):
+                if s >= MIN_SIMILARITY and t not in matches:
+                    matches[t] = FUZZY_SCORE * s
+        return matches
+
+    def search(self, q: str, limit: int = 10, lat: Optional[float] = None,
+               lon: Optional[float] = None) -> List[dict]:
+        terms = tokenize(q)
+        if not terms or not len(self):
+            return []
+
+        n = len(self)
+        score = np.zeros(n)
+        matched_terms = np.zeros(n, dtype=np.int64)
+        for term in terms:
+            term_score = np.zeros(n)
+            for t, quality in self._resolve(term).items():
+                np.maximum.at(term_score, self.post_rows[t], self.post_weights[t] * quality)
+            score += term_score
+            matched_terms += term_score > 0
+
+        hits = np.flatnonzero(matched_terms)
+        if not len(hits):
+            return []
+
+        distance = None
+        if lat is not None and lon is not None:
+            x, y = to_svy21(lon, lat)
+            distance = np.hypot(self.xy[hits, 0] - x, self.xy[hits, 1] - y)
+            score[hits] *= 1.0 + 1.0 / (1.0 + distance / SPATIAL_SCALE_M)
+
+        # Facilities matching more of the terms always outrank partial matches.
+        order = np.lexsort((-score[hits], -matched_terms[hits]))[:limit]
+        results = []
+        for k in order.tolist():
+            i = int(hits[k])
+            row = self.rows[i]
+            result = {
+                "objectid": int(self.objectids[i]),
+                "class": self.classes[i],
+                "name_left": row.name_left,
+                "name_right": row.name_right,
+                "additional_info": row.additional_info,
+                "lat": float(self.lonlat[i, 1]),
+                "lon": float(self.lonlat[i, 0]),
+                "score": round(float(score[i]), 3),
+            }
+            if distance is not None:
+                result["distance_meters"] = round(float(distance[k]), 1)
+            results.append(result)
+        return results
+
+
+_index: Optional[FacilitySearchIndex] = None
+
+
+def get_facility_search_index() -> Optional[FacilitySearchIndex]:
+    return _index
+
+
+async def _rebuild(store: FacilityStore) -> None:
+    global _index
+    _index = FacilitySearchIndex(store)
+
+
+facility_store.subscribe(_rebuild)
@@ -0,0 +1,72 @@
+from typing import Dict, Optional
+import asyncio
+import gzip
+import hashlib
+
+from ..database import AsyncSessionLocal
+from .facility_geojson import facility_collection_json
+from .facility_store import FacilityStore, facility_store
+
+try:  # optional: brotli is smaller than gzip for JSON, but not required
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class FacilitySnapshot:
+    """
+    The all_facilities payload, assembled by PostGIS once per facility data version,
+    with gzip (and brotli, when installed) variants compressed up front.
+    """
+
+    def __init__(self, version: Optional[str], body: bytes):
+        self.version = version
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        self.bodies: Dict[str, bytes] = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Best pre-compressed variant the client accepts."""
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.bodies:
+                return encoding
+        return "identity"
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = {t.strip() for t in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags or self.etag[2:] in tags
+
+
+_snapshot: Optional[FacilitySnapshot] = None
+_build_lock = asyncio.Lock()
+
+
+async def build_facility_snapshot(version: Optional[str] = None) -> FacilitySnapshot:
+    global _snapshot
+    async with _build_lock:
+        # Requests that queued behind a build of this version reuse its result.
+        if _snapshot is not None and _snapshot.version == version:
+            return _snapshot
+        async with AsyncSessionLocal() as db:
+            body = await facility_collection_json(db)
+        _snapshot = await asyncio.to_thread(FacilitySnapshot, version, body)
+    return _snapshot
+
+
+async def get_facility_snapshot() -> FacilitySnapshot:
+    """Current snapshot; built on first use if the startup load didn't produce one."""
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != facility_store.version:
+        snapshot = await build_facility_snapshot(facility_store.version)
+    return snapshot
+
+
+async def _rebuild(store: FacilityStore) -> None:
+    await build_facility_snapshot(store.version)
+
+
+facility_store.subscribe(_rebuild)
@@ -0,0 +1,96 @@
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+
+import numpy as np
+from sqlalchemy import select, text
+
+from ..config.settings import settings
+from ..database import AsyncSessionLocal
+from ..models import ParkFacility
+from .walk_graph import to_svy21
+
+# Cheap change detector: hashes every row server-side, no geometry leaves the DB.
+_VERSION_SQL = text("""
+    SELECT md5(coalesce(string_agg(md5(f::text), '' ORDER BY objectid), ''))
+    FROM park_facilities f;
+""")
+
+Listener = Callable[["FacilityStore"], Awaitable[None]]
+
+
+class FacilityStore:
+    """
+    In-memory copy of park_facilities that the per-process indexes are built from.
+
+    refresh() reloads the rows only when the table's content hash changes, then
+    awaits every subscribed listener so they can rebuild from the new rows.
+    Row-aligned numpy arrays (objectids, classes, lonlat, xy) sit next to the rows.
+    """
+
+    def __init__(self):
+        self.version: Optional[str] = None
+        self.rows: list = []
+        self.objectids = np.empty(0, dtype=np.int64)
+        self.classes = np.empty(0, dtype=object)
+        self.lonlat = np.empty((0, 2))
+        self.xy = np.empty((0, 2))
+        self._listeners: List[Listener] = []
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Reload if the data changed. Returns True when listeners were notified."""
+        async with self._lock:
+            async with AsyncSessionLocal() as db:
+                version = (await db.execute(_VERSION_SQL)).scalar()
+                if version == self.version and not force:
+                    return False
+                res = await db.execute(
+                    select(
+                        ParkFacility.objectid,
+                        ParkFacility.class_name,
+                        ParkFacility.name_left,
+                        ParkFacility.name_right,
+                        ParkFacility.additional_info,
+                        ParkFacility.hours_open,
+                        ParkFacility.hours_close,
+                        ParkFacility.cuisine,
+                        ParkFacility.activities,
+                        ParkFacility.service_options,
+                        ParkFacility.geom.ST_X().label("lon"),
+                        ParkFacility.geom.ST_Y().label("lat"),
+                    )
+                    .where(ParkFacility.geom.isnot(None))
+                    .order_by(ParkFacility.objectid)
+                )
+                rows = res.all()
+
+            self.rows = rows
+            self.objectids = np.array([r.objectid for r in rows], dtype=np.int64)
+            self.classes = np.array([r.class_name for r in rows], dtype=object)
+            self.lonlat = np.array([(r.lon, r.lat) for r in rows], dtype=np.float64).reshape(-1, 2)
+            x, y = to_svy21(self.lonlat[:, 0], self.lonlat[:, 1])
+            self.xy = np.column_stack([x, y])
+            self.version = version
+            print(f"Facility data version {version[:12]}: {len(rows)} facilities")
+
+            for listener in self._listeners:
+                try:
+                    await listener(self)
+                except Exception as e:
+                    print(f"Warning: facility listener {getattr(listener, '__name__', listener)} failed: {e}")
+            return True
+
+    async def run_refresh_loop(self) -> None:
+        """Poll for data changes every settings.facility_refresh_s seconds."""
+        while True:
+            await asyncio.sleep(settings.facility_refresh_s)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Warning: facility refresh failed: {e}")
+
+
+facility_store = FacilityStore()
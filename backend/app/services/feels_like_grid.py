@@ -0,0 +1,171 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import orjson
+import shapely
+from cachetools import LRUCache
+
+from ..config.settings import settings
+from .park_registry import ParkInfo, get_park_registry
+from .walk_graph import to_svy21, to_wgs84
+
+IDW_POWER = 2.0
+
+
+def apparent_temperature_c(t_c: np.ndarray, rh: np.ndarray, v_ms: np.ndarray) -> np.ndarray:
+    """Steadman apparent temperature, elementwise; NaN humidity or wind leaves the air temperature."""
+    rh = np.clip(rh, 0.0, 100.0)
+    e = (rh / 100.0) * 6.105 * np.exp(17.27 * t_c / (237.7 + t_c))
+    at = t_c + 0.33 * e - 0.70 * v_ms - 4.00
+    return np.where(np.isnan(rh) | np.isnan(v_ms), t_c, at)
+
+
+class ParkGrid:
+    """Cell centres every spacing_m metres inside a park (WGS84 boundary), in SVY21 and WGS84."""
+
+    def __init__(self, boundary, spacing_m: float):
+        self.spacing_m = spacing_m
+        min_lon, min_lat, max_lon, max_lat = boundary.bounds
+        bx, by = to_svy21(np.array([min_lon, max_lon, min_lon, max_lon]),
+                          np.array([min_lat, min_lat, max_lat, max_lat]))
+        xs = np.arange(bx.min() + spacing_m / 2, bx.max(), spacing_m)
+        ys = np.arange(by.min() + spacing_m / 2, by.max(), spacing_m)
+        gx, gy = (a.ravel() for a in np.meshgrid(xs, ys))
+        lon, lat = to_wgs84(gx, gy)
+        inside = shapely.contains_xy(boundary, lon, lat)
+        if not inside.any():
+            # Park smaller than a cell: one cell at a point inside it.
+            gx, gy, lon, lat, inside = self._single_cell(boundary)
+        self.xy = np.column_stack([gx[inside], gy[inside]])
+        self.lonlat = np.column_stack([lon[inside], lat[inside]])
+
+    @staticmethod
+    def _single_cell(boundary):
+        lon, lat = shapely.get_coordinates(shapely.point_on_surface(boundary))[0]
+        x, y = to_svy21(lon, lat)
+        return np.array([x]), np.array([y]), np.array([lon]), np.array([lat]), np.array([True])
+
+    def __len__(self) -> int:
+        return len(self.xy)
+
+
+class IDWWeights:
+    """Normalised inverse-distance weights from every station to every grid cell."""
+
+    def __init__(self, station_ids: Tuple[str, ...], station_xy: np.ndarray, grid: ParkGrid):
+        self.station_ids = station_ids
+        self.column = {sid: i for i, sid in enumerate(station_ids)}
+        d = np.hypot(grid.xy[:, None, 0] - station_xy[None, :, 0], grid.xy[:, None, 1] - station_xy[None, :, 1])
+        self.weights = 1.0 / np.maximum(d, 1.0) ** IDW_POWER      # (cells, stations)
+
+    def interpolate(self, readings: Dict[str, float]) -> np.ndarray:
+        """IDW over the stations that reported; NaN everywhere when none did."""
+        values = np.zeros(len(self.station_ids))
+        present = np.zeros(len(self.station_ids))
+        for sid, value in readings.items():
+            col = self.column.get(sid)
+            if col is not None:
+                values[col] = value
+                present[col] = 1.0
+        if not present.any():
+            return np.full(len(self.weights), np.nan)
+        return (self.weights @ (values * present)) / (self.weights @ present)
+
+
+def _station_locations(*payloads: dict) -> Dict[str, Tuple[float, float]]:
+    locations = {}
+    for payload in payloads:
+        for s in (payload.get("data") or {}).get("stations") or []:
+            sid = s.get("stationId") or s.get("id") or s.get("deviceId")
+            loc = s.get("location") or {}
+            if sid is not None and loc.get("latitude") is not None and loc.get("longitude") is not None:
+                locations[sid] = (float(loc["longitude"]), float(loc["latitude"]))
+    return locations
+
+
+def _latest(payload: Optional[dict]) -> Tuple[Optional[str], Dict[str, float]]:
+    if payload is None:
+        return None, {}
+    latest = payload["data"]["readings"][0]
+    return latest["timestamp"], {d["stationId"]: float(d["value"]) for d in latest["data"]}
+
+
+class FeelsLikeGrid:
+    """
+    Apparent temperature over a park's grid.
+
+    Grids and weights are kept per park; weights depend only on the station set,
+    so they are rebuilt only when stations appear or move. Each new reading is
+    then three matrix-vector products and the Steadman formula on arrays; the
+    serialised result is cached per park and reading timestamp.
+    """
+
+    def __init__(self):
+        self._grids: LRUCache = LRUCache(maxsize=32)       # park slug -> ParkGrid
+        self._weights: LRUCache = LRUCache(maxsize=32)     # park slug -> (station key, IDWWeights)
+        self._bodies: LRUCache = LRUCache(maxsize=64)
+
+    def grid(self, park: ParkInfo) -> ParkGrid:
+        grid = self._grids.get(park.slug)
+        if grid is None:
+            grid = self._grids[park.slug] = ParkGrid(get_park_registry().boundary(park), settings.feels_like_grid_m)
+        return grid
+
+    def _weights_for(self, park: ParkInfo, locations: Dict[str, Tuple[float, float]], grid: ParkGrid) -> IDWWeights:
+        key = tuple(sorted(locations.items()))
+        cached = self._weights.get(park.slug)
+        if cached is None or cached[0] != key:
+            ids = tuple(sid for sid, _ in key)
+            lonlat = np.array([loc for _, loc in key]).reshape(-1, 2)
+            x, y = to_svy21(lonlat[:, 0], lonlat[:, 1])
+            cached = self._weights[park.slug] = (key, IDWWeights(ids, np.column_stack([x, y]), grid))
+        return cached[1]
+
+    def render(self, park: ParkInfo, air: dict, rh: Optional[dict], wind: Optional[dict]) -> Optional[bytes]:
+        """GeoJSON point grid as bytes, or None when the park has no cell or there is no station."""
+        ts_air, t_map = _latest(air)
+        ts_rh, rh_map = _latest(rh)
+        ts_w, w_map = _latest(wind)
+        cache_key = (park.slug, ts_air, ts_rh, ts_w)
+        body = self._bodies.get(cache_key)
+        if body is not None:
+            return body
+
+        grid = self.grid(park)
+        locations = _station_locations(air, rh or {}, wind or {})
+        if not len(grid) or not locations:
+            return None
+        weights = self._weights_for(park, locations, grid)
+
+        t_c = weights.interpolate(t_map)
+        humidity = weights.interpolate(rh_map)
+        wind_ms = weights.interpolate(w_map)
+        at = apparent_temperature_c(t_c, humidity, wind_ms)
+
+        def rounded(a):
+            return [None if np.isnan(v) else round(float(v), 1) for v in a]
+
+        features = [{
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, 6), round(lat, 6)]},
+            "properties": {"value": v, "airTemperature": t, "relativeHumidity": h, "windSpeed": w},
+        } for (lon, lat), v, t, h, w in zip(grid.lonlat.tolist(), rounded(at), rounded(t_c),
+                                            rounded(humidity), rounded(wind_ms))]
+        valid = at[~np.isnan(at)]
+        body = orjson.dumps({
+            "type": "FeatureCollection",
+            "park": park.slug,
+            "timestamp": max(ts for ts in cache_key[1:] if ts is not None),
+            "spacing_m": grid.spacing_m,
+            "stations": len(weights.station_ids),
+            "method": "Steadman Apparent Temperature, inverse-distance weighted",
+            "readingUnit": "deg c",
+            "min": round(float(valid.min()), 1) if len(valid) else None,
+            "max": round(float(valid.max()), 1) if len(valid) else None,
+            "features": features,
+        })
+        self._bodies[cache_key] = body
+        return body
+
+
+feels_like_grid = FeelsLikeGrid()
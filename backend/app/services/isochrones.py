@@ -0,0 +1,370 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import asyncio
+import hashlib
+import os
+
+import numpy as np
+import orjson
+import shapely
+from cachetools import LRUCache
+from fastapi import HTTPException
+from scipy import ndimage
+from scipy.sparse.csgraph import dijkstra
+from shapely.geometry import mapping
+
+from ..config.settings import settings
+from .carpark_service import CarparkSnapshot, carpark_service
+from .facility_store import FacilityStore, facility_store
+from .park_registry import get_park_registry
+from .walk_graph import PROFILES, WalkGraph, get_walk_graph, to_svy21, to_wgs84
+
+try:  # advisory file locks coordinate gunicorn workers; unavailable on Windows
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _to_wgs84_coords(coords: np.ndarray) -> np.ndarray:
+    lon, lat = to_wgs84(coords[:, 0], coords[:, 1])
+    return np.round(np.column_stack([lon, lat]), 6)   # ~0.1 m, well under the raster cell
+
+
+def budget_m(minutes: float) -> float:
+    """Walking metres (search cost) in a number of minutes."""
+    return minutes * 60 * settings.walking_speed_mps
+
+
+def corridor_polygon(starts: np.ndarray, ends: np.ndarray, cell_m: float, buffer_m: float):
+    """
+    Area within buffer_m of a set of SVY21 segments, on a cell_m raster: sample the
+    segments into cells, dilate by a disk, then union one box per run of cells in
+    each row. Buffering thousands of segments directly in GEOS takes seconds; this
+    takes milliseconds, at the price of cell_m-sized steps on the outline.
+    """
+    length = np.hypot(*(ends - starts).T)
+    n = np.ceil(length / (cell_m / 2)).astype(np.int64) + 1          # samples per segment
+    seg = np.repeat(np.arange(len(length)), n)
+    t = (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)) / np.repeat(np.maximum(n - 1, 1), n)
+    points = starts[seg] + (ends - starts)[seg] * t[:, None]
+
+    r = int(np.ceil(buffer_m / cell_m))
+    lo = points.min(axis=0) - (r + 1) * cell_m
+    ij = ((points - lo) // cell_m).astype(np.int64)
+    nx, ny = ij.max(axis=0) + r + 2
+    grid = np.zeros((ny, nx), dtype=bool)
+    grid[ij[:, 1], ij[:, 0]] = True
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    grid = ndimage.binary_dilation(grid, structure=dx ** 2 + dy ** 2 <= (buffer_m / cell_m) ** 2)
+
+    edges = np.diff(np.pad(grid, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, first = np.nonzero(edges == 1)
+    _, stop = np.nonzero(edges == -1)
+    boxes = shapely.box(lo[0] + first * cell_m, lo[1] + rows * cell_m, lo[0] + stop * cell_m, lo[1] + (rows + 1) * cell_m)
+    return shapely.simplify(shapely.union_all(boxes), cell_m / 2)
+
+
+class IsochroneIndex:
+    """
+    Walking isochrones on one WalkGraph.
+
+    An isochrone is a bounded Dijkstra from the origin's nearest graph node (scipy,
+    stopped at the largest requested budget, so several bands cost one search). Each
+    edge is kept as far along as the budget reaches from either end, and the kept
+    segments are widened by isochrone_buffer_m into the polygon. With the sheltered
+    profile, exposed metres count rain_penalty times, so the polygon shrinks towards
+    covered linkways.
+
+    Polygons depend only on (node, minutes, profile), so requests snapping to the
+    same node share them. Those for the nodes of MRT exits, carparks and facilities
+    are precomputed for isochrone_minutes and saved to isochrone_cache_path; the rest
+    are computed on demand and kept in an LRU. Precompute runs only when the set of
+    origin nodes changes, and a lock file lets one worker build while the others wait
+    and adopt its file.
+    """
+
+    def __init__(self, graph: WalkGraph):
+        self.graph = graph
+        self._csr = {profile: graph.csr(profile) for profile in PROFILES}
+
+        # Each undirected edge once: CSR entries with u < v.
+        src = np.repeat(np.arange(graph.node_count), np.diff(graph.indptr))
+        once = src < graph.indices
+        self.u = src[once]
+        self.v = graph.indices[once].astype(np.int64)
+        self.cost = {profile: graph.weights(profile)[once] for profile in PROFILES}
+
+        self.fingerprint = hashlib.sha1(orjson.dumps([
+            graph.fingerprint(), settings.walking_speed_mps, settings.isochrone_buffer_m,
+            settings.isochrone_cell_m,
+        ])).hexdigest()
+        self.precomputed: Dict[str, bytes] = {}      # "node:minutes:profile" -> serialised feature
+        self.origins: Dict[int, List[str]] = {}      # node -> origins labelled "kind:id"
+        self._computed: LRUCache = LRUCache(maxsize=settings.isochrone_cache_size)
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False                          # origins changed while _task was running
+        self.hits = 0
+        self.misses = 0
+
+    # --- geometry ---
+    def _reach(self, node: int, profile: str, max_budget: float) -> np.ndarray:
+        return dijkstra(self._csr[profile], directed=False, indices=node, limit=max_budget)
+
+    def _feature(self, dist: np.ndarray, node: int, minutes: float, profile: str) -> bytes:
+        budget = budget_m(minutes)
+        cost = self.cost[profile]
+        du, dv = dist[self.u], dist[self.v]
+        with np.errstate(invalid="ignore"):
+            from_u = np.clip(np.nan_to_num((budget - du) / cost, neginf=0.0), 0.0, 1.0)
+            from_v = np.clip(np.nan_to_num((budget - dv) / cost, neginf=0.0), 0.0, 1.0)
+        full = from_u + from_v >= 1.0
+        a, b = self.graph.xy[self.u], self.graph.xy[self.v]
+
+        head = ~full & (from_u > 0)
+        tail = ~full & (from_v > 0)
+        starts = np.vstack([a[full], a[head], b[tail]])
+        ends = np.vstack([b[full], a[head] + (b[head] - a[head]) * from_u[head, None],
+                          b[tail] + (a[tail] - b[tail]) * from_v[tail, None]])
+        if not len(starts):   # budget too small to leave the origin node
+            starts = ends = self.graph.xy[[node]]
+        area = corridor_polygon(starts, ends, settings.isochrone_cell_m, settings.isochrone_buffer_m)
+
+        geometry = mapping(shapely.transform(area, _to_wgs84_coords))
+        return orjson.dumps({
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {
+                "minutes": minutes,
+                "budget_meters": round(budget, 1),
+                "profile": profile,
+                "area_m2": round(float(shapely.area(area))),
+                "reachable_nodes": int(np.count_nonzero(dist <= budget)),
+            },
+        })
+
+    def compute(self, node: int, minutes: Sequence[float], profile: str) -> Dict[float, bytes]:
+        dist = self._reach(node, profile, budget_m(max(minutes)))
+        return {m: self._feature(dist, node, m, profile) for m in minutes}
+
+    # --- lookups ---
+    @staticmethod
+    def _key(node: int, minutes: float, profile: str) -> str:
+        return f"{node}:{minutes:g}:{profile}"
+
+    def lookup(self, node: int, minutes: float, profile: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """(feature, "precomputed" / "cached") or (None, None)."""
+        key = self._key(node, minutes, profile)
+        feature = self.precomputed.get(key)
+        if feature is not None:
+            return feature, "precomputed"
+        feature = self._computed.get(key)
+        if feature is not None:
+            return feature, "cached"
+        return None, None
+
+    def store(self, node: int, features: Dict[float, bytes], profile: str) -> None:
+        for minutes, feature in features.items():
+            self._computed[self._key(node, minutes, profile)] = feature
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "precomputed": len(self.precomputed),
+            "precomputed_origins": sum(len(v) for v in self.origins.values()),
+            "precomputed_nodes": len(self.origins),
+            "cached": self._computed.currsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    # --- precomputed origins ---
+    def _origin_nodes(self, labels: List[str], xy: np.ndarray) -> Dict[int, List[str]]:
+        if not len(xy):
+            return {}
+        nodes, gaps = self.graph.snap_xy(xy[:, 0], xy[:, 1])
+        out: Dict[int, List[str]] = {}
+        for label, node, gap in zip(labels, nodes.tolist(), gaps.tolist()):
+            if gap <= settings.max_snap_m:
+                out.setdefault(node, []).append(label)
+        return out
+
+    def common_origins(self) -> Dict[int, List[str]]:
+        """Graph nodes of every MRT exit, current carpark and facility."""
+        labels: List[str] = []
+        lonlat: List[Tuple[float, float]] = []
+        for e in get_park_registry().exits:
+            labels.append(f"mrt:{e['name']}")
+            lonlat.append((e["lon"], e["lat"]))
+        snapshot = carpark_service.snapshot
+        if snapshot is not None:
+            labels += [f"carpark:{cid}" for cid in snapshot.ids.tolist()]
+            lonlat += list(zip(snapshot.lon.tolist(), snapshot.lat.tolist()))
+        xy = np.empty((0, 2))
+        if lonlat:
+            lon, lat = np.array(lonlat).T
+            xy = np.column_stack(to_svy21(lon, lat))
+        if len(facility_store.xy):
+            labels += [f"facility:{oid}" for oid in facility_store.objectids.tolist()]
+            xy = np.vstack([xy, facility_store.xy])
+        return self._origin_nodes(labels, xy)
+
+    def _load_sync(self, path: str) -> Dict[str, bytes]:
+        try:
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+        if data.get("fingerprint") != self.fingerprint:
+            return {}
+        return {key: orjson.dumps(feature) for key, feature in data["features"].items()}
+
+    def _save_sync(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        body = b'{"fingerprint":' + orjson.dumps(self.fingerprint) + b',"features":{' + b",".join(
+            orjson.dumps(key) + b":" + feature for key, feature in self.precomputed.items()) + b"}}"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+
+    def _precompute_sync(self, origins: Dict[int, List[str]]) -> int:
+        """
+        Make self.precomputed cover exactly the origin nodes: adopt what's on disk,
+        build what's missing, drop nodes that are no longer origins. Returns how many
+        features were built.
+        """
+        path = settings.isochrone_cache_path
+        lock = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            lock = open(f"{path}.lock", "a+")
+            fcntl.flock(lock, fcntl.LOCK_EX)   # another worker may be building; its file is read below
+        try:
+            on_disk = self._load_sync(path)
+            precomputed = {key: feature for key, feature in {**on_disk, **self.precomputed}.items()
+                           if int(key.split(":", 1)[0]) in origins}
+            minutes = sorted(settings.isochrone_minutes)
+            built = 0
+            for node in origins:
+                for profile in PROFILES:
+                    missing = [m for m in minutes if self._key(node, m, profile) not in precomputed]
+                    if missing:
+                        for m, feature in self.compute(node, missing, profile).items():
+                            precomputed[self._key(node, m, profile)] = feature
+                        built += len(missing)
+            self.precomputed = precomputed
+            self.origins = origins
+            if precomputed.keys() != on_disk.keys():
+                self._save_sync(path)
+            return built
+        finally:
+            if lock is not None:
+                lock.close()   # also releases the flock
+
+    async def _precompute(self, origins: Dict[int, List[str]]) -> None:
+        while True:
+            self._dirty = False
+            try:
+                built = await asyncio.to_thread(self._precompute_sync, origins)
+                if built:
+                    print(f"Isochrones: {built} precomputed for {len(self.origins)} origin nodes -> "
+                          f"{settings.isochrone_cache_path}")
+            except Exception as e:
+                print(f"Warning: isochrone precompute failed ({e})")
+                return
+            if not self._dirty:
+                return
+            # Origins changed during the run; go again if they still differ from what was built.
+            origins = self.common_origins()
+            if origins.keys() == self.origins.keys():
+                self.origins = origins
+                return
+
+    def schedule_precompute(self) -> None:
+        """
+        Precompute in the background when the origin nodes have changed. A run already
+        in progress is marked dirty instead, and re-runs with the latest origins when it ends.
+        """
+        if self._task is not None and not self._task.done():
+            self._dirty = True
+            return
+        origins = self.common_origins()
+        if origins.keys() == self.origins.keys():
+            self.origins = origins      # same nodes; only the labels may differ
+            return
+        self._task = asyncio.create_task(self._precompute(origins))
+
+
+_index: Optional[IsochroneIndex] = None
+
+
+def get_isochrone_index() -> Optional[IsochroneIndex]:
+    """The index for the current walk graph, rebuilt if the graph was reloaded."""
+    global _index
+    graph = get_walk_graph()
+    if graph is None:
+        return None
+    if _index is None or _index.graph is not graph:
+        _index = IsochroneIndex(graph)
+    return _index
+
+
+async def walking_isochrone(start: Tuple[float, float], minutes: Iterable[float], prefer_shelter: bool) -> bytes:
+    """
+    Isochrone polygons, one per minutes band (largest first, so smaller bands draw
+    on top), as GeoJSON FeatureCollection bytes. Served from the precomputed or LRU
+    cache when the origin snaps to a node already done; cached features are spliced
+    in as stored, without re-serialising.
+    """
+    index = get_isochrone_index()
+    if index is None:
+        raise HTTPException(503, "Walk graph unavailable")
+    node, gap = index.graph.snap(*start)
+    if gap > settings.max_snap_m:
+        raise HTTPException(404, "Origin is too far from the walking network.")
+    profile = "sheltered" if prefer_shelter else "fastest"
+
+    bands = sorted(set(minutes), reverse=True)
+    features: Dict[float, bytes] = {}
+    sources = set()
+    for m in bands:
+        feature, source = index.lookup(node, m, profile)
+        if feature is not None:
+            features[m] = feature
+            sources.add(source)
+    missing = [m for m in bands if m not in features]
+    if missing:
+        index.misses += 1
+        computed = await asyncio.to_thread(index.compute, node, missing, profile)
+        index.store(node, computed, profile)
+        features.update(computed)
+        sources.add("computed")
+    else:
+        index.hits += 1
+
+    lon, lat = index.graph.lonlat[node].tolist()
+    rest = orjson.dumps({
+        "origin": {"lat": float(start[0]), "lon": float(start[1])},
+        "snapped_origin": {"lat": lat, "lon": lon, "snap_distance_meters": round(gap, 1)},
+        "origin_labels": index.origins.get(node, []),
+        "profile": profile,
+        "source": sorted(sources),
+    })
+    return (b'{"type":"FeatureCollection","features":[' + b",".join(features[m] for m in bands)
+            + b"]," + rest[1:])
+
+
+async def _on_facilities_changed(store: FacilityStore) -> None:
+    index = get_isochrone_index()
+    if index is not None:
+        index.schedule_precompute()
+
+
+async def _on_carparks(snapshot: CarparkSnapshot) -> None:
+    index = get_isochrone_index()
+    if index is not None and index.origins:   # the first run happens once facilities load
+        index.schedule_precompute()
+
+
+facility_store.subscribe(_on_facilities_changed)
+carpark_service.subscribe(_on_carparks)
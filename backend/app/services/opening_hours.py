@@ -0,0 +1,128 @@
+from typing import List, Optional, Tuple
+import bisect
+import datetime
+import hashlib
+
+import numpy as np
+import pytz
+
+from .facility_store import FacilityStore, facility_store
+
+MINUTES_PER_DAY = 1440
+SGT = pytz.timezone("Asia/Singapore")
+
+
+def minute_of_day(t: datetime.time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def now_minute() -> int:
+    return minute_of_day(datetime.datetime.now(tz=SGT).time())
+
+
+def daily_intervals(hours_open: Optional[datetime.time], hours_close: Optional[datetime.time]) -> List[Tuple[int, int]]:
+    """
+    Sorted [start, end) minute intervals a facility is open each day.
+    No listed hours (toilets, shelters, ...) or open == close means open all day;
+    close before open means the facility closes after midnight.
+    """
+    if hours_open is None or hours_close is None:
+        return [(0, MINUTES_PER_DAY)]
+    start, end = minute_of_day(hours_open), minute_of_day(hours_close)
+    if start == end:
+        return [(0, MINUTES_PER_DAY)]
+    if start < end:
+        return [(start, end)]
+    return [(0, end), (start, MINUTES_PER_DAY)]
+
+
+class OpeningHoursIndex:
+    """
+    Open/closed state of every facility across the day.
+
+    The day is cut at every minute where any facility opens or closes. Between two
+    cuts nothing changes, so each segment stores one packed bitset of open facilities
+    (bit i = store row i). "Open at T" is a binary search for T's segment plus an unpack.
+    """
+
+    def __init__(self, store: FacilityStore):
+        self.version = store.version
+        self.objectids = store.objectids
+        n = len(store.rows)
+
+        intervals = [daily_intervals(r.hours_open, r.hours_close) for r in store.rows]
+        cuts = {0}
+        for ivs in intervals:
+            for start, end in ivs:
+                cuts.add(start)
+                cuts.add(end % MINUTES_PER_DAY)
+        self.seg_start = sorted(cuts)
+
+        # open_matrix[s, i] - facility i is open throughout segment s
+        starts = np.array(self.seg_start)
+        self.open_matrix = np.zeros((len(starts), n), dtype=bool)
+        for i, ivs in enumerate(intervals):
+            for start, end in ivs:
+                self.open_matrix[(starts >= start) & (starts < end), i] = True
+        self.packed = np.packbits(self.open_matrix, axis=1)
+
+        self._seg_len = np.diff(np.append(starts, MINUTES_PER_DAY))
+
+    def __len__(self) -> int:
+        return len(self.objectids)
+
+    def _segment(self, minute: int) -> int:
+        return bisect.bisect_right(self.seg_start, minute % MINUTES_PER_DAY) - 1
+
+    def open_at(self, minute: int) -> np.ndarray:
+        """Bool mask (store row order) of facilities open at a minute of the day."""
+        return np.unpackbits(self.packed[self._segment(minute)], count=len(self)).astype(bool)
+
+    def minutes_until_close(self, minute: int, rows: np.ndarray) -> np.ndarray:
+        """
+        For the given store rows (assumed open at minute), minutes until each closes.
+        Facilities that never close come back as -1.
+        """
+        seg = self._segment(minute)
+        order = np.roll(np.arange(len(self.seg_start)), -seg)
+        closed = ~self.open_matrix[order][:, rows]                 # segments from now, cyclic
+        # minutes from `minute` to the start of each of those segments
+        offset = np.cumsum(np.concatenate([[0], self._seg_len[order][:-1]]))
+        offset = offset - (minute % MINUTES_PER_DAY - self.seg_start[seg])
+        first_closed = closed.argmax(axis=0)
+        result = offset[first_closed]
+        result[~closed.any(axis=0)] = -1
+        return result
+
+    def closing_within(self, minute: int, window: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows open at minute that close within window minutes, and their minutes left."""
+        rows = np.flatnonzero(self.open_at(minute))
+        left = self.minutes_until_close(minute, rows)
+        soon = (left >= 0) & (left <= window)
+        return rows[soon], left[soon]
+
+    def minute_bitmap(self) -> np.ndarray:
+        """(1440, ceil(n / 8)) uint8: the packed open bitset for every minute of the day."""
+        return np.repeat(self.packed, self._seg_len, axis=0)
+
+    def etag(self) -> str:
+        """Changes whenever minute_bitmap() does: the segment bounds matter as much as the bits."""
+        h = hashlib.sha1(self.packed.tobytes())
+        h.update(np.asarray(self.seg_start, dtype=np.int64).tobytes())
+        h.update(self.objectids.tobytes())
+        return f'W/"{h.hexdigest()}"'
+
+
+_index: Optional[OpeningHoursIndex] = None
+
+
+def get_opening_hours_index() -> Optional[OpeningHoursIndex]:
+    return _index
+
+
+async def _rebuild(store: FacilityStore) -> None:
+    global _index
+    _index = OpeningHoursIndex(store)
+
+
+facility_store.subscribe(_rebuild)
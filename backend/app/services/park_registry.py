@@ -0,0 +1,271 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import json
+import os
+import re
+
+import numpy as np
+import shapely
+from scipy.spatial import cKDTree
+from shapely.geometry import shape
+from sqlalchemy import text
+
+from ..config.settings import settings
+from ..database import AsyncSessionLocal
+from .walk_graph import to_svy21, to_wgs84
+
+
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def _to_svy21_coords(coords: np.ndarray) -> np.ndarray:
+    x, y = to_svy21(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y])
+
+
+def _to_wgs84_coords(coords: np.ndarray) -> np.ndarray:
+    lon, lat = to_wgs84(coords[:, 0], coords[:, 1])
+    return np.column_stack([lon, lat])
+
+
+class ParkInfo(NamedTuple):
+    index: int                 # row in the registry's arrays and STRtree
+    slug: str
+    name: str                  # NParks NAME, e.g. "PASIR RIS PK"
+    lat: float                 # a point guaranteed to be inside the park
+    lon: float
+    area_m2: float
+
+    def as_dict(self) -> dict:
+        return {"slug": self.slug, "name": self.name, "lat": self.lat, "lon": self.lon,
+                "area_m2": round(self.area_m2)}
+
+
+class NearestTable:
+    """The nearest of a set of labelled points (stations, PSI regions, forecast areas) to every park."""
+
+    def __init__(self, locations: Dict[str, Tuple[float, float]], park_xy: np.ndarray, source: dict):
+        self.source = source                      # payload the table was built from
+        self.labels = list(locations)
+        lonlat = np.array([locations[k] for k in self.labels], dtype=np.float64).reshape(-1, 2)
+        self.distance_m, self.nearest = cKDTree(_to_svy21_coords(lonlat)).query(park_xy)
+
+    def for_park(self, park: ParkInfo) -> Tuple[str, float]:
+        return self.labels[self.nearest[park.index]], float(self.distance_m[park.index])
+
+
+def _weather_locations(dataset: str, payload: dict) -> Dict[str, Tuple[float, float]]:
+    """{station id / PSI region / lower-cased forecast area: (lon, lat)} from a payload's metadata."""
+    data = payload.get("data") or {}
+    if dataset == "psi":
+        items = [(m.get("name"), m.get("labelLocation")) for m in data.get("regionMetadata") or []
+                 if m.get("name") != "national"]
+    elif dataset == "two-hr-forecast":
+        items = [((m.get("name") or "").lower(), m.get("label_location") or m.get("labelLocation"))
+                 for m in data.get("area_metadata") or data.get("areaMetadata") or []]
+    else:
+        items = [(s.get("stationId") or s.get("id") or s.get("deviceId"), s.get("location"))
+                 for s in data.get("stations") or []]
+    locations = {}
+    for label, loc in items:
+        if label and loc and loc.get("latitude") is not None and loc.get("longitude") is not None:
+            locations[label] = (float(loc["longitude"]), float(loc["latitude"]))
+    return locations
+
+
+def load_mrt_exits(path: str) -> List[dict]:
+    """Exits from LTA's MRT station exit GeoJSON (STATION_NA / EXIT_CODE); none when it isn't deployed."""
+    if not os.path.exists(path):
+        print(f"Warning: MRT exits GeoJSON {path} not found; no park will list MRT exits")
+        return []
+    with open(path) as f:
+        collection = json.load(f)
+    exits = []
+    for feature in collection.get("features", []):
+        props = feature.get("properties") or {}
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "Point" or not props.get("STATION_NA"):
+            continue
+        lon, lat = geometry["coordinates"][:2]
+        station = props["STATION_NA"].title()
+        code = str(props.get("EXIT_CODE") or "").replace("Exit", "").strip()
+        exits.append({"exit": code, "name": f"{station} Exit {code}".strip(), "lat": lat, "lon": lon,
+                      "description": station})
+    if not exits:
+        print(f"Warning: no MRT exits read from {path}")
+    return exits
+
+
+class ParkRegistry:
+    """
+    Every park, indexed for per-request lookups.
+
+    Boundaries come from the NParks parks GeoJSON, plus a circle of
+    park_point_radius_m around any `parks` table row it doesn't cover. An
+    STRtree over the SVY21 polygons resolves a coordinate to its park, and
+    per-park tables (MRT exits, carpark rows per snapshot, nearest weather
+    station / PSI region / forecast area per payload) are built once per data
+    change, so a request only indexes into arrays.
+    """
+
+    def __init__(self, named_geometries: List[Tuple[str, object]], exits: List[dict]):
+        names = [name for name, _ in named_geometries]
+        self.svy21 = shapely.transform(np.array([g for _, g in named_geometries], dtype=object), _to_svy21_coords)
+        self.tree = shapely.STRtree(self.svy21)
+        inside = shapely.point_on_surface(self.svy21)
+        self.xy = shapely.get_coordinates(inside).reshape(-1, 2)
+        lon, lat = to_wgs84(self.xy[:, 0], self.xy[:, 1])
+        areas = shapely.area(self.svy21)
+
+        self.parks: List[ParkInfo] = []
+        self.by_key: Dict[str, ParkInfo] = {}
+        for i, name in enumerate(names):
+            slug = base = slugify(name)
+            n = 2
+            while slug in self.by_key:     # a few NAMEs repeat
+                slug, n = f"{base}-{n}", n + 1
+            park = ParkInfo(i, slug, name, float(lat[i]), float(lon[i]), float(areas[i]))
+            self.parks.append(park)
+            self.by_key[slug] = park
+            self.by_key.setdefault(name.upper(), park)
+
+        self.exits = exits
+        self._exits_by_park = self._group(
+            self._within(np.array([[e["lon"], e["lat"]] for e in exits]).reshape(-1, 2), settings.mrt_radius_m))
+        self._weather: Dict[str, NearestTable] = {}
+        self._carparks: Optional[Tuple[object, List[np.ndarray]]] = None
+
+    def __len__(self) -> int:
+        return len(self.parks)
+
+    # --- spatial queries ---
+    def _within(self, lonlat: np.ndarray, distance_m: float) -> np.ndarray:
+        """(2, M) pairs [point index, park index] with the point within distance_m of the park."""
+        if not len(lonlat) or not len(self):
+            return np.empty((2, 0), dtype=np.int64)
+        x, y = to_svy21(lonlat[:, 0], lonlat[:, 1])
+        return self.tree.query(shapely.points(x, y), predicate="dwithin", distance=distance_m)
+
+    def _group(self, pairs: np.ndarray) -> List[np.ndarray]:
+        """Per park, the point indices paired with it."""
+        order = np.argsort(pairs[1], kind="stable")
+        points, parks = pairs[0][order], pairs[1][order]
+        bounds = np.searchsorted(parks, np.arange(len(self) + 1))
+        return [points[bounds[i]:bounds[i + 1]] for i in range(len(self))]
+
+    def near_any(self, lat: np.ndarray, lon: np.ndarray, distance_m: float) -> np.ndarray:
+        """Mask of the points within distance_m of some park."""
+        mask = np.zeros(len(lat), dtype=bool)
+        mask[self._within(np.column_stack([lon, lat]), distance_m)[0]] = True
+        return mask
+
+    def resolve(self, lat: float, lon: float) -> Optional[ParkInfo]:
+        """The park containing (lat, lon) (the smallest, if nested), else the nearest within park_resolve_m."""
+        if not len(self):
+            return None
+        point = shapely.points(*to_svy21(lon, lat))
+        hits = self.tree.query(point, predicate="intersects")
+        if len(hits):
+            return self.parks[min(hits.tolist(), key=lambda i: self.parks[i].area_m2)]
+        nearest = self.tree.query_nearest(point, max_distance=settings.park_resolve_m)
+        return self.parks[int(nearest[0])] if len(nearest) else None
+
+    def locate_xy(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Vectorised resolve() of SVY21 points: the park index of each, or -1."""
+        out = np.full(len(x), -1, dtype=np.int64)
+        if not len(x) or not len(self):
+            return out
+        points = shapely.points(x, y)
+        pt, park = self.tree.query(points, predicate="intersects")
+        # Smallest containing park first, so it wins when parks are nested.
+        order = np.lexsort((shapely.area(self.svy21)[park], pt))
+        first = np.r_[True, pt[order][1:] != pt[order][:-1]]
+        out[pt[order][first]] = park[order][first]
+        rest = np.flatnonzero(out < 0)
+        if len(rest):
+            pt, park = self.tree.query_nearest(points[rest], max_distance=settings.park_resolve_m, all_matches=False)
+            out[rest[pt]] = park
+        return out
+
+    def get(self, key: str) -> Optional[ParkInfo]:
+        """A park by slug or NParks NAME."""
+        return self.by_key.get(key) or self.by_key.get(key.upper())
+
+    def default(self) -> Optional[ParkInfo]:
+        return self.get(settings.park_name)
+
+    def boundary(self, park: ParkInfo):
+        """The park's polygon in WGS84."""
+        return shapely.transform(self.svy21[park.index], _to_wgs84_coords)
+
+    # --- lookup tables ---
+    def mrt_exits(self, park: ParkInfo) -> List[dict]:
+        return [self.exits[i] for i in self._exits_by_park[park.index].tolist()]
+
+    def carpark_rows(self, park: ParkInfo, snapshot) -> np.ndarray:
+        """Rows of a CarparkSnapshot within carpark_radius_m of the park; grouped once per snapshot."""
+        cached = self._carparks
+        if cached is None or cached[0] is not snapshot:
+            pairs = self._within(np.column_stack([snapshot.lon, snapshot.lat]), settings.carpark_radius_m)
+            cached = self._carparks = (snapshot, self._group(pairs))
+        return cached[1][park.index]
+
+    def nearest(self, dataset: str, payload: dict, park: ParkInfo) -> Optional[str]:
+        """The park's station / PSI region / forecast area in a weather payload; rebuilt per payload."""
+        table = self._weather.get(dataset)
+        if table is None or table.source is not payload:
+            locations = _weather_locations(dataset, payload)
+            if not locations:
+                return None
+            table = self._weather[dataset] = NearestTable(locations, self.xy, payload)
+        return table.for_park(park)[0]
+
+
+def _load_park_polygons(path: str) -> List[Tuple[str, object]]:
+    if not os.path.exists(path):
+        print(f"Warning: parks GeoJSON {path} not found; only the parks table will be registered")
+        return []
+    with open(path) as f:
+        collection = json.load(f)
+    parks = []
+    for feature in collection.get("features", []):
+        name = (feature.get("properties") or {}).get("NAME")
+        if name and feature.get("geometry"):
+            parks.append((name, shape(feature["geometry"])))
+    return parks
+
+
+_registry: Optional[ParkRegistry] = None
+
+
+def get_park_registry() -> ParkRegistry:
+    """The registry; built from the GeoJSON alone until load_park_registry() adds the parks table."""
+    global _registry
+    if _registry is None:
+        _registry = ParkRegistry(_load_park_polygons(settings.parks_geojson_path),
+                                 load_mrt_exits(settings.mrt_exits_path))
+    return _registry
+
+
+async def load_park_registry() -> ParkRegistry:
+    """Rebuild the registry with the `parks` table rows the GeoJSON doesn't already cover."""
+    global _registry
+    polygons = _load_park_polygons(settings.parks_geojson_path)
+    try:
+        async with AsyncSessionLocal() as db:
+            res = await db.execute(text("""
+                SELECT name, ST_X(geom), ST_Y(geom) FROM parks WHERE geom IS NOT NULL ORDER BY objectid;
+            """))
+            rows = res.all()
+        covered = {name.upper() for name, _ in polygons}
+        for name, lon, lat in rows:
+            if name and name.upper() not in covered:
+                x, y = to_svy21(lon, lat)
+                circle = shapely.transform(shapely.Point(x, y).buffer(settings.park_point_radius_m), _to_wgs84_coords)
+                polygons.append((name, circle))
+                covered.add(name.upper())
+    except Exception as e:
+        print(f"Warning: could not read the parks table ({e}). Registering GeoJSON parks only.")
+    _registry = ParkRegistry(polygons, load_mrt_exits(settings.mrt_exits_path))
+    print(f"Park registry ready: {len(_registry)} parks, {len(_registry.exits)} MRT exits")
+    return _registry
@@ -1,10 +1,21 @@
-from typing import Tuple, List
+from typing import Tuple, List, Optional
+import asyncio
 from fastapi import HTTPException
 from sqlalchemy import text
 from shapely.geometry import LineString, mapping, Point, Polygon, MultiPoint, MultiLineString, MultiPolygon
 from geoalchemy2.shape import to_shape
 from geoalchemy2.types import Geometry 
+from ..config.settings import settings
 from ..database import AsyncSessionLocal
+from .walk_graph import get_walk_graph, WalkGraph, to_svy21
+from .facility_routes import get_facility_route_index, FacilityRouteIndex, _tree_lengths
+from .upstream import get_upstream
+from .facility_index import get_facility_index
+from .facility_store import FacilityStore, facility_store
+from .shelter_coverage import get_shelter_coverage
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from cachetools import TTLCache
 import httpx 
 import json 
 import os 
@@ -13,6 +24,8 @@ from geoalchemy2.elements import WKBElement
 
 load_dotenv()
 
+MAPBOX_MATRIX_MAX_COORDS = 25   # Mapbox Matrix API limit for the walking profile
+
 def _to_xy(geom):
     """Return (x, y) for any shapely geometry; None if unusable."""
     if geom is None:
@@ -55,10 +68,250 @@ def _to_xy(geom):
 
 
 
+
+
+class RouteCache:
+    """
+    LRU + TTL cache of route responses. Endpoints are keyed on the facility they
+    sit on, or else on a settings.route_cache_grid_m grid cell in SVY21, so
+    people starting from the same MRT exit or carpark share one entry.
+    """
+
+    def __init__(self, maxsize: int, ttl_s: float, grid_m: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl_s)
+        self.grid_m = grid_m
+        self.hits = 0
+        self.misses = 0
+
+    def _endpoint_key(self, lat: float, lon: float) -> tuple:
+        index = get_facility_route_index()
+        if index is not None:
+            i = index.match(lat, lon)
+            if i is not None:
+                return ("facility", int(index.objectids[i]))
+        x, y = to_svy21(lon, lat)
+        return ("cell", int(x // self.grid_m), int(y // self.grid_m))
+
+    def key(self, start: Tuple[float, float], end: Tuple[float, float], prefer_shelter: bool) -> tuple:
+        return (self._endpoint_key(*start), self._endpoint_key(*end), prefer_shelter)
+
+    def get(self, key: tuple) -> Optional[dict]:
+        route = self._cache.get(key)
+        if route is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return route
+
+    def put(self, key: tuple, route: dict) -> None:
+        self._cache[key] = route
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": self._cache.currsize,
+            "maxsize": self._cache.maxsize,
+            "ttl_seconds": self._cache.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+route_cache = RouteCache(settings.route_cache_size, settings.route_cache_ttl_s, settings.route_cache_grid_m)
+
+
+async def _clear_route_cache(store: FacilityStore) -> None:
+    # Facility endpoints and amenities are baked into cached routes.
+    route_cache.clear()
+
+
+facility_store.subscribe(_clear_route_cache)
+
+
+async def _amenities_along_route(route_line: LineString, buffer_m: int = 300) -> List[dict]:
+    """Shelters and toilets within buffer_m metres of a WGS84 route line."""
+    index = get_facility_index()
+    if index is not None:
+        return index.along_route(np.asarray(route_line.coords), buffer_m)
+
+    # Index not built yet (e.g. facility load failed at startup): ask PostGIS.
+    found = []
+    async with AsyncSessionLocal() as db:
+        amenity_sql = text(f"""
+            SELECT objectid, class, name_right AS name, ST_AsEWKB(geom) AS geom_wkb
+            FROM park_facilities
+            WHERE class IN ('SHELTER', 'TOILET')
+            AND ST_DWithin(
+                ST_Transform(geom, 3414),
+                ST_Transform(ST_SetSRID(ST_GeomFromText(:route_wkt_4326), 4326), 3414),
+                {buffer_m}
+            );
+        """)
+
+        amenity_results = await db.execute(amenity_sql, {"route_wkt_4326": route_line.wkt})
+
+        for row in amenity_results.mappings().all():
+            facility_geom = to_shape(WKBElement(row["geom_wkb"]))
+            xy = _to_xy(facility_geom)
+            if not xy or xy[0] is None or xy[1] is None:
+                continue
+            lon, lat = xy
+            found.append({
+                "objectid": row["objectid"],
+                "class": row["class"],
+                "name": row["name"],
+                "lat": lat,
+                "lon": lon
+            })
+    return found
+
+
+def _route_response(route_coords: List[List[float]], distance_m: float, duration_s: float,
+                    amenities: List[dict], engine: str) -> dict:
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": mapping(LineString(route_coords)),
+            "properties": {
+                "total_distance_meters": distance_m,
+                "total_duration_seconds": duration_s,
+                "segments":  len(route_coords) - 1,
+                "engine": engine,
+            }
+        }],
+        "amenities_along_route": amenities
+    }
+
+
+def _facility_route(
+    graph: WalkGraph,
+    index: FacilityRouteIndex,
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    prefer_shelter: bool
+) -> Optional[Tuple[List[List[float]], float]]:
+    """Lookup in the precomputed table when both endpoints are known facilities."""
+    i = index.match(*start)
+    j = index.match(*end) if i is not None else None
+    if j is None:
+        return None
+    profile = "sheltered" if prefer_shelter else "fastest"
+    path = index.path(i, j, profile)
+    if path is None:
+        return None
+    coords = [[start[1], start[0]]] + graph.lonlat[path].tolist() + [[end[1], end[0]]]
+    return coords, index.distance(i, j, profile)
+
+
+def _local_route(
+    graph: WalkGraph,
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    prefer_shelter: bool
+) -> Optional[Tuple[List[List[float]], float]]:
+    """
+    Route on the in-process walk graph. Returns (lon/lat coords, metres), or None when
+    either endpoint is too far from the path network or the two are not connected.
+    """
+    src, src_gap = graph.snap(*start)
+    dst, dst_gap = graph.snap(*end)
+    if src_gap > settings.max_snap_m or dst_gap > settings.max_snap_m:
+        return None
+
+    path = graph.shortest_path(src, dst, "sheltered" if prefer_shelter else "fastest")
+    if path is None:
+        return None
+
+    # Walk from the exact start point onto the network and off it again at the end.
+    coords = [[start[1], start[0]]] + graph.lonlat[path].tolist() + [[end[1], end[0]]]
+    distance_m = src_gap + graph.path_length(path) + dst_gap
+    return coords, distance_m
+
+
+def _graph_route(
+    graph: WalkGraph,
+    index: Optional[FacilityRouteIndex],
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    prefer_shelter: bool
+) -> Optional[Tuple[List[List[float]], float]]:
+    """The precomputed facility route if there is one, else a search; run in a worker thread."""
+    local = _facility_route(graph, index, start, end, prefer_shelter) if index is not None else None
+    if local is None:
+        local = _local_route(graph, start, end, prefer_shelter)
+    return local
+
+
 async def shortest_path(
     start: Tuple[float, float], # (lat, lon)
     end: Tuple[float, float],   # (lat, lon)
     prefer_shelter: bool = False 
+) -> dict:
+    """
+    Calculates a walking route on the in-process park graph. With prefer_shelter,
+    unsheltered edges cost settings.rain_penalty times their length.
+    Falls back to Mapbox Directions when the graph is unavailable or can't
+    connect the two points (e.g. a start far outside the park).
+    Results are served from route_cache when a nearby request was answered recently.
+    Shelter coverage is scored on every response, cached or not.
+    """
+    key = route_cache.key(start, end, prefer_shelter)
+    route = route_cache.get(key)
+    if route is None:
+        route = await _compute_route(start, end, prefer_shelter)
+        route_cache.put(key, route)
+    return _with_shelter_coverage(route)
+
+
+def _with_shelter_coverage(route: dict) -> dict:
+    """Copy of route with sheltered/exposed metres added; the cached dict is left as is."""
+    coverage = get_shelter_coverage()
+    if coverage is None:
+        return route
+    feature = route["features"][0]
+    metrics = coverage.measure_lonlat(np.asarray(feature["geometry"]["coordinates"], dtype=np.float64))
+    return {
+        **route,
+        "features": [{**feature, "properties": {**feature["properties"], **metrics}}],
+    }
+
+
+async def _compute_route(
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    prefer_shelter: bool
+) -> dict:
+    graph = get_walk_graph()
+    if graph is not None:
+        # The A* loop is pure Python and can take tens of milliseconds; keep it off the event loop.
+        local = await asyncio.to_thread(
+            _graph_route, graph, get_facility_route_index(), start, end, prefer_shelter
+        )
+        if local is not None:
+            coords, distance_m = local
+            amenities = await _amenities_along_route(LineString(coords)) if prefer_shelter else []
+            return _route_response(
+                coords,
+                round(distance_m, 1),
+                round(distance_m / settings.walking_speed_mps, 1),
+                amenities,
+                engine="local",
+            )
+
+    if not settings.mapbox_fallback:
+        raise HTTPException(404, "No walking route found between the given points.")
+    return await _mapbox_shortest_path(start, end, prefer_shelter)
+
+
+async def _mapbox_shortest_path(
+    start: Tuple[float, float], # (lat, lon)
+    end: Tuple[float, float],   # (lat, lon)
+    prefer_shelter: bool = False 
 ) -> dict:
     """
     Calculates a route using the Mapbox Directions API.
@@ -73,150 +326,211 @@ async def shortest_path(
     origin_coords_str      = f"{start[1]},{start[0]}" # lon,lat
     destination_coords_str = f"{end[1]},{end[0]}"     # lon,lat
 
-    # --- Move httpx.AsyncClient initialization to encompass both API calls ---
-    async with httpx.AsyncClient() as client:
-        # --- Step 1: Get the initial shortest route from Mapbox ---
-        initial_mapbox_url = (
-            f"https://api.mapbox.com/directions/v5/mapbox/walking/{origin_coords_str};{destination_coords_str}"
-            f"?alternatives=false&geometries=geojson&steps=false&access_token={mapbox_access_token}"
-        )
+    # --- One pooled Mapbox client serves both API calls ---
+    client = get_upstream("mapbox")
+    # --- Step 1: Get the initial shortest route from Mapbox ---
+    initial_mapbox_url = (
+        f"/directions/v5/mapbox/walking/{origin_coords_str};{destination_coords_str}"
+        f"?alternatives=false&geometries=geojson&steps=false&access_token={mapbox_access_token}"
+    )
 
-        try:
-            response = await client.get(initial_mapbox_url, timeout=10)
-            response.raise_for_status() 
-            initial_directions_data = response.json()
-        except httpx.RequestError as exc:
-            raise HTTPException(500, f"An error occurred while requesting Mapbox Directions: {exc}")
-        except httpx.HTTPStatusError as exc:
-            error_detail = exc.response.json().get("message", "Unknown error from Mapbox")
-            raise HTTPException(exc.response.status_code, f"Mapbox Directions API error: {error_detail}")
-        except json.JSONDecodeError:
-            raise HTTPException(500, "Mapbox Directions API returned invalid JSON.")
-        except Exception as e:
-            raise HTTPException(500, f"An unexpected error occurred during Mapbox API call: {e}")
-
-        if not initial_directions_data or not initial_directions_data.get('routes'):
-            raise HTTPException(404, "No route found by Mapbox for the given points.")
-
-        initial_route_geometry_geojson = initial_directions_data['routes'][0]['geometry']
-        initial_route_coords = initial_route_geometry_geojson['coordinates']
-        
-        try:
-            initial_primary_route_line = LineString(initial_route_coords)
-        except Exception as e:
-            raise HTTPException(500, f"Error creating initial route geometry from Mapbox response: {e}")
+    try:
+        response = await client.get(initial_mapbox_url)
+        response.raise_for_status() 
+        initial_directions_data = response.json()
+    except httpx.RequestError as exc:
+        raise HTTPException(500, f"An error occurred while requesting Mapbox Directions: {exc}")
+    except httpx.HTTPStatusError as exc:
+        error_detail = exc.response.json().get("message", "Unknown error from Mapbox")
+        raise HTTPException(exc.response.status_code, f"Mapbox Directions API error: {error_detail}")
+    except json.JSONDecodeError:
+        raise HTTPException(500, "Mapbox Directions API returned invalid JSON.")
+    except Exception as e:
+        raise HTTPException(500, f"An unexpected error occurred during Mapbox API call: {e}")
+
+    if not initial_directions_data or not initial_directions_data.get('routes'):
+        raise HTTPException(404, "No route found by Mapbox for the given points.")
+
+    initial_route_geometry_geojson = initial_directions_data['routes'][0]['geometry']
+    initial_route_coords = initial_route_geometry_geojson['coordinates']
+    
+    try:
+        initial_primary_route_line = LineString(initial_route_coords)
+    except Exception as e:
+        raise HTTPException(500, f"Error creating initial route geometry from Mapbox response: {e}")
 
-        # Extract initial distance and duration
-        final_route_line = initial_primary_route_line
-        final_distance_meters = initial_directions_data['routes'][0].get('distance', 0)
-        final_duration_seconds = initial_directions_data['routes'][0].get('duration', 0)
-        final_route_coords_to_return = initial_route_coords # Coordinates to be returned
+    # Extract initial distance and duration
+    final_distance_meters = initial_directions_data['routes'][0].get('distance', 0)
+    final_duration_seconds = initial_directions_data['routes'][0].get('duration', 0)
+    final_route_coords_to_return = initial_route_coords # Coordinates to be returned
 
-        found_amenities_along_initial_route = []
+    found_amenities_along_initial_route = []
+    
+    # --- Step 2: If prefer_shelter, identify amenities and potentially re-route ---
+    if prefer_shelter:
+        found_amenities_along_initial_route = await _amenities_along_route(initial_primary_route_line)
         
-        # --- Step 2: If prefer_shelter, identify amenities and potentially re-route ---
-        if prefer_shelter:
-            async with AsyncSessionLocal() as db:
-                buffer_m = 300 # Meters buffer around the initial route line
-                
-                amenity_sql = text(f"""
-                    SELECT objectid, class, name_right AS name, ST_AsEWKB(geom) AS geom_wkb
-                    FROM park_facilities
-                    WHERE class IN ('SHELTER', 'TOILET')
-                    AND ST_DWithin(
-                        ST_Transform(geom, 3414),
-                        ST_Transform(ST_SetSRID(ST_GeomFromText(:route_wkt_4326), 4326), 3414),
-                        {buffer_m}
-                    );
-                """)
-                
-                amenity_results = await db.execute(amenity_sql, {"route_wkt_4326": initial_primary_route_line.wkt})
-                
-
-                for row in amenity_results.mappings().all():
-                    facility_geom = to_shape(WKBElement(row["geom_wkb"]))
-                    print(f"this is facility {facility_geom}")
-                    xy = _to_xy(facility_geom)
-                    print(f"this is xy{xy}")
-                    if not xy or xy[0] is None or xy[1] is None:
-                        pass
-                    print(xy)
-                    lon, lat = xy
-                    # lat, lon = xy
-                    print(f"this is long and lat{lon}, {lat}")
-                    found_amenities_along_initial_route.append({
-                        "objectid": row["objectid"],
-                        "class": row["class"],
-                        "name": row["name"],
-                        "lat": lat,
-                        "lon": lon
-                    })
+        # --- Step 3: If amenities found, attempt to re-route via waypoints ---
+        if found_amenities_along_initial_route:
+            # Select a limited number of amenities as waypoints to avoid Mapbox limits
+            # and excessive route deviation. Let's take up to 3 amenities.
+            # A more sophisticated approach would sort by distance along path, etc. - lets try this one
+            waypoints_to_use = []
+            max_waypoints = 20 # Mapbox free tier typically allows 25 waypoints, but keeping it low for sensible routes
             
-            # --- Step 3: If amenities found, attempt to re-route via waypoints ---
-            if found_amenities_along_initial_route:
-                # Select a limited number of amenities as waypoints to avoid Mapbox limits
-                # and excessive route deviation. Let's take up to 3 amenities.
-                # A more sophisticated approach would sort by distance along path, etc. - lets try this one
-                waypoints_to_use = []
-                max_waypoints = 20 # Mapbox free tier typically allows 25 waypoints, but keeping it low for sensible routes
-                
-                # Simple strategy: Add amenities that are roughly "in the middle" or spread out.
-                # For this iteration, we are only going to pick a few from the found list 
-                # future steps:: might sort them by distance along the path.
-                for i, amenity in enumerate(found_amenities_along_initial_route):
-                    if i < max_waypoints: # Add up to max_waypoints
-                        waypoints_to_use.append(f"{amenity['lon']},{amenity['lat']}") # Mapbox expects lon,lat
-                    else:
-                        break
-
-                # Construct waypoints string for Mapbox URL
-                # Format: {lon},{lat};{lon},{lat};
-                if waypoints_to_use:
-                    # The waypoints go between origin and destination in the URL
-                    waypoint_string = ";".join(waypoints_to_use)
-                    waypointed_mapbox_url = (
-                        f"https://api.mapbox.com/directions/v5/mapbox/walking/"
-                        f"{origin_coords_str};{waypoint_string};{destination_coords_str}"
-                        f"?alternatives=false&geometries=geojson&steps=false&access_token={mapbox_access_token}"
-                    )
-
-                    try:
-                        response_waypointed = await client.get(waypointed_mapbox_url, timeout=10) # <--- This call is now within the 'client' scope
-                        response_waypointed.raise_for_status()
-                        waypointed_directions_data = response_waypointed.json()
-
-                        if waypointed_directions_data and waypointed_directions_data.get('routes'):
-                            waypointed_route_geometry_geojson = waypointed_directions_data['routes'][0]['geometry']
-                            waypointed_route_coords = waypointed_route_geometry_geojson['coordinates']
-                            
-                            # Update the final route details to the waypointed route
-                            final_route_line = LineString(waypointed_route_coords)
-                            final_distance_meters = waypointed_directions_data['routes'][0].get('distance', 0)
-                            final_duration_seconds = waypointed_directions_data['routes'][0].get('duration', 0)
-                            final_route_coords_to_return = waypointed_route_coords
-                            # The amenities returned will be those along the *initial* path,
-                            # but the route itself now passes through some of them.
-                            
-                    except httpx.RequestError as exc:
-                        print(f"Warning: Mapbox Waypoint Directions API request failed: {exc}. Falling back to shortest route.")
-                    except httpx.HTTPStatusError as exc:
-                        error_detail = exc.response.json().get("message", "Unknown error from Mapbox")
-                        print(f"Warning: Mapbox Waypoint Directions API error: {error_detail}. Falling back to shortest route.")
-                    except Exception as e:
-                        print(f"Warning: Unexpected error with Mapbox Waypoint Directions: {e}. Falling back to shortest route.")
+            # Simple strategy: Add amenities that are roughly "in the middle" or spread out.
+            # For this iteration, we are only going to pick a few from the found list 
+            # future steps:: might sort them by distance along the path.
+            for i, amenity in enumerate(found_amenities_along_initial_route):
+                if i < max_waypoints: # Add up to max_waypoints
+                    waypoints_to_use.append(f"{amenity['lon']},{amenity['lat']}") # Mapbox expects lon,lat
+                else:
+                    break
+
+            # Construct waypoints string for Mapbox URL
+            # Format: {lon},{lat};{lon},{lat};
+            if waypoints_to_use:
+                # The waypoints go between origin and destination in the URL
+                waypoint_string = ";".join(waypoints_to_use)
+                waypointed_mapbox_url = (
+                    f"/directions/v5/mapbox/walking/"
+                    f"{origin_coords_str};{waypoint_string};{destination_coords_str}"
+                    f"?alternatives=false&geometries=geojson&steps=false&access_token={mapbox_access_token}"
+                )
+
+                try:
+                    response_waypointed = await client.get(waypointed_mapbox_url)
+                    response_waypointed.raise_for_status()
+                    waypointed_directions_data = response_waypointed.json()
+
+                    if waypointed_directions_data and waypointed_directions_data.get('routes'):
+                        waypointed_route_geometry_geojson = waypointed_directions_data['routes'][0]['geometry']
+                        waypointed_route_coords = waypointed_route_geometry_geojson['coordinates']
+                        
+                        # Update the final route details to the waypointed route
+                        final_distance_meters = waypointed_directions_data['routes'][0].get('distance', 0)
+                        final_duration_seconds = waypointed_directions_data['routes'][0].get('duration', 0)
+                        final_route_coords_to_return = waypointed_route_coords
+                        # The amenities returned will be those along the *initial* path,
+                        # but the route itself now passes through some of them.
+                        
+                except httpx.RequestError as exc:
+                    print(f"Warning: Mapbox Waypoint Directions API request failed: {exc}. Falling back to shortest route.")
+                except httpx.HTTPStatusError as exc:
+                    error_detail = exc.response.json().get("message", "Unknown error from Mapbox")
+                    print(f"Warning: Mapbox Waypoint Directions API error: {error_detail}. Falling back to shortest route.")
+                except Exception as e:
+                    print(f"Warning: Unexpected error with Mapbox Waypoint Directions: {e}. Falling back to shortest route.")
 
     # --- Step 4: Return the chosen route GeoJSON and the identified amenities ---
+    # The amenities are those identified locally (from initial path)
+    return _route_response(
+        final_route_coords_to_return,
+        final_distance_meters,
+        final_duration_seconds,
+        found_amenities_along_initial_route,
+        engine="mapbox",
+    )
+
+
+def _graph_matrix(graph: WalkGraph, profile: str, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    (len(sources), len(targets)) metres between graph nodes from one bulk Dijkstra;
+    inf where unreachable. Run in a worker thread.
+    """
+    cost, pred = dijkstra(graph.csr(profile), directed=False, indices=sources, return_predecessors=True)
+    if profile == "fastest":
+        return cost[:, targets]
+    # Measure real metres along the tree, not the (penalised) search cost.
+    metres = np.stack([_tree_lengths(graph.xy, row)[targets] for row in pred])
+    return np.where(np.isinf(cost[:, targets]), np.inf, metres)
+
+
+async def walking_matrix(
+    origins: List[Tuple[float, float]],       # [(lat, lon), ...]
+    destinations: List[Tuple[float, float]],  # [(lat, lon), ...]
+    prefer_shelter: bool = False
+) -> dict:
+    """
+    Walking distances and durations from every origin to every destination, in input
+    order. All origins share one bulk Dijkstra on the walk graph; pairs the graph
+    can't answer are filled from a single Mapbox Matrix call when allowed.
+    """
+    m, n = len(origins), len(destinations)
+    distances: List[List[Optional[float]]] = [[None] * n for _ in range(m)]
+    engine = "local"
+
+    graph = get_walk_graph()
+    if graph is not None:
+        profile = "sheltered" if prefer_shelter else "fastest"
+        pts = np.asarray(origins + destinations, dtype=np.float64)
+        x, y = to_svy21(pts[:, 1], pts[:, 0])
+        nodes, gaps = graph.snap_xy(x, y)
+        on_graph = gaps <= settings.max_snap_m
+        src = np.flatnonzero(on_graph[:m])
+        dst = np.flatnonzero(on_graph[m:])
+
+        if len(src) and len(dst):
+            sources, src_row = np.unique(nodes[src], return_inverse=True)
+            metres = await asyncio.to_thread(_graph_matrix, graph, profile, sources, nodes[m + dst])
+            total = gaps[src][:, None] + metres[src_row] + gaps[m + dst][None, :]
+            for a, i in enumerate(src.tolist()):
+                for b, j in enumerate(dst.tolist()):
+                    if np.isfinite(total[a, b]):
+                        distances[i][j] = round(float(total[a, b]), 1)
+
+    durations = [[None if d is None else round(d / settings.walking_speed_mps, 1) for d in row]
+                 for row in distances]
+
+    missing = any(d is None for row in distances for d in row)
+    if missing and settings.mapbox_fallback and m + n <= MAPBOX_MATRIX_MAX_COORDS:
+        try:
+            mb_distances, mb_durations = await _mapbox_matrix(origins, destinations)
+            for i in range(m):
+                for j in range(n):
+                    if distances[i][j] is None:
+                        distances[i][j] = mb_distances[i][j]
+                        durations[i][j] = mb_durations[i][j]
+            engine = "mapbox" if graph is None else "local+mapbox"
+        except HTTPException as e:
+            print(f"Warning: Mapbox Matrix fallback failed: {e.detail}")
+
     return {
-        "type": "FeatureCollection",
-        "features": [{
-            "type": "Feature",
-            "geometry": mapping(final_route_line), 
-            "properties": {
-                "total_distance_meters": final_distance_meters,
-                "total_duration_seconds": final_duration_seconds,
-                "segments":  len(final_route_coords_to_return) - 1,
-            }
-        }],
-        "amenities_along_route": found_amenities_along_initial_route # Amenities identified locally (from initial path)
+        "origins": [{"lat": lat, "lon": lon} for lat, lon in origins],
+        "destinations": [{"lat": lat, "lon": lon} for lat, lon in destinations],
+        "prefer_shelter": prefer_shelter,
+        "distances_meters": distances,
+        "durations_seconds": durations,
+        "engine": engine,
     }
 
+
+async def _mapbox_matrix(
+    origins: List[Tuple[float, float]],
+    destinations: List[Tuple[float, float]]
+) -> Tuple[List[List[Optional[float]]], List[List[Optional[float]]]]:
+    """One Mapbox Matrix API call covering every origin/destination pair."""
+    mapbox_access_token = os.getenv("MAPBOX_ACCESS_TOKEN")
+    if not mapbox_access_token:
+        raise HTTPException(500, "Mapbox Access Token not set.")
+
+    m, n = len(origins), len(destinations)
+    coords = ";".join(f"{lon},{lat}" for lat, lon in origins + destinations)
+    url = (
+        f"/directions-matrix/v1/mapbox/walking/{coords}"
+        f"?sources={';'.join(str(i) for i in range(m))}"
+        f"&destinations={';'.join(str(m + j) for j in range(n))}"
+        f"&annotations=distance,duration&access_token={mapbox_access_token}"
+    )
+    try:
+        response = await get_upstream("mapbox").get(url)
+        response.raise_for_status()
+        data = response.json()
+    except httpx.RequestError as exc:
+        raise HTTPException(502, f"An error occurred while requesting Mapbox Matrix: {exc}")
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(exc.response.status_code, "Mapbox Matrix API error")
+
+    if data.get("code") != "Ok":
+        raise HTTPException(502, f"Mapbox Matrix API error: {data.get('message', data.get('code'))}")
+    return data["distances"], data["durations"]
@@ -0,0 +1,77 @@
+from typing import List, Optional
+import hashlib
+
+import numpy as np
+import shapely
+from sqlalchemy import text
+
+from ..database import AsyncSessionLocal
+from .walk_graph import SHELTER_TOLERANCE_M, to_svy21
+
+
+class ShelterCoverage:
+    """
+    Union of every covered linkway (SVY21), prepared for fast predicate tests.
+
+    Sheltered metres are the length of each route segment inside the cover. Segments
+    wholly inside or outside are settled by the prepared predicates; only those
+    crossing an outline (long Mapbox segments, mostly) are clipped against it.
+    """
+
+    def __init__(self, linkway_wkbs: List[bytes]):
+        linkways = shapely.from_wkb(linkway_wkbs) if linkway_wkbs else np.empty(0, dtype=object)
+        self.linkway_count = len(linkways)
+        self.version = hashlib.sha1(b"".join(linkway_wkbs)).hexdigest()
+        self.cover = shapely.buffer(shapely.union_all(linkways), SHELTER_TOLERANCE_M)
+        shapely.prepare(self.cover)
+
+    def measure(self, xy: np.ndarray) -> dict:
+        """Coverage metrics for a route given as (n, 2) SVY21 vertices."""
+        if len(xy) < 2:
+            return {"sheltered_meters": 0.0, "exposed_meters": 0.0, "sheltered_ratio": None,
+                    "segment_sheltered": []}
+        seg = np.diff(xy, axis=0)
+        seg_len = np.hypot(seg[:, 0], seg[:, 1])
+        segs = shapely.linestrings(np.stack([xy[:-1], xy[1:]], axis=1))
+        inside = shapely.contains(self.cover, segs)
+        covered = np.where(inside, seg_len, 0.0)
+        crossing = ~inside & shapely.intersects(self.cover, segs)
+        if crossing.any():
+            covered[crossing] = shapely.length(shapely.intersection(segs[crossing], self.cover))
+        # Per segment, sheltered means more than half of it is under cover.
+        flags = covered > seg_len / 2
+        total = float(seg_len.sum())
+        sheltered = float(covered.sum())
+        return {
+            "sheltered_meters": round(sheltered, 1),
+            "exposed_meters": round(total - sheltered, 1),
+            "sheltered_ratio": round(sheltered / total, 3) if total > 0 else None,
+            "segment_sheltered": flags.tolist(),
+        }
+
+    def measure_lonlat(self, lonlat: np.ndarray) -> dict:
+        x, y = to_svy21(lonlat[:, 0], lonlat[:, 1])
+        return self.measure(np.column_stack([x, y]))
+
+
+_coverage: Optional[ShelterCoverage] = None
+
+
+def get_shelter_coverage() -> Optional[ShelterCoverage]:
+    return _coverage
+
+
+async def load_shelter_coverage() -> Optional[ShelterCoverage]:
+    global _coverage
+    try:
+        async with AsyncSessionLocal() as db:
+            res = await db.execute(text("""
+                SELECT ST_AsBinary(geom) FROM covered_linkways WHERE geom IS NOT NULL ORDER BY objectid;
+            """))
+            wkbs = [bytes(r[0]) for r in res.all()]
+        _coverage = ShelterCoverage(wkbs)
+        print(f"Shelter coverage ready: {_coverage.linkway_count} covered linkways")
+    except Exception as e:
+        print(f"Warning: could not load covered linkways ({e}). Routes will not report shelter coverage.")
+        _coverage = None
+    return _coverage
@@ -0,0 +1,89 @@
+from typing import Dict, NamedTuple, Optional
+import asyncio
+import importlib.util
+
+import httpx
+
+from ..config.settings import settings
+
+
+class UpstreamConfig(NamedTuple):
+    base_url: str
+    timeout_s: float         # per-request timeout
+    max_connections: int     # pooled sockets kept towards this host
+    max_concurrency: int     # in-flight requests allowed at once; the rest queue
+
+
+# One pooled client per upstream host. Routers refer to these by name.
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "mapbox":  UpstreamConfig("https://api.mapbox.com", timeout_s=10, max_connections=20, max_concurrency=16),
+    "lta":     UpstreamConfig("https://datamall2.mytransport.sg", timeout_s=10, max_connections=10, max_concurrency=8),
+    "datagov": UpstreamConfig("https://api-open.data.gov.sg", timeout_s=5, max_connections=20, max_concurrency=12),
+}
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class Upstream:
+    """A keep-alive connection pool to one host plus a concurrency cap."""
+
+    def __init__(self, name: str, config: UpstreamConfig, http2: bool):
+        self.name = name
+        self.config = config
+        self.client = httpx.AsyncClient(
+            base_url=config.base_url,
+            timeout=httpx.Timeout(config.timeout_s),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_connections,
+                keepalive_expiry=settings.upstream_keepalive_s,
+            ),
+            http2=http2,
+        )
+        self._slots = asyncio.Semaphore(config.max_concurrency)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        async with self._slots:
+            return await self.client.get(url, **kwargs)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class UpstreamClients:
+    """Registry of Upstream pools, opened and closed with the app lifespan."""
+
+    def __init__(self):
+        self._pools: Dict[str, Upstream] = {}
+        self._http2: Optional[bool] = None
+
+    def _use_http2(self) -> bool:
+        if self._http2 is None:
+            self._http2 = settings.upstream_http2 and _http2_available()
+            if settings.upstream_http2 and not self._http2:
+                print("Warning: UPSTREAM_HTTP2 is set but the 'h2' package is missing; using HTTP/1.1")
+        return self._http2
+
+    def start(self) -> None:
+        for name in UPSTREAMS:
+            self.get(name)
+
+    def get(self, name: str) -> Upstream:
+        # Created lazily as well, so code running outside the app lifespan (scripts) still works.
+        pool = self._pools.get(name)
+        if pool is None:
+            pool = self._pools[name] = Upstream(name, UPSTREAMS[name], self._use_http2())
+        return pool
+
+    async def close(self) -> None:
+        pools, self._pools = list(self._pools.values()), {}
+        await asyncio.gather(*(p.aclose() for p in pools), return_exceptions=True)
+
+
+upstreams = UpstreamClients()
+
+
+def get_upstream(name: str) -> Upstream:
+    return upstreams.get(name)
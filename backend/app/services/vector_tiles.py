@@ -0,0 +1,292 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+import asyncio
+import math
+import os
+
+from cachetools import LRUCache
+from sqlalchemy import text
+
+from ..config.settings import settings
+from ..database import AsyncSessionLocal
+from .facility_store import FacilityStore, facility_store
+from .shelter_coverage import get_shelter_coverage
+
+EXTENT = 4096
+BUFFER = 64
+WORLD_M = 40075016.68557849   # width of the web mercator world in metres
+
+
+class TileLayer(NamedTuple):
+    table: str
+    srid: int                 # native SRID of the table's geom, so the bbox filter can use its GiST index
+    min_zoom: int
+    max_zoom: int
+    # (min zoom, SQL attribute list) - the last entry whose zoom <= z wins
+    attributes: Tuple[Tuple[int, str], ...]
+    simplify: bool            # simplify polygons to ~1 screen pixel for the zoom
+
+
+LAYERS: Dict[str, TileLayer] = {
+    "facilities": TileLayer(
+        table="park_facilities", srid=4326, min_zoom=12, max_zoom=20,
+        attributes=(
+            (12, "t.objectid, t.class"),
+            (15, "t.objectid, t.class, t.name_left, t.facility_type"),
+            (17, "t.objectid, t.class, t.name_left, t.facility_type, t.additional_info, "
+                 "to_char(t.hours_open, 'HH24:MI') AS hours_open, "
+                 "to_char(t.hours_close, 'HH24:MI') AS hours_close, t.rating::float8 AS rating"),
+        ),
+        simplify=False,
+    ),
+    "covered_linkways": TileLayer(
+        table="covered_linkways", srid=3414, min_zoom=14, max_zoom=20,
+        attributes=((14, "t.objectid"),),
+        simplify=True,
+    ),
+}
+
+
+def _attributes_for(layer: TileLayer, z: int) -> str:
+    chosen = layer.attributes[0][1]
+    for min_zoom, attrs in layer.attributes:
+        if z >= min_zoom:
+            chosen = attrs
+    return chosen
+
+
+def _tile_sql(name: str, layer: TileLayer, z: int) -> str:
+    geom = "ST_Transform(t.geom, 3857)"
+    if layer.simplify:
+        # one pixel of a 256px tile at this zoom, in mercator metres
+        tolerance = WORLD_M / (256 * 2 ** z)
+        geom = f"ST_SimplifyPreserveTopology({geom}, {tolerance:.4f})"
+    return f"""
+        WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS env),
+        mvtgeom AS (
+            SELECT ST_AsMVTGeom({geom}, bounds.env, {EXTENT}, {BUFFER}, true) AS geom,
+                   {_attributes_for(layer, z)}
+            FROM {layer.table} t, bounds
+            WHERE t.geom && ST_Transform(bounds.env, {layer.srid})
+        )
+        SELECT ST_AsMVT(mvtgeom.*, '{name}', {EXTENT}, 'geom') FROM mvtgeom WHERE geom IS NOT NULL;
+    """
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_r = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_r)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_covering(bbox: Tuple[float, float, float, float], z: int) -> Iterator[Tuple[int, int]]:
+    """(x, y) of every tile at zoom z touching a lon/lat bbox (min_lon, min_lat, max_lon, max_lat)."""
+    x0, y1 = lonlat_to_tile(bbox[0], bbox[1], z)
+    x1, y0 = lonlat_to_tile(bbox[2], bbox[3], z)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+class TileCache:
+    """
+    Two-level MVT cache. Keys carry the data version of the layer, so a facility or
+    linkway change simply stops hitting the old entries (and old directories on disk).
+    prune() deletes those old directories and keeps the rest under max_bytes.
+    """
+
+    def __init__(self, directory: str, max_tiles: int, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.written = 0          # bytes written to disk since the last prune
+        self._memory: LRUCache = LRUCache(maxsize=max_tiles)
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _path(self, version: str, layer: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.directory, version[:16], layer, str(z), str(x), f"{y}.mvt")
+
+    def get(self, version: str, layer: str, z: int, x: int, y: int) -> Optional[bytes]:
+        key = (version, layer, z, x, y)
+        tile = self._memory.get(key)
+        if tile is not None:
+            self.hits_memory += 1
+            return tile
+        path = self._path(version, layer, z, x, y)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                tile = f.read()
+            self._memory[key] = tile
+            self.hits_disk += 1
+            return tile
+        self.misses += 1
+        return None
+
+    def put(self, version: str, layer: str, z: int, x: int, y: int, tile: bytes) -> None:
+        self._memory[(version, layer, z, x, y)] = tile
+        path = self._path(version, layer, z, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(tile)
+            os.replace(tmp, path)
+            self.written += len(tile)
+        except OSError as e:
+            print(f"Warning: could not write tile cache file {path}: {e}")
+
+    def prune(self, versions: List[str]) -> int:
+        """
+        Delete version directories not in versions, then the oldest tiles until the
+        cache is under 90% of max_bytes. Other workers may prune at the same time, so
+        files vanishing underneath are fine. Returns how many files were removed.
+        """
+        self.written = 0
+        if not os.path.isdir(self.directory):
+            return 0
+        keep = {v[:16] for v in versions}
+        removed = 0
+        files = []
+        for entry in os.listdir(self.directory):
+            root = os.path.join(self.directory, entry)
+            for dirpath, _, names in os.walk(root, topdown=False):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        if entry in keep:
+                            st = os.stat(path)
+                            files.append((st.st_mtime, st.st_size, path))
+                        else:
+                            os.remove(path)
+                            removed += 1
+                    except OSError:
+                        pass
+                if entry not in keep:
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "memory_tiles": self._memory.currsize,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+        }
+
+
+tile_cache = TileCache(settings.tile_cache_dir, settings.tile_cache_size, int(settings.tile_cache_max_mb * 1e6))
+
+
+def layer_version(name: str) -> str:
+    if name == "facilities":
+        return facility_store.version or "unversioned"
+    coverage = get_shelter_coverage()
+    return coverage.version if coverage is not None else "unversioned"
+
+
+async def render_tile(name: str, z: int, x: int, y: int, db=None) -> bytes:
+    """MVT bytes for one tile, from cache or PostGIS. Empty bytes when nothing is there."""
+    layer = LAYERS[name]
+    if z < layer.min_zoom or z > layer.max_zoom:
+        return b""
+    version = layer_version(name)
+    tile = tile_cache.get(version, name, z, x, y)
+    if tile is not None:
+        return tile
+
+    params = {"z": z, "x": x, "y": y}
+    if db is None:
+        async with AsyncSessionLocal() as session:
+            tile = (await session.execute(text(_tile_sql(name, layer, z)), params)).scalar()
+    else:
+        tile = (await db.execute(text(_tile_sql(name, layer, z)), params)).scalar()
+    tile = bytes(tile or b"")
+    tile_cache.put(version, name, z, x, y, tile)
+    if tile_cache.written > tile_cache.max_bytes // 10:
+        schedule_prune()
+    return tile
+
+
+_prune_task: Optional[asyncio.Task] = None
+
+
+async def _prune() -> None:
+    try:
+        removed = await asyncio.to_thread(tile_cache.prune, [layer_version(name) for name in LAYERS])
+        if removed:
+            print(f"Tile cache pruned: {removed} files removed")
+    except Exception as e:
+        print(f"Warning: tile cache pruning failed: {e}")
+
+
+def schedule_prune() -> None:
+    """Prune the disk cache in the background; a run already in progress is left to finish."""
+    global _prune_task
+    if _prune_task is None or _prune_task.done():
+        _prune_task = asyncio.create_task(_prune())
+
+
+async def seed_tiles(bbox: Tuple[float, float, float, float], zooms: List[int]) -> int:
+    """Render every tile over bbox at the given zooms so first visitors hit the cache."""
+    rendered = 0
+    async with AsyncSessionLocal() as db:
+        for name, layer in LAYERS.items():
+            for z in zooms:
+                if z < layer.min_zoom or z > layer.max_zoom:
+                    continue
+                for x, y in tiles_covering(bbox, z):
+                    await render_tile(name, z, x, y, db=db)
+                    rendered += 1
+    return rendered
+
+
+def park_bbox(store: FacilityStore, pad_deg: float = 0.002) -> Optional[Tuple[float, float, float, float]]:
+    if not len(store.lonlat):
+        return None
+    lo = store.lonlat.min(axis=0)
+    hi = store.lonlat.max(axis=0)
+    return (lo[0] - pad_deg, lo[1] - pad_deg, hi[0] + pad_deg, hi[1] + pad_deg)
+
+
+_seed_task: Optional[asyncio.Task] = None
+
+
+async def _seed(bbox: Tuple[float, float, float, float]) -> None:
+    # Tiles of the previous facility version are dead now; clear them before adding more.
+    await _prune()
+    try:
+        n = await seed_tiles(bbox, settings.tile_seed_zooms)
+        print(f"Tile cache seeded: {n} tiles")
+    except Exception as e:
+        print(f"Warning: tile pre-seeding failed: {e}")
+
+
+async def _reseed(store: FacilityStore) -> None:
+    # Runs in the background; a new facility version makes any running seed moot.
+    global _seed_task
+    bbox = park_bbox(store)
+    if bbox is None or not settings.tile_seed_zooms:
+        return
+    if _seed_task is not None and not _seed_task.done():
+        _seed_task.cancel()
+    _seed_task = asyncio.create_task(_seed(bbox))
+
+
+facility_store.subscribe(_reseed)
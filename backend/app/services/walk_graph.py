@@ -0,0 +1,272 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import hashlib
+import heapq
+import math
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from sqlalchemy import text
+
+from ..config.settings import settings
+from ..database import AsyncSessionLocal
+
+# Everything inside the graph is in SVY21 (EPSG:3414) metres; lat/lon only at the edges.
+_to_svy21 = Transformer.from_crs(4326, 3414, always_xy=True)
+_to_wgs84 = Transformer.from_crs(3414, 4326, always_xy=True)
+
+NODE_SNAP_M = 0.05        # vertices closer than this are merged into one node
+SHELTER_TOLERANCE_M = 1.0 # linkway outlines sit on the polygon edge, so grow the cover a little
+
+PROFILES = ("fastest", "sheltered")
+
+
+def to_svy21(lon, lat):
+    """(lon, lat) -> (x, y) in SVY21 metres. Accepts scalars or arrays."""
+    return _to_svy21.transform(lon, lat)
+
+
+def to_wgs84(x, y):
+    """(x, y) in SVY21 metres -> (lon, lat). Accepts scalars or arrays."""
+    return _to_wgs84.transform(x, y)
+
+
+class WalkGraph:
+    """
+    Undirected walking graph stored as CSR arrays.
+
+    Node i sits at xy[i] (SVY21) / lonlat[i]. The neighbours of i are
+    indices[indptr[i]:indptr[i + 1]] with matching entries in length / sheltered.
+    """
+
+    def __init__(self, xy: np.ndarray, edge_u: np.ndarray, edge_v: np.ndarray,
+                 edge_len: np.ndarray, edge_sheltered: np.ndarray, rain_penalty: float):
+        n = len(xy)
+        src = np.concatenate([edge_u, edge_v])
+        dst = np.concatenate([edge_v, edge_u])
+        order = np.argsort(src, kind="stable")
+
+        self.xy = xy
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+        self.indices = dst[order].astype(np.int32)
+        self.length = np.concatenate([edge_len, edge_len])[order]
+        self.sheltered = np.concatenate([edge_sheltered, edge_sheltered])[order]
+        self.rain_penalty = rain_penalty
+
+        lon, lat = to_wgs84(xy[:, 0], xy[:, 1])
+        self.lonlat = np.column_stack([lon, lat])
+
+        # Only snap onto the largest connected component, otherwise a start point
+        # next to an isolated path fragment can never reach anything.
+        adj = coo_matrix((np.ones(len(src)), (src, dst)), shape=(n, n)).tocsr()
+        _, labels = connected_components(adj, directed=False)
+        main = np.flatnonzero(labels == np.bincount(labels).argmax())
+        self._snap_nodes = main
+        self._kdtree = cKDTree(xy[main])
+
+        # Plain-list mirrors for the search loop; indexing numpy scalars one by one is slow.
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._x = xy[:, 0].tolist()
+        self._y = xy[:, 1].tolist()
+        self._weights = {profile: self.weights(profile).tolist() for profile in PROFILES}
+
+    @property
+    def node_count(self) -> int:
+        return len(self.xy)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices) // 2
+
+    def fingerprint(self) -> str:
+        """Stable hash of the graph topology, geometry and cost model."""
+        h = hashlib.sha1()
+        for arr in (self.xy, self.indptr, self.indices, self.length, self.sheltered):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        h.update(repr(self.rain_penalty).encode())
+        return h.hexdigest()
+
+    def weights(self, profile: str) -> np.ndarray:
+        """Per-CSR-entry edge costs for a profile."""
+        if profile == "sheltered":
+            return np.where(self.sheltered, self.length, self.length * self.rain_penalty)
+        return self.length
+
+    def csr(self, profile: str) -> csr_matrix:
+        """The graph as a scipy sparse matrix, for the csgraph bulk searches."""
+        n = self.node_count
+        return csr_matrix((self.weights(profile), self.indices, self.indptr), shape=(n, n))
+
+    def snap_xy(self, x, y) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorised snap of SVY21 points; returns (node ids, distances in metres)."""
+        d, i = self._kdtree.query(np.column_stack([x, y]))
+        return self._snap_nodes[i], d
+
+    def snap(self, lat: float, lon: float) -> Tuple[int, float]:
+        """Nearest routable node to a WGS84 coordinate and the distance to it in metres."""
+        x, y = to_svy21(lon, lat)
+        d, i = self._kdtree.query((x, y))
+        return int(self._snap_nodes[i]), float(d)
+
+    def shortest_path(self, source: int, target: int, profile: str = "fastest") -> Optional[List[int]]:
+        """A* from source to target. Returns the node sequence, or None if unreachable."""
+        if source == target:
+            return [source]
+        weights = self._weights[profile]
+        indptr, indices, xs, ys = self._indptr, self._indices, self._x, self._y
+        tx, ty = xs[target], ys[target]
+
+        # Straight-line distance never overestimates: every weight is >= the edge length.
+        def h(n):
+            return math.hypot(xs[n] - tx, ys[n] - ty)
+
+        best = {source: 0.0}
+        prev = {}
+        heap = [(h(source), 0.0, source)]
+        while heap:
+            _, g, node = heapq.heappop(heap)
+            if node == target:
+                path = [node]
+                while node != source:
+                    node = prev[node]
+                    path.append(node)
+                path.reverse()
+                return path
+            if g > best[node]:
+                continue
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = indices[k]
+                ng = g + weights[k]
+                if ng < best.get(nxt, math.inf):
+                    best[nxt] = ng
+                    prev[nxt] = node
+                    heapq.heappush(heap, (ng + h(nxt), ng, nxt))
+        return None
+
+    def search(self, source: int, profile: str = "fastest", targets: Optional[Iterable[int]] = None,
+               max_cost: Optional[float] = None) -> Dict[int, Tuple[float, float]]:
+        """
+        Plain Dijkstra from source that settles nodes in cost order and stops once every
+        node in targets is settled, or once costs pass max_cost. Returns
+        {node: (cost, metres)} for every settled node; metres is the real walking
+        distance along the cheapest path, which differs from cost on the sheltered profile.
+        """
+        weights, lengths = self._weights[profile], self._weights["fastest"]
+        indptr, indices = self._indptr, self._indices
+        remaining = set(targets) if targets is not None else None
+        settled: Dict[int, Tuple[float, float]] = {}
+        best = {source: 0.0}
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            cost, metres, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if max_cost is not None and cost > max_cost:
+                break
+            settled[node] = (cost, metres)
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = indices[k]
+                if nxt in settled:
+                    continue
+                nc = cost + weights[k]
+                if nc < best.get(nxt, math.inf):
+                    best[nxt] = nc
+                    heapq.heappush(heap, (nc, metres + lengths[k], nxt))
+        return settled
+
+    def path_length(self, path: List[int]) -> float:
+        """Metres along a node sequence."""
+        if len(path) < 2:
+            return 0.0
+        seg = np.diff(self.xy[path], axis=0)
+        return float(np.hypot(seg[:, 0], seg[:, 1]).sum())
+
+
+def build_walk_graph(track_wkbs: List[bytes], linkway_wkbs: List[bytes], rain_penalty: float) -> WalkGraph:
+    """
+    Node the path network together with the covered linkway outlines and turn every
+    resulting segment into an edge. Inputs are WKB in SVY21.
+    """
+    tracks = shapely.from_wkb(track_wkbs) if track_wkbs else np.empty(0, dtype=object)
+    linkways = shapely.from_wkb(linkway_wkbs) if linkway_wkbs else np.empty(0, dtype=object)
+
+    lines = np.concatenate([tracks, shapely.boundary(linkways)])
+    lines = lines[~shapely.is_empty(lines)]
+    if not len(lines):
+        raise ValueError("walk network is empty")
+
+    # union_all nodes the lines at every crossing, so tracks and linkway outlines connect.
+    parts = shapely.get_parts(shapely.union_all(lines))
+    coords, part_idx = shapely.get_coordinates(parts, return_index=True)
+    same_part = part_idx[1:] == part_idx[:-1]
+    a = coords[:-1][same_part]
+    b = coords[1:][same_part]
+
+    keys = np.round(np.vstack([a, b]) / NODE_SNAP_M).astype(np.int64)
+    uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    u, v = inverse[:len(a)], inverse[len(a):]
+    keep = u != v
+    a, b, u, v = a[keep], b[keep], u[keep], v[keep]
+
+    # Overlapping lines (a track under a linkway outline) give duplicate edges; keep one.
+    pair = np.sort(np.column_stack([u, v]), axis=1)
+    _, first = np.unique(pair, axis=0, return_index=True)
+    a, b, u, v = a[first], b[first], u[first], v[first]
+
+    edge_len = np.hypot(b[:, 0] - a[:, 0], b[:, 1] - a[:, 1])
+    mid = (a + b) / 2
+    if len(linkways):
+        cover = shapely.buffer(shapely.union_all(linkways), SHELTER_TOLERANCE_M)
+        shapely.prepare(cover)
+        edge_sheltered = shapely.contains_xy(cover, mid[:, 0], mid[:, 1])
+    else:
+        edge_sheltered = np.zeros(len(a), dtype=bool)
+
+    node_xy = uniq.astype(np.float64) * NODE_SNAP_M
+    return WalkGraph(node_xy, u, v, edge_len, edge_sheltered, rain_penalty)
+
+
+# ----------------------------------------------------------------------------
+# Process-wide graph, built once at startup
+# ----------------------------------------------------------------------------
+_graph: Optional[WalkGraph] = None
+
+
+def get_walk_graph() -> Optional[WalkGraph]:
+    return _graph
+
+
+async def load_walk_graph() -> Optional[WalkGraph]:
+    """Read the path network and covered linkways from PostGIS and build the graph."""
+    global _graph
+    try:
+        async with AsyncSessionLocal() as db:
+            tracks = await db.execute(text(f"""
+                SELECT ST_AsBinary(ST_Transform(geom, 3414)) FROM {settings.walk_network_table}
+                WHERE geom IS NOT NULL;
+            """))
+            linkways = await db.execute(text("""
+                SELECT ST_AsBinary(geom) FROM covered_linkways WHERE geom IS NOT NULL;
+            """))
+            track_wkbs = [bytes(r[0]) for r in tracks.all()]
+            linkway_wkbs = [bytes(r[0]) for r in linkways.all()]
+
+        _graph = await asyncio.to_thread(
+            build_walk_graph, track_wkbs, linkway_wkbs, settings.rain_penalty
+        )
+        print(f"Walk graph ready: {_graph.node_count} nodes, {_graph.edge_count} edges")
+    except Exception as e:
+        print(f"Warning: could not build walk graph ({e}). Routing will use Mapbox.")
+        _graph = None
+    return _graph
@@ -0,0 +1,238 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import datetime
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from ..config.settings import settings
+from .weather_store import WeatherEntry, weather_store
+
+# Series are keyed "<dataset>:<station>". PSI uses the region as station, the 2-hour
+# forecast the (lower-cased) area, with forecast text stored as an integer code.
+STATION_DATASETS = ("air-temperature", "relative-humidity", "wind-speed")
+SERIES_DATASETS = STATION_DATASETS + ("psi", "two-hr-forecast")
+CATEGORICAL = ("two-hr-forecast",)
+
+
+def _epoch(timestamp: str) -> float:
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+def _station_readings(payload: dict) -> Iterator[Tuple[str, float, float]]:
+    for reading in (payload.get("data") or {}).get("readings") or []:
+        ts = _epoch(reading["timestamp"])
+        for d in reading.get("data") or []:
+            if d.get("stationId") is not None and d.get("value") is not None:
+                yield d["stationId"], ts, float(d["value"])
+
+
+def _psi_readings(payload: dict) -> Iterator[Tuple[str, float, float]]:
+    for item in (payload.get("data") or {}).get("items") or []:
+        ts = item.get("timestamp") or item.get("updatedTimestamp")
+        regions = ((item.get("readings") or {}).get("psi_twenty_four_hourly") or {})
+        if ts is None:
+            continue
+        for region, value in regions.items():
+            if value is not None:
+                yield region, _epoch(ts), float(value)
+
+
+def _forecast_readings(payload: dict) -> Iterator[Tuple[str, float, str]]:
+    for item in (payload.get("data") or {}).get("items") or []:
+        ts = item.get("timestamp") or item.get("update_timestamp") or item.get("updatedTimestamp")
+        if ts is None:
+            continue
+        for f in item.get("forecasts") or []:
+            text = f.get("forecast")
+            if isinstance(text, dict):
+                text = text.get("text")
+            if f.get("area") and text:
+                yield f["area"].lower(), _epoch(ts), text
+
+
+class RingBuffer:
+    """Fixed-capacity (timestamp, value) series; the oldest points fall off the end."""
+
+    def __init__(self, capacity: int):
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.head = 0        # next write position
+        self.count = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.ts)
+
+    def last_ts(self) -> float:
+        return float(self.ts[self.head - 1]) if self.count else -np.inf
+
+    def append(self, ts: float, value: float) -> bool:
+        """Append a newer point; older or repeated timestamps are ignored."""
+        if ts <= self.last_ts():
+            return False
+        self.ts[self.head] = ts
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return True
+
+    def since(self, start: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Points at or after start, oldest first."""
+        order = (np.arange(self.count) + self.head - self.count) % self.capacity
+        ts, values = self.ts[order], self.values[order]
+        i = np.searchsorted(ts, start)
+        return ts[i:], values[i:]
+
+
+class WeatherHistory:
+    """
+    Rolling history of every weather series in ring buffers, mirrored to SQLite.
+
+    Fed by the weather snapshot store, so history costs no extra upstream calls.
+    On startup the buffers are refilled from the file, which is pruned to the
+    retention window as it is written.
+    """
+
+    def __init__(self, path: str, hours: float, points_per_hour: int = 60):
+        self.path = path
+        self.retention_s = hours * 3600
+        self.capacity = int(hours * points_per_hour)
+        self.series: Dict[str, RingBuffer] = {}
+        self.codes: Dict[str, int] = {}        # forecast text -> code, assigned by SQLite
+        self.texts: Dict[int, str] = {}        # code -> forecast text
+
+    # --- SQLite mirror ---
+    def _connect(self) -> sqlite3.Connection:
+        # Every gunicorn worker writes the same file: WAL plus a busy timeout lets one
+        # wait for the other instead of failing with "database is locked".
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=10.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS readings "
+                   "(series TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL, PRIMARY KEY (series, ts)) "
+                   "WITHOUT ROWID")
+        db.execute("CREATE TABLE IF NOT EXISTS forecast_codes (code INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)")
+        return db
+
+    def _load_sync(self) -> int:
+        with self._connect() as db:
+            for code, text in db.execute("SELECT code, text FROM forecast_codes"):
+                self.codes[text] = code
+                self.texts[code] = text
+            rows = db.execute("SELECT series, ts, value FROM readings WHERE ts >= ? ORDER BY series, ts",
+                              (time.time() - self.retention_s,)).fetchall()
+        for key, ts, value in rows:
+            self._buffer(key).append(ts, value)
+        return len(rows)
+
+    def _codes_sync(self, texts: List[str]) -> Dict[str, int]:
+        """
+        Codes for forecast texts, letting SQLite number the new ones so every worker
+        sharing the file agrees on them. One transaction: insert, then read back.
+        """
+        with self._connect() as db:
+            db.executemany("INSERT OR IGNORE INTO forecast_codes (text) VALUES (?)", [(t,) for t in texts])
+            return {t: db.execute("SELECT code FROM forecast_codes WHERE text = ?", (t,)).fetchone()[0]
+                    for t in texts}
+
+    def _write_sync(self, rows: List[Tuple[str, float, float]]) -> None:
+        with self._connect() as db:
+            db.executemany("INSERT OR IGNORE INTO readings (series, ts, value) VALUES (?, ?, ?)", rows)
+            db.execute("DELETE FROM readings WHERE ts < ?", (time.time() - self.retention_s,))
+
+    async def load(self) -> None:
+        try:
+            n = await asyncio.to_thread(self._load_sync)
+            print(f"Weather history: {n} readings restored from {self.path}")
+        except Exception as e:
+            print(f"Warning: could not load weather history ({e})")
+
+    # --- ingest ---
+    def _buffer(self, key: str) -> RingBuffer:
+        buf = self.series.get(key)
+        if buf is None:
+            buf = self.series[key] = RingBuffer(self.capacity)
+        return buf
+
+    def ingest(self, dataset: str, payload: dict) -> List[Tuple[str, float, float]]:
+        """
+        Append every new point in a payload; returns the rows to persist. Forecast
+        texts must already have codes (see on_weather).
+        """
+        if dataset in STATION_DATASETS:
+            points = _station_readings(payload)
+        elif dataset == "psi":
+            points = _psi_readings(payload)
+        elif dataset == "two-hr-forecast":
+            points = ((area, ts, self.codes[text]) for area, ts, text in _forecast_readings(payload))
+        else:
+            return []
+        # Payloads can hold a whole day of readings; sort so each buffer sees them in order.
+        rows = []
+        for station, ts, value in sorted(points, key=lambda p: p[1]):
+            key = f"{dataset}:{station}"
+            if self._buffer(key).append(ts, value):
+                rows.append((key, ts, value))
+        return rows
+
+    async def on_weather(self, dataset: str, entry: WeatherEntry) -> None:
+        if dataset in CATEGORICAL:
+            new = sorted({text for _, _, text in _forecast_readings(entry.payload)} - self.codes.keys())
+            if new:
+                for text, code in (await asyncio.to_thread(self._codes_sync, new)).items():
+                    self.codes[text] = code
+                    self.texts[code] = text
+        rows = self.ingest(dataset, entry.payload)
+        if rows:
+            await asyncio.to_thread(self._write_sync, rows)
+
+    # --- queries ---
+    def window(self, dataset: str, station: str, hours: float) -> Tuple[np.ndarray, np.ndarray]:
+        buf = self.series.get(f"{dataset}:{station}")
+        if buf is None:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+        return buf.since(time.time() - hours * 3600)
+
+    def downsample(self, dataset: str, station: str, hours: float, bucket_s: float) -> List[dict]:
+        """Bucketed series: mean per bucket, or the last value for categorical series."""
+        ts, values = self.window(dataset, station, hours)
+        if not len(ts):
+            return []
+        bucket = ((ts - ts[0]) // bucket_s).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        ends = np.r_[starts[1:], len(ts)]
+        out = []
+        if dataset in CATEGORICAL:
+            for s, e in zip(starts.tolist(), ends.tolist()):
+                out.append({"timestamp": ts[e - 1], "value": self.texts[int(values[e - 1])]})
+        else:
+            sums = np.add.reduceat(values.astype(np.float64), starts)
+            means = sums / (ends - starts)
+            for s, e, mean in zip(starts.tolist(), ends.tolist(), means.tolist()):
+                out.append({"timestamp": ts[e - 1], "value": round(mean, 2), "samples": e - s})
+        for point in out:
+            point["timestamp"] = datetime.datetime.fromtimestamp(point["timestamp"], tz=datetime.timezone.utc).isoformat()
+        return out
+
+    def trend(self, dataset: str, station: str, hours: float) -> Optional[dict]:
+        """Least-squares slope per hour over the window, with first/last values."""
+        ts, values = self.window(dataset, station, hours)
+        if dataset in CATEGORICAL or not len(ts):
+            return None
+        result = {
+            "latest": round(float(values[-1]), 2),
+            "change": round(float(values[-1] - values[0]), 2),
+            "samples": len(ts),
+            "slope_per_hour": None,
+        }
+        if len(ts) >= 2 and ts[-1] > ts[0]:
+            slope, _ = np.polyfit((ts - ts[0]) / 3600.0, values.astype(np.float64), 1)
+            result["slope_per_hour"] = round(float(slope), 3)
+        return result
+
+
+weather_history = WeatherHistory(settings.weather_history_path, settings.weather_history_hours)
+weather_store.subscribe(weather_history.on_weather)
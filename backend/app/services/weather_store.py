@@ -0,0 +1,144 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import asyncio
+import datetime
+import time
+
+import pytz
+
+from ..config.settings import settings
+from .upstream import get_upstream
+
+BASE_URL = "/v2/real-time/api"   # relative to the pooled data.gov.sg upstream
+SGT = pytz.timezone("Asia/Singapore")
+
+# data.gov.sg real-time dataset -> seconds between polls, roughly its publishing cadence
+WEATHER_DATASETS: Dict[str, float] = {
+    "two-hr-forecast": 600,           # issued every 30 min
+    "twenty-four-hr-forecast": 1800,  # issued a few times a day
+    "wind-speed": 60,                 # station readings every minute
+    "psi": 900,                       # hourly
+    "air-temperature": 60,            # every minute
+    "relative-humidity": 60,          # every minute
+}
+
+
+def date_str_with_fallback() -> Tuple[str, bool]:
+    """
+    Returns the appropriate date string for API calls.
+    During midnight to 5am, uses previous day's date due to API downtime.
+    Returns tuple: (date_str, is_fallback)
+    """
+    now = datetime.datetime.now(tz=SGT)
+    if 0 <= now.hour < 5:
+        yesterday = now - datetime.timedelta(days=1)
+        return yesterday.strftime("%Y-%m-%d"), True
+    return now.strftime("%Y-%m-%d"), False
+
+
+class WeatherEntry(NamedTuple):
+    payload: dict
+    fetched_at: float          # time.time() of the successful fetch
+    date: str                  # date= the payload was requested with
+    is_fallback: bool          # date is yesterday because of the 12am-5am downtime
+
+    def age_s(self) -> float:
+        return max(0.0, time.time() - self.fetched_at)
+
+
+Listener = Callable[[str, WeatherEntry], Awaitable[None]]
+
+
+class WeatherStore:
+    """
+    Latest payload of every weather dataset, kept fresh by a background poller.
+
+    Endpoints read from here instead of calling data.gov.sg. A failed poll keeps the
+    previous payload (served as stale) rather than erasing it; only a dataset that has
+    never been fetched is fetched on demand, once, however many requests are waiting.
+    Subscribed listeners are awaited with every freshly fetched payload.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, WeatherEntry] = {}
+        self.errors: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {name: asyncio.Lock() for name in WEATHER_DATASETS}
+        self._listeners: List[Listener] = []
+
+    def subscribe(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+
+    async def refresh(self, name: str) -> WeatherEntry:
+        """Fetch one dataset now. On failure the old entry stays and the error is raised."""
+        date_str, is_fallback = date_str_with_fallback()
+        try:
+            res = await asyncio.wait_for(
+                get_upstream("datagov").get(f"{BASE_URL}/{name}", params={"date": date_str}),
+                timeout=settings.weather_call_timeout_s,
+            )
+            res.raise_for_status()
+            entry = WeatherEntry(res.json(), time.time(), date_str, is_fallback)
+        except Exception as e:
+            self.errors[name] = "timed out" if isinstance(e, asyncio.TimeoutError) else (str(e) or type(e).__name__)
+            raise
+        self.entries[name] = entry
+        self.errors.pop(name, None)
+        for listener in self._listeners:
+            try:
+                await listener(name, entry)
+            except Exception as e:
+                print(f"Warning: weather listener {getattr(listener, '__name__', listener)} failed: {e}")
+        return entry
+
+    async def get(self, name: str) -> WeatherEntry:
+        entry = self.entries.get(name)
+        if entry is not None:
+            return entry
+        async with self._locks[name]:
+            entry = self.entries.get(name)   # someone else may have fetched it meanwhile
+            if entry is not None:
+                return entry
+            return await self.refresh(name)
+
+    async def get_many(self, names: Iterable[str]) -> Tuple[Dict[str, WeatherEntry], Dict[str, str]]:
+        """Entries for several datasets at once, plus {name: error} for any unavailable."""
+        names = list(names)
+        results = await asyncio.gather(*(self.get(n) for n in names), return_exceptions=True)
+        entries, errors = {}, {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                errors[name] = self.errors.get(name) or str(result) or type(result).__name__
+            else:
+                entries[name] = result
+        return entries, errors
+
+    def is_stale(self, name: str) -> bool:
+        """True when the last poll failed or the entry is over two poll intervals old."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return True
+        return name in self.errors or entry.age_s() > 2 * WEATHER_DATASETS[name]
+
+    def status(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "data_age_seconds": round(self.entries[name].age_s(), 1) if name in self.entries else None,
+                "poll_interval_seconds": interval,
+                "is_stale": self.is_stale(name),
+                "last_error": self.errors.get(name),
+            }
+            for name, interval in WEATHER_DATASETS.items()
+        }
+
+    async def _poll(self, name: str, interval: float) -> None:
+        while True:
+            try:
+                await self.refresh(name)
+            except Exception as e:
+                print(f"Warning: weather poll for {name} failed, serving stale data: {self.errors.get(name, e)}")
+            await asyncio.sleep(interval)
+
+    def start_polling(self) -> List[asyncio.Task]:
+        return [asyncio.create_task(self._poll(name, interval)) for name, interval in WEATHER_DATASETS.items()]
+
+
+weather_store = WeatherStore()
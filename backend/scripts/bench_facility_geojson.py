@@ -0,0 +1,145 @@
+"""
+Benchmark: facility GeoJSON built in Python (old path) vs assembled by PostGIS.
+
+Loads data/raw/ParkFacilities.geojson (every NParks facility, ~5.4k points) into a
+session-local TEMP TABLE named park_facilities, which shadows the real table for
+this connection only, then times both serialisation paths against it.
+
+    cd backend && python -m scripts.bench_facility_geojson [--runs 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import orjson
+from dotenv import load_dotenv
+from geoalchemy2.elements import WKBElement
+from geoalchemy2.shape import to_shape
+from shapely.geometry import mapping
+from sqlalchemy import text
+
+load_dotenv()
+
+from app.database import AsyncSessionLocal, Base, engine  # noqa: E402
+from app.services.facility_geojson import facility_collection_json  # noqa: E402
+
+DATASET = os.path.join(os.path.dirname(__file__), "..", "..", "data", "raw", "ParkFacilities.geojson")
+
+# Same columns as the pre-change all_facilities query; geometry comes back as WKB.
+OLD_SQL = text("""
+    SELECT objectid, class AS class_name, additional_info, name_left, facility_type, phone,
+           hours_open, hours_close, price_range, price_info, rating, review_count, cuisine,
+           website, activities, service_options, reservation_links, order_links, address,
+           ST_AsEWKB(ST_Transform(geom, 4326)) AS geom
+    FROM park_facilities
+    ORDER BY objectid;
+""")
+
+
+async def old_path(db) -> bytes:
+    rows = (await db.execute(OLD_SQL)).all()
+    features = [{
+        "type": "Feature",
+        "geometry": mapping(to_shape(WKBElement(r.geom))),
+        "properties": {
+            "objectid": r.objectid,
+            "class": r.class_name,
+            "additional_info": r.additional_info,
+            "name_left": r.name_left,
+            "facility_type": r.facility_type,
+            "phone": r.phone,
+            "hours": {
+                "open": r.hours_open.strftime("%H:%M") if r.hours_open else None,
+                "close": r.hours_close.strftime("%H:%M") if r.hours_close else None
+            } if r.hours_open or r.hours_close else None,
+            "price_range": r.price_range,
+            "price_info": r.price_info,
+            "rating": float(r.rating) if r.rating else None,
+            "review_count": r.review_count,
+            "cuisine": r.cuisine,
+            "website": r.website,
+            "activities": r.activities,
+            "service_options": r.service_options,
+            "reservation_links": r.reservation_links,
+            "order_links": r.order_links,
+            "address": r.address
+        }
+    } for r in rows]
+    return orjson.dumps({"type": "FeatureCollection", "features": features})
+
+
+async def new_path(db) -> bytes:
+    return await facility_collection_json(db)
+
+
+async def load_dataset(db) -> int:
+    with open(DATASET) as f:
+        features = json.load(f)["features"]
+    await db.execute(text("CREATE TEMP TABLE park_facilities (LIKE public.park_facilities INCLUDING DEFAULTS);"))
+    await db.execute(
+        text("""
+            INSERT INTO park_facilities (objectid, class, additional_info, uniqueid, name_left, geom)
+            VALUES (:objectid, :class, :info, :uniqueid, :name, ST_SetSRID(ST_MakePoint(:lon, :lat), 4326));
+        """),
+        [{
+            "objectid": f["properties"]["OBJECTID"],
+            "class": f["properties"]["CLASS"],
+            "info": f["properties"]["ADDITIONAL_INFO"],
+            "uniqueid": f["properties"]["UNIQUEID"],
+            "name": f["properties"]["NAME"],
+            "lon": f["geometry"]["coordinates"][0],
+            "lat": f["geometry"]["coordinates"][1],
+        } for f in features],
+    )
+    await db.execute(text("ANALYZE park_facilities;"))
+    return len(features)
+
+
+async def timed(fn, db, runs: int):
+    samples, body = [], b""
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        body = await fn(db)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples, body
+
+
+def report(name: str, samples, body: bytes):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:>8}: median {statistics.median(samples):8.1f} ms   p95 {p95:8.1f} ms   {len(body) / 1024:8.1f} KiB")
+
+
+async def main(runs: int):
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as db:
+        n = await load_dataset(db)
+        print(f"Loaded {n} facilities from {os.path.normpath(DATASET)}; {runs} runs each\n")
+
+        # Warm both paths once so connection setup and plan caching don't skew run 1.
+        await old_path(db)
+        await new_path(db)
+
+        old_samples, old_body = await timed(old_path, db, runs)
+        new_samples, new_body = await timed(new_path, db, runs)
+        report("python", old_samples, old_body)
+        report("postgis", new_samples, new_body)
+        print(f"\nspeed-up (median): {statistics.median(old_samples) / statistics.median(new_samples):.1f}x")
+
+        old_features = orjson.loads(old_body)["features"]
+        new_features = orjson.loads(new_body)["features"]
+        same_props = all(a["properties"] == b["properties"] for a, b in zip(old_features, new_features))
+        print(f"features: {len(old_features)} vs {len(new_features)}, identical properties: {same_props}")
+        await db.rollback()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    asyncio.run(main(parser.parse_args().runs))
@@ -0,0 +1,34 @@
+"""
+Offline precompute of the facility-to-facility route table.
+
+Run from backend/ after loading or changing park data, so that workers find a
+matching index on disk at startup instead of building it themselves:
+
+    python -m scripts.build_route_index
+"""
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.config.settings import settings  # noqa: E402
+from app.services.facility_routes import get_facility_route_index  # noqa: E402
+from app.services.facility_store import facility_store  # noqa: E402
+from app.services.walk_graph import load_walk_graph  # noqa: E402
+
+
+async def main():
+    graph = await load_walk_graph()
+    if graph is None:
+        raise SystemExit("Walk graph could not be built; nothing to index.")
+    # Loading the facilities rebuilds (and saves) the index unless the file on disk matches.
+    await facility_store.refresh(force=True)
+    index = get_facility_route_index()
+    if index is None:
+        raise SystemExit("Facility route index build failed.")
+    print(f"{len(index)} facilities, fingerprint {index.fingerprint[:12]} -> {settings.route_index_path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())